@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Compare the batched background/RMS grid engine with the per-cell loop.
+
+A synthetic noise image with a sprinkling of point-like sources is built,
+and the background & RMS grids are computed with both implementations in
+tkp.sourcefinder.image.ImageData. Timings and the largest differences
+between the resulting grids are printed.
+
+Run as:
+
+  $ python bench_grids.py [--size 4096] [--back-size 32] [--repeat 3]
+"""
+import time
+from optparse import OptionParser
+import numpy
+from tkp.sourcefinder import image
+
+
+def synthetic_image(size, nsources, seed):
+    """Gaussian noise with a background offset and some bright pixels."""
+    rng = numpy.random.RandomState(seed)
+    data = rng.normal(loc=0.01, scale=0.002, size=(size, size))
+    x = rng.randint(0, size, nsources)
+    y = rng.randint(0, size, nsources)
+    data[x, y] += rng.uniform(0.02, 1.0, nsources)
+    return data
+
+
+def time_grids(data, back_size, batched, repeat):
+    """Best time out of repeat runs, and the grids of the last one."""
+    image.BATCHED_GRIDS = batched
+    best = None
+    for i in range(repeat):
+        imagedata = image.ImageData(data, (1.5, 1.5, 0.), None,
+                                    back_size_x=back_size,
+                                    back_size_y=back_size)
+        start = time.time()
+        grids = imagedata.grids
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, grids
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--size", default=4096, type="int",
+                      help="Image size in pixels along each axis")
+    parser.add_option("--back-size", default=32, type="int",
+                      help="Background cell size in pixels")
+    parser.add_option("--sources", default=2000, type="int",
+                      help="Number of bright pixels added to the noise")
+    parser.add_option("--repeat", default=3, type="int",
+                      help="Number of timing runs; the best is reported")
+    parser.add_option("--seed", default=0, type="int", help="Random seed")
+    options, args = parser.parse_args()
+
+    data = synthetic_image(options.size, options.sources, options.seed)
+    batched = image.BATCHED_GRIDS
+    try:
+        loop_time, loop_grids = time_grids(data, options.back_size, False,
+                                           options.repeat)
+        batch_time, batch_grids = time_grids(data, options.back_size, True,
+                                             options.repeat)
+    finally:
+        image.BATCHED_GRIDS = batched
+
+    cells = loop_grids['rms'].size
+    print "%dx%d image, %d cells of %dx%d pixels" % (
+        options.size, options.size, cells, options.back_size, options.back_size)
+    print "per-cell loop: %8.3f s" % loop_time
+    print "batched:       %8.3f s (%.1fx)" % (batch_time, loop_time / batch_time)
+    for name in ('rms', 'bg'):
+        same_mask = (numpy.ma.getmaskarray(loop_grids[name]) ==
+                     numpy.ma.getmaskarray(batch_grids[name])).all()
+        maxdiff = numpy.ma.max(abs(loop_grids[name] - batch_grids[name]))
+        print "%-3s grid: masks identical: %s, max. abs. difference: %g" % (
+            name, same_mask, maxdiff)
+
+
+if __name__ == '__main__':
+    main()
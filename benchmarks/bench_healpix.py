@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Compare the declination zone and HEALPix pixel indexes for cone searches.
+
+A synthetic catalogue of sources uniformly distributed over the whole sky is
+indexed both ways: sorted on zone (the floor of the declination), as the
+runningcatalog_zone index orders it, and sorted on the nested HEALPix pixel,
+as runningcatalog_hpx does. For cones at a range of declinations and radii,
+the number of index entries which a range scan reads before the exact
+distance check is counted for both, with the time taken to find them. The
+zone scan reads the whole declination strip; the pixel scan reads the ranges
+returned by tkp.utility.healpix.disc_ranges().
+
+Run as:
+
+  $ python bench_healpix.py [--sources 2000000] [--cones 20]
+"""
+import math
+import time
+from optparse import OptionParser
+import numpy
+from tkp.utility import healpix
+
+
+def all_sky(number, seed):
+    """Unit vectors and declinations of sources uniform over the sky."""
+    rng = numpy.random.RandomState(seed)
+    z = rng.uniform(-1, 1, number)
+    ra = rng.uniform(0, 2 * math.pi, number)
+    s = numpy.sqrt(1 - z * z)
+    return s * numpy.cos(ra), s * numpy.sin(ra), z
+
+
+def zone_scan(zones, decl, radius):
+    """Index entries read by the zone range of a cone."""
+    first = numpy.searchsorted(zones, math.floor(decl - radius), 'left')
+    last = numpy.searchsorted(zones, math.floor(decl + radius), 'right')
+    return last - first
+
+
+def pixel_scan(pixels, x, y, z, radius):
+    """Index entries read by the pixel ranges of a cone."""
+    ranges = healpix.disc_ranges(x, y, z, radius)
+    first = numpy.searchsorted(pixels, ranges[:, 0], 'left')
+    last = numpy.searchsorted(pixels, ranges[:, 1], 'right')
+    return (last - first).sum(), len(ranges)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--sources", default=2000000, type="int",
+                      help="Number of sources in the catalogue")
+    parser.add_option("--cones", default=20, type="int",
+                      help="Number of cones per declination and radius")
+    parser.add_option("--seed", default=0, type="int", help="Random seed")
+    options, args = parser.parse_args()
+
+    x, y, z = all_sky(options.sources, options.seed)
+    decls = numpy.degrees(numpy.arcsin(z))
+    zones = numpy.sort(numpy.floor(decls))
+    pixels = numpy.sort(healpix.xyz2nest(x, y, z))
+    rng = numpy.random.RandomState(options.seed + 1)
+
+    print "%d sources over the whole sky" % options.sources
+    print "%6s %6s %10s %10s %10s %7s %9s %9s" % (
+        "decl", "radius", "in cone", "zone rows", "hpx rows", "ranges",
+        "zone ms", "hpx ms")
+    for decl in (0., 30., 60., 80., 88.):
+        for radius in (0.05, 1., 5.):
+            ras = rng.uniform(0, 2 * math.pi, options.cones)
+            d = math.radians(decl)
+            centres = [(math.cos(d) * math.cos(ra),
+                        math.cos(d) * math.sin(ra), math.sin(d))
+                       for ra in ras]
+
+            start = time.time()
+            zone_rows = [zone_scan(zones, decl, radius) for c in centres]
+            zone_time = (time.time() - start) / options.cones
+
+            start = time.time()
+            scans = [pixel_scan(pixels, cx, cy, cz, radius)
+                     for cx, cy, cz in centres]
+            pixel_time = (time.time() - start) / options.cones
+
+            in_cone = [numpy.count_nonzero(
+                x * cx + y * cy + z * cz > math.cos(math.radians(radius)))
+                for cx, cy, cz in centres]
+            print "%6.1f %6.2f %10.1f %10.1f %10.1f %7.1f %9.3f %9.3f" % (
+                decl, radius, numpy.mean(in_cone), numpy.mean(zone_rows),
+                numpy.mean([rows for rows, n in scans]),
+                numpy.mean([n for rows, n in scans]),
+                1000 * zone_time, 1000 * pixel_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Measure the per-island cost of the maximum pixel method corrections.
+
+A number of small synthetic islands is measured with
+tkp.sourcefinder.fitting.moments(), followed by the maximum pixel method
+variance used for the peak error, all with the same beam. This is done once
+with the beam cache emptied before each island, which is what every island
+cost when the corrections were integrated afresh each time, and once with
+the cache in place.
+
+Run as:
+
+  $ python bench_pixel_corrections.py [--islands 500] [--repeat 3]
+"""
+import time
+from optparse import OptionParser
+import numpy
+from tkp.sourcefinder import fitting
+from tkp.sourcefinder import utils
+from tkp.sourcefinder.gaussian import gaussian
+
+
+BEAM = (1.46255645752, 1.30175183614, 1.51619779602)
+
+
+def synthetic_islands(number, seed):
+    """Gaussian blobs of the beam shape at random subpixel positions."""
+    rng = numpy.random.RandomState(seed)
+    x, y = numpy.indices((9, 9))
+    islands = []
+    for i in range(number):
+        xbar, ybar = 4 + rng.uniform(-0.5, 0.5, 2)
+        islands.append(gaussian(rng.uniform(1, 10), xbar, ybar,
+                                BEAM[0], BEAM[1], BEAM[2])(x, y))
+    return islands
+
+
+def time_islands(islands, cached, repeat):
+    """Best time per island out of repeat runs."""
+    best = None
+    for i in range(repeat):
+        utils.fudge_max_pix.cache.clear()
+        utils.maximum_pixel_method_variance.cache.clear()
+        start = time.time()
+        for island in islands:
+            if not cached:
+                utils.fudge_max_pix.cache.clear()
+                utils.maximum_pixel_method_variance.cache.clear()
+            fitting.moments(island, BEAM, 0.5)
+            utils.maximum_pixel_method_variance(*BEAM)
+        elapsed = (time.time() - start) / len(islands)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--islands", default=500, type="int",
+                      help="Number of islands measured")
+    parser.add_option("--repeat", default=3, type="int",
+                      help="Number of timing runs; the best is reported")
+    parser.add_option("--seed", default=0, type="int", help="Random seed")
+    options, args = parser.parse_args()
+
+    islands = synthetic_islands(options.islands, options.seed)
+    uncached = time_islands(islands, False, options.repeat)
+    cached = time_islands(islands, True, options.repeat)
+
+    print "%d islands, beam %s" % (options.islands, BEAM)
+    print "integrated per island: %8.3f ms" % (1000 * uncached)
+    print "cached per beam:       %8.3f ms (%.1fx)" % (1000 * cached,
+                                                       uncached / cached)
+
+
+if __name__ == '__main__':
+    main()
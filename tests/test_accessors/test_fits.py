@@ -3,11 +3,18 @@ Tests for simulated LOFAR datasets.
 """
 
 import os
+import shutil
+import tempfile
 import unittest
 
+import numpy
+import pyfits
+
 from tkp.testutil.data import DATAPATH
 from tkp import accessors
 from tkp.accessors.fitsimage import FitsImage
+from tkp.accessors.detection import detect
+from tkp.quality.statistics import rms_with_clipped_subregion
 from tkp.db.orm import DataSet
 from tkp.db.database import Database
 import tkp.db
@@ -100,6 +107,71 @@ class TestFitsImage(unittest.TestCase):
 
 
 
+class TestMemoryMapped(unittest.TestCase):
+    """
+    The data is a view of the file, rather than a copy in memory.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'cube.fits')
+        numpy.random.seed(5)
+        # Stored as [stokes][freq][y][x].
+        self.stored = numpy.random.normal(size=(1, 1, 60, 40)).astype(
+            numpy.float32)
+        hdu = pyfits.PrimaryHDU(self.stored)
+        for key, value in (('CRVAL1', 15.), ('CRVAL2', 50.),
+                           ('CRPIX1', 21.), ('CRPIX2', 31.),
+                           ('CDELT1', -0.01), ('CDELT2', 0.01),
+                           ('CTYPE1', 'RA---SIN'), ('CTYPE2', 'DEC--SIN'),
+                           ('CTYPE3', 'FREQ'), ('CRVAL3', 1.5e8),
+                           ('CDELT3', 2e5), ('BMAJ', 0.02), ('BMIN', 0.02),
+                           ('BPA', 0.), ('TELESCOP', 'TEST'),
+                           ('DATE-OBS', '2013-01-01T00:00:00')):
+            hdu.header[key] = value
+        hdu.writeto(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testData(self):
+        image = accessors.open(self.filename)
+        self.assertTrue(isinstance(image, FitsImage))
+        self.assertEqual(image.data.shape, (40, 60))
+        self.assertFalse(image.data.flags.owndata)
+        self.assertEqual(image.data.dtype, self.stored.dtype.newbyteorder('>'))
+        self.assertTrue((image.data == self.stored[0, 0].transpose()).all())
+
+    def testDetect(self):
+        self.assertEqual(detect(self.filename), FitsImage)
+
+    def testRms(self):
+        image = accessors.open(self.filename)
+        rms = rms_with_clipped_subregion(
+            numpy.float64(self.stored[0, 0].transpose()), 2.5, 3)
+        self.assertEqual(rms_with_clipped_subregion(image.data, 2.5, 3), rms)
+        self.assertEqual(image.rms_with_clipped_subregion(2.5, 3), rms)
+
+    def testReadWindow(self):
+        image = accessors.open(self.filename)
+        window = (slice(5, 12), slice(30, 50))
+        self.assertEqual(image.shape, (40, 60))
+        self.assertTrue(
+            (image.read_window(window) == image.data[window]).all())
+
+    def testSourcefinderImage(self):
+        image = accessors.open(self.filename)
+        sfimage = accessors.sourcefinder_image_from_accessor(image)
+        self.assertEqual(sfimage.data.dtype, numpy.float64)
+        self.assertTrue((sfimage.data == image.data).all())
+
+    def testClose(self):
+        image = accessors.open(self.filename)
+        taustart_ts = image.taustart_ts
+        image.close()
+        self.assertTrue(image._hdulist._file.closed)
+        self.assertEqual(image.taustart_ts, taustart_ts)
+
+
 class FrequencyInformation(unittest.TestCase):
     @requires_data(os.path.join(DATAPATH, 'accessors/missing_metadata.fits'))
     def testFreqinfo(self):
@@ -23,6 +23,7 @@ options = AttributeDict({
     'grid': 100,
     'margin': 0,
     'radius': 0,
+    'dtype': 'float32',
     'deblend': False,
     'deblend_thresholds': 32,
     'residuals': True,
@@ -124,6 +125,7 @@ class TestPyse(unittest.TestCase):
         self.assertEqual(config['back_size_y'], options.grid)
         self.assertEqual(config['margin'], options.margin)
         self.assertEqual(config['radius'], options.radius)
+        self.assertEqual(config['dtype'], options.dtype)
 
     def test_sourcefinder_gets_beam(self):
         old_get_beam = tkp.bin.pyse.get_beam
@@ -1054,8 +1054,10 @@ class TestMany2Many(unittest.TestCase):
         dbgen.insert_extracted_sources(image2.id, image2_srcs, 'blind')
 
 #         Double check that we actually get *many-to-many* candidate links:
-        assoc_subs._insert_temprunningcatalog(image2.id, dr_limit,
-                                    assoc_subs._check_meridian_wrap(image2.id))
+        assoc_subs._insert_tempimage([image2.id])
+        regions = assoc_subs._image_regions([image2.id])
+        assoc_subs._insert_image_pixelranges(regions)
+        assoc_subs._insert_temprunningcatalog(dr_limit, regions[0].q_across)
         candidate_assocs = columns_from_table('temprunningcatalog')
         self.assertEqual(len(candidate_assocs),
                          len(image1_srcs) * len(image2_srcs))
@@ -1347,3 +1349,96 @@ class TestMany2Many(unittest.TestCase):
 
         # We want to be sure that the error has been appropriately logged.
         self.assertIn("RhombusError", iostream.getvalue())
+
+
+@requires_database()
+class TestGroupedAssociation(unittest.TestCase):
+    """
+    Associating the images of a timestep in groups gives the same results as
+    associating them one by one.
+    """
+    def shortDescription(self):
+        return None
+
+    def tearDown(self):
+        tkp.db.rollback()
+
+    def insert_and_associate(self, dataset, associate):
+        """
+        Three timesteps of images of two bands of one field and of one band
+        of another field, far away. A new source appears in every field after
+        the first timestep.
+
+        Returns the image ids per timestep.
+        """
+        fields = [dict(centre_ra=123., freq_eff=140e6),
+                  dict(centre_ra=123., freq_eff=150e6),
+                  dict(centre_ra=183., freq_eff=140e6)]
+        im_params = [db_subs.generate_timespaced_dbimages_data(3, **field)
+                     for field in fields]
+        timesteps = []
+        for n in range(3):
+            image_ids = []
+            for field, params in zip(fields, im_params):
+                image = tkp.db.Image(dataset=dataset, data=params[n])
+                ras = [field['centre_ra'], field['centre_ra'] + 0.5]
+                if n > 0:
+                    ras.append(field['centre_ra'] - 0.5)
+                sources = [db_subs.example_extractedsource_tuple(ra=ra,
+                                                                 dec=10.)
+                           for ra in ras]
+                dbgen.insert_extracted_sources(image.id, sources, 'blind')
+                image_ids.append(image.id)
+            associate(image_ids)
+            timesteps.append(image_ids)
+        return timesteps
+
+    def results(self, dataset):
+        query = """\
+        SELECT rc.wm_ra
+              ,rc.wm_decl
+              ,rc.datapoints
+              ,rf.band
+              ,rf.f_datapoints
+              ,rf.avg_f_peak
+              ,(SELECT COUNT(*) FROM assocskyrgn a WHERE a.runcat = rc.id)
+              ,(SELECT COUNT(*) FROM newsource n WHERE n.runcat = rc.id)
+          FROM runningcatalog rc
+              ,runningcatalog_flux rf
+         WHERE rc.dataset = %(dataset)s
+           AND rf.runcat = rc.id
+        """
+        rows = tkp.db.execute(query, {'dataset': dataset.id}).fetchall()
+        return sorted(tuple(round(v, 9) if isinstance(v, float) else v
+                            for v in row) for row in rows)
+
+    def test_grouped_association(self):
+        associate = partial(assoc_subs.associate_images, deRuiter_r=3.717,
+                            new_source_sigma_margin=3)
+
+        one_by_one = DataSet(data={'description': 'assoc one by one'})
+        def associate_one_by_one(image_ids):
+            for image_id in image_ids:
+                associate([image_id])
+        self.insert_and_associate(one_by_one, associate_one_by_one)
+
+        grouped = DataSet(data={'description': 'assoc grouped'})
+        groups = []
+        def associate_grouped(image_ids):
+            groups.append(assoc_subs.group_independent_images(image_ids))
+            for group in groups[-1]:
+                associate(group)
+        timesteps = self.insert_and_associate(grouped, associate_grouped)
+
+        # The bands of the first field are associated in turn, the second
+        # field together with the first band of the first.
+        for image_ids, timestep_groups in zip(timesteps, groups):
+            self.assertEqual(timestep_groups, [[image_ids[0], image_ids[2]],
+                                               [image_ids[1]]])
+        expected = self.results(one_by_one)
+        self.assertEqual(len(expected), 3 * 3)
+        self.assertEqual(self.results(grouped), expected)
+
+        # Overlapping images cannot be associated together.
+        with self.assertRaises(ValueError):
+            associate(timesteps[-1][:2])
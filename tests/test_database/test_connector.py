@@ -1,7 +1,12 @@
 import unittest
+import multiprocessing
 from exceptions import StandardError
 from tkp.testutil.decorators import requires_database
 import tkp.db
+from tkp.db.database import ConnectionPool
+from tkp.db.database import _inherited_connections
+from tkp.db.database import _prepared_parameters
+from tkp.db.database import StatementRegistry
 
 class TestDatabaseConnection(unittest.TestCase):
 
@@ -54,3 +59,125 @@ class TestDatabaseConnection(unittest.TestCase):
         for exception in bad_exceptions:
             with self.assertRaises(AttributeError):
                 getattr(self.database.exceptions, exception)
+
+
+def _query_in_child(queue):
+    queue.put(tkp.db.execute("SELECT 42").fetchone()[0])
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(FakeConnection, maxconn=2)
+
+    def test_reuse(self):
+        first = self.pool.getconn()
+        second = self.pool.getconn()
+        self.assertIsNot(first, second)
+        self.pool.putconn(first)
+        self.assertEqual(first.rollbacks, 1)
+        self.assertIs(self.pool.getconn(), first)
+        self.assertEqual(len(self.pool), 2)
+
+    def test_close(self):
+        connection = self.pool.getconn()
+        self.pool.putconn(connection, close=True)
+        self.assertTrue(connection.closed)
+        self.assertEqual(len(self.pool), 0)
+        self.assertIsNot(self.pool.getconn(), connection)
+
+    def test_fork(self):
+        connection = self.pool.getconn()
+        # Pretend to be the child of the process which made the connection.
+        self.pool._pid = -1
+        self.assertIsNot(self.pool.getconn(), connection)
+        self.assertFalse(connection.closed)
+        self.assertIn(connection, _inherited_connections)
+
+
+class TestPreparedStatements(unittest.TestCase):
+
+    def test_placeholders(self):
+        query, values = _prepared_parameters(
+            "SELECT %(b)s + %(a)s * %(b)s, 'x%%'", {'a': 1, 'b': 2})
+        self.assertEqual(query, "SELECT $1 + $2 * $1, 'x%'")
+        self.assertEqual(values, [2, 1])
+        query, values = _prepared_parameters("SELECT %s, %s", (3, 4))
+        self.assertEqual(query, "SELECT $1, $2")
+        self.assertEqual(values, [3, 4])
+
+    @requires_database()
+    def test_prepared(self):
+        if tkp.db.Database().engine != 'postgresql':
+            raise unittest.SkipTest("Prepared statements need PostgreSQL")
+        query = "SELECT CAST(%(a)s AS INTEGER) + CAST(%(b)s AS INTEGER)"
+        for a in range(3):
+            cursor = tkp.db.execute(query, {'a': a, 'b': 10},
+                                    prepare='test_prepared_sum')
+            self.assertEqual(cursor.fetchone()[0], a + 10)
+        tkp.db.rollback()
+
+    @requires_database()
+    def test_registry(self):
+        statements = StatementRegistry('test_registry_')
+        query = "SELECT CAST(%(a)s AS INTEGER) * 2"
+        for a in range(3):
+            cursor = statements.execute('double', query, {'a': a})
+            self.assertEqual(cursor.fetchone()[0], 2 * a)
+        statements.execute('double', query, {'a': 1}, prepare=False)
+        self.assertEqual(statements.timings['double'][0], 4)
+        self.assertRaises(ValueError, statements.execute, 'double',
+                          "SELECT 1")
+        tkp.db.rollback()
+
+    @requires_database()
+    def test_registry_scaled(self):
+        statements = StatementRegistry('test_registry_scaled_')
+        query = "SELECT CAST(%(a)s AS INTEGER) * 2"
+        for rows in (0, 5, 50, 5000):
+            statements.set_rows(rows)
+            cursor = statements.execute('double', query, {'a': rows},
+                                        scaled=True)
+            self.assertEqual(cursor.fetchone()[0], 2 * rows)
+        self.assertEqual(statements.magnitude, 4)
+        self.assertEqual(statements.timings['double'][0], 4)
+        tkp.db.rollback()
+
+
+class TestForkedConnection(unittest.TestCase):
+
+    @requires_database()
+    def test_child_connects(self):
+        # A child process makes its own connection, leaving the one of the
+        # parent intact.
+        parent = tkp.db.connection()
+        queue = multiprocessing.Queue()
+        child = multiprocessing.Process(target=_query_in_child, args=(queue,))
+        child.start()
+        self.assertEqual(queue.get(timeout=30), 42)
+        child.join()
+        self.assertEqual(child.exitcode, 0)
+        self.assertIs(tkp.db.connection(), parent)
+        self.assertEqual(tkp.db.execute("SELECT 43").fetchone()[0], 43)
+        tkp.db.rollback()
+
+    @requires_database()
+    def test_pooled_connection(self):
+        database = tkp.db.Database()
+        with database.pooled_connection() as connection:
+            self.assertIsNot(connection, database.connection)
+            cursor = connection.cursor()
+            cursor.execute("SELECT 44")
+            self.assertEqual(cursor.fetchone()[0], 44)
@@ -0,0 +1,173 @@
+import unittest
+
+import numpy
+
+import tkp.db
+import tkp.db.general as dbgen
+import tkp.db.associations as assoc_subs
+from tkp.db import matching
+from tkp.db.orm import DataSet
+from tkp.db.associations import associate_extracted_sources
+from tkp.db.generic import columns_from_table
+from tkp.testutil import db_subs
+from tkp.testutil.decorators import requires_database
+
+
+def random_sources(n, ra, decl, spread, seed):
+    """Arrays of the matched columns for n sources around ra, decl."""
+    numpy.random.seed(seed)
+    ras = ra + numpy.random.uniform(-spread, spread, n)
+    decls = decl + numpy.random.uniform(-spread, spread, n)
+    sources = {
+        'id': numpy.arange(n, dtype=float),
+        'ra': ras,
+        'decl': decls,
+        'zone': numpy.floor(decls),
+        'x': numpy.cos(numpy.radians(decls)) * numpy.cos(numpy.radians(ras)),
+        'y': numpy.cos(numpy.radians(decls)) * numpy.sin(numpy.radians(ras)),
+        'z': numpy.sin(numpy.radians(decls)),
+        'uncertainty_ew': numpy.random.uniform(1e-3, 1e-2, n),
+        'uncertainty_ns': numpy.random.uniform(1e-3, 1e-2, n),
+    }
+    for name in ('ra', 'decl', 'uncertainty_ew', 'uncertainty_ns'):
+        sources['wm_' + name] = sources[name]
+    return sources
+
+
+class TestCandidatePairs(unittest.TestCase):
+    def brute_force(self, xtr, runcat, rb_smaj, deRuiter_r, q_across):
+        pairs = set()
+        for i in range(len(xtr['id'])):
+            for j in range(len(runcat['id'])):
+                xi, ri, distance, r = matching.candidate_pairs(
+                    dict((k, v[i:i + 1]) for k, v in xtr.items()),
+                    dict((k, v[j:j + 1]) for k, v in runcat.items()),
+                    rb_smaj, deRuiter_r, q_across)
+                if len(xi):
+                    pairs.add((i, j))
+        return pairs
+
+    def check(self, ra, q_across):
+        xtr = random_sources(40, ra, 30., 0.05, seed=1)
+        runcat = random_sources(60, ra, 30., 0.05, seed=2)
+        xi, ri, distance, r = matching.candidate_pairs(
+            xtr, runcat, 0.02, 3.717, q_across)
+        self.assertTrue(len(xi) > 0)
+        self.assertTrue((r < 3.717).all())
+        self.assertTrue((distance <= 0.02 * 3600).all())
+        self.assertEqual(set(zip(xi, ri)),
+                         self.brute_force(xtr, runcat, 0.02, 3.717, q_across))
+
+    def test_pairs(self):
+        self.check(123., q_across=False)
+
+    def test_pairs_across_meridian(self):
+        xtr = random_sources(20, 0.01, 30., 0.02, seed=3)
+        xtr['ra'] = numpy.mod(xtr['ra'], 360)
+        runcat = random_sources(20, 0.01, 30., 0.02, seed=4)
+        runcat['wm_ra'] = numpy.mod(runcat['wm_ra'], 360)
+        xi, ri, distance, r = matching.candidate_pairs(
+            xtr, runcat, 0.02, 3.717, True)
+        # Pairs on either side of the meridian are found.
+        sides = xtr['ra'][xi] > 180
+        self.assertTrue((sides != (runcat['wm_ra'][ri] > 180)).any())
+
+    def test_no_sources(self):
+        xtr = random_sources(0, 123., 30., 0.05, seed=1)
+        runcat = random_sources(5, 123., 30., 0.05, seed=2)
+        xi, ri, distance, r = matching.candidate_pairs(
+            xtr, runcat, 0.02, 3.717, False)
+        self.assertEqual(len(xi), 0)
+
+
+class TestFlagManyToMany(unittest.TestCase):
+    def test_one_to_one(self):
+        inactive = matching.flag_many_to_many(
+            numpy.array([1, 2]), numpy.array([10, 20]), numpy.array([1., 2.]))
+        self.assertFalse(inactive.any())
+
+    def test_one_to_many(self):
+        # One running catalog source, two extracted sources: nothing to do.
+        inactive = matching.flag_many_to_many(
+            numpy.array([1, 1]), numpy.array([10, 20]), numpy.array([1., 2.]))
+        self.assertFalse(inactive.any())
+
+    def test_many_to_many(self):
+        # Two running catalog sources, each with both extracted sources:
+        # per extracted source, only the closest pair is kept.
+        runcat = numpy.array([1, 1, 2, 2])
+        xtrsrc = numpy.array([10, 20, 10, 20])
+        r = numpy.array([1., 3., 2., 0.5])
+        inactive = matching.flag_many_to_many(runcat, xtrsrc, r)
+        self.assertEqual(inactive.tolist(), [False, True, True, False])
+
+
+@requires_database()
+class TestInMemoryAssociation(unittest.TestCase):
+    """
+    The in-memory matching fills temprunningcatalog as the SQL queries do.
+    """
+    def tearDown(self):
+        tkp.db.rollback()
+
+    def temprunningcatalog(self):
+        rows = columns_from_table('temprunningcatalog')
+        for row in rows:
+            del row['id']
+        return sorted(rows, key=lambda row: (row['runcat'], row['xtrsrc']))
+
+    def compare(self, centre_ra, offsets):
+        dataset = DataSet(data={'description': 'in-memory association'})
+        im_params = db_subs.generate_timespaced_dbimages_data(
+            len(offsets), centre_ra=centre_ra, centre_decl=10.5)
+        pos_err = 30 / 3600.
+        template = db_subs.example_extractedsource_tuple(
+            ra=centre_ra, dec=10.5, ra_fit_err=pos_err, dec_fit_err=pos_err,
+            beam_maj=100, beam_min=100, beam_angle=45,
+            ew_sys_err=0, ns_sys_err=0)
+
+        for n, (params, image_offsets) in enumerate(zip(im_params, offsets)):
+            image = tkp.db.Image(dataset=dataset, data=params)
+            sources = [template._replace(ra=(centre_ra + offset) % 360)
+                       for offset in image_offsets]
+            dbgen.insert_extracted_sources(image.id, sources, 'blind')
+            if n < len(offsets) - 1:
+                associate_extracted_sources(image.id, deRuiter_r=3.717,
+                                            new_source_sigma_margin=3)
+
+        assoc_subs._insert_tempimage([image.id])
+        q_across = assoc_subs._image_regions([image.id])[0].q_across
+        assoc_subs._insert_image_pixelranges(
+            assoc_subs._image_regions([image.id]))
+        assoc_subs._empty_temprunningcatalog()
+        assoc_subs._insert_temprunningcatalog(3.717, q_across)
+        assoc_subs._flag_many_to_many_tempruncat()
+        expected = self.temprunningcatalog()
+        self.assertTrue(expected)
+
+        assoc_subs._empty_temprunningcatalog()
+        matching.insert_temprunningcatalog(image.id, 3.717, q_across)
+        result = self.temprunningcatalog()
+        assoc_subs._empty_temprunningcatalog()
+
+        self.assertEqual(len(result), len(expected))
+        for r, e in zip(result, expected):
+            self.assertEqual(sorted(r.keys()), sorted(e.keys()))
+            for key in e:
+                if isinstance(e[key], float):
+                    self.assertAlmostEqual(r[key], e[key], places=9)
+                else:
+                    self.assertEqual(r[key], e[key])
+
+    def test_one_to_one(self):
+        self.compare(123., [[0, 0.1], [0, 0.1], [1 / 3600., 0.1]])
+
+    def test_many_to_many(self):
+        offset = 20 / 3600.
+        self.compare(123., [[-offset, offset], [-offset, offset],
+                            [-offset + 1 / 3600., offset]])
+
+    def test_meridian(self):
+        offset = 20 / 3600.
+        self.compare(0., [[-offset, offset], [-offset, offset],
+                          [-offset / 2, offset / 2]])
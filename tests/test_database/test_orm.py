@@ -1,6 +1,8 @@
 import unittest
 import datetime
 import logging
+import math
+import numpy
 from io import BytesIO
 from tkp.testutil.decorators import requires_database
 import tkp.db
@@ -9,6 +11,8 @@ from tkp.db.database import Database
 from tkp.db.orm import ExtractedSource
 from tkp.testutil import db_subs
 from tkp.db.generic import columns_from_table
+from tkp.utility.containers import ColumnarExtractionResults
+from tkp.utility.coordinates import eq_to_cart
 
 # We're cheating here: a unit test shouldn't really depend on an
 # external dependency like the database being up and running
@@ -222,8 +226,56 @@ class TestExtractedSource(unittest.TestCase):
                                       where= {'image' : image.id})
         self.assertEqual(len(inserted), 1)
 
-
-
+    @requires_database()
+    def test_derived_columns(self):
+        # The columns calculated on insertion, for a list of tuples and for
+        # columnar results.
+        dataset = DataSet(data={'description': 'example dataset'},
+                           database=self.database)
+        sources = [
+            db_subs.example_extractedsource_tuple(),
+            db_subs.example_extractedsource_tuple(ra=10., dec=-45.5,
+                                                  error_radius=float('inf'),
+                                                  chisq=None,
+                                                  reduced_chisq=None)
+        ]
+        columnar = ColumnarExtractionResults(numpy.zeros(
+            2, dtype=ColumnarExtractionResults.dtype))
+        for name, values in zip(ColumnarExtractionResults.serialized_columns,
+                                zip(*sources)):
+            columnar.data[name] = [numpy.nan if value is None else value
+                                   for value in values]
+        for results in (sources, columnar):
+            image = Image(dataset=dataset,
+                          data=db_subs.example_dbimage_data_dict())
+            image.insert_extracted_sources(results)
+            inserted = columns_from_table(
+                'extractedsource',
+                keywords=['ra', 'decl', 'error_radius', 'chisq', 'zone',
+                          'x', 'y', 'z', 'racosdecl', 'uncertainty_ew',
+                          'decl_err', 'extract_type', 'ff_runcat'],
+                where={'image': image.id}, order='id')
+            self.assertEqual(len(inserted), 2)
+            first, second = inserted
+            self.assertEqual(first['zone'], 10)
+            self.assertEqual(second['zone'], -46)
+            self.assertEqual(first['chisq'], 5.)
+            self.assertEqual(second['chisq'], None)
+            self.assertEqual(second['error_radius'], 360.)
+            self.assertAlmostEqual(second['uncertainty_ew'],
+                                   (20.**2 + 360.**2)**0.5 / 3600.)
+            self.assertAlmostEqual(first['decl_err'],
+                                   ((6. / 3600)**2 + (20. / 3600)**2)**0.5)
+            self.assertEqual(first['extract_type'], 0)
+            self.assertEqual(first['ff_runcat'], None)
+            for source in inserted:
+                x, y, z = eq_to_cart(source['ra'], source['decl'])
+                self.assertAlmostEqual(source['x'], x)
+                self.assertAlmostEqual(source['y'], y)
+                self.assertAlmostEqual(source['z'], z)
+                self.assertAlmostEqual(
+                    source['racosdecl'],
+                    source['ra'] * math.cos(math.radians(source['decl'])))
 
     @requires_database()
     def test_create(self):
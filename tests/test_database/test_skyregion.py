@@ -127,6 +127,36 @@ class TestSkyRegionAssociation(unittest.TestCase):
                                     where={'skyrgn':image2._data['skyrgn']})
         self.assertEqual(len(assocs), 0)
 
+    def test_skyregion_without_pixel_ranges(self):
+        """A skyregion inserted by getSkyRgn directly, without the HEALPix
+        pixel ranges in temppixelrange, is associated through the range of
+        declinations of the region instead.
+        """
+        im_params = db_subs.generate_timespaced_dbimages_data(1)
+        src_in_img0 = db_subs.example_extractedsource_tuple(
+                        ra=im_params[0]['centre_ra'],
+                        dec=im_params[0]['centre_decl'],)
+        image0 = tkp.db.Image(dataset=self.dataset, data=im_params[0])
+        image0.insert_extracted_sources([src_in_img0])
+        image0.associate_extracted_sources(deRuiter_r, new_source_sigma_margin)
+        self.assertEqual(
+            tkp.db.execute("SELECT COUNT(*) FROM temppixelrange").fetchone()[0],
+            0)
+
+        query = "SELECT getSkyRgn(%(dataset)s, %(ra)s, %(decl)s, %(radius)s)"
+        args = {'dataset': self.dataset.id,
+                'ra': im_params[0]['centre_ra'],
+                'decl': im_params[0]['centre_decl'] +
+                        im_params[0]['xtr_radius'] * 0.5,
+                'radius': im_params[0]['xtr_radius']}
+        skyrgn = tkp.db.execute(query, args, commit=True).fetchone()[0]
+
+        runcats = columns_from_table('runningcatalog',
+                                     where={'dataset':self.dataset.id})
+        assocs = columns_from_table('assocskyrgn', where={'skyrgn':skyrgn})
+        self.assertEqual(len(assocs), 1)
+        self.assertEqual(assocs[0]['runcat'], runcats[0]['id'])
+
     def test_new_runcat_insertion(self):
         """Here we test the association logic executed upon insertion of a
         new runningcatalog source.
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy
+
+import tkp.db
+from tkp.db.associations import associate_extracted_sources
+from tkp.db.generic import columns_from_table
+from tkp.testutil import db_subs
+from tkp.testutil.decorators import requires_database
+from tkp.utility import healpix
+
+
+@requires_database()
+class TestHpxNest(unittest.TestCase):
+    """The database calculates the same HEALPix pixels as Python."""
+
+    def tearDown(self):
+        tkp.db.rollback()
+
+    def test_hpxnest(self):
+        numpy.random.seed(1)
+        v = numpy.random.normal(size=(3, 200))
+        v /= numpy.sqrt((v ** 2).sum(axis=0))
+        # The poles and the RA = 0/360 meridian.
+        v = numpy.hstack([v, [[0, 0, 1, 0], [0, 0, 0, 1e-9],
+                              [1, -1, 0, 1]]])
+        v /= numpy.sqrt((v ** 2).sum(axis=0))
+        expected = healpix.xyz2nest(*v)
+        for (x, y, z), pix in zip(v.T.tolist(), expected.tolist()):
+            cursor = tkp.db.execute("SELECT hpxNest(%s, %s, %s)", (x, y, z))
+            self.assertEqual(cursor.fetchone()[0], pix)
+
+    def test_pixel_columns(self):
+        dataset = tkp.db.DataSet(data={'description': 'hpx columns'})
+        im_params = db_subs.generate_timespaced_dbimages_data(
+            3, centre_ra=0.2, centre_decl=60.)
+        src = db_subs.example_extractedsource_tuple(ra=0.2, dec=60.)
+        for n, params in enumerate(im_params):
+            image = tkp.db.Image(dataset=dataset, data=params)
+            sources = [src._replace(ra=(src.ra + offset) % 360)
+                       for offset in (-0.3, 0., 0.3 + n / 3600.)]
+            tkp.db.general.insert_extracted_sources(image.id, sources,
+                                                    'blind')
+            associate_extracted_sources(image.id, deRuiter_r=3.717,
+                                        new_source_sigma_margin=3)
+
+        for table in ('runningcatalog', 'skyregion'):
+            rows = columns_from_table(table, keywords=['x', 'y', 'z', 'hpx'],
+                                      where={'dataset': dataset.id})
+            self.assertTrue(rows)
+            for row in rows:
+                self.assertEqual(row['hpx'], healpix.xyz2nest(
+                    row['x'], row['y'], row['z']))
+
+        # All sources are associated across the meridian.
+        runcat = columns_from_table('runningcatalog',
+                                    keywords=['id', 'datapoints'],
+                                    where={'dataset': dataset.id})
+        self.assertEqual(sorted(r['datapoints'] for r in runcat), [3, 3, 3])
+
+        # A new skyregion, found by the pixel ranges around its centre, has
+        # the running catalog sources as members.
+        params = dict(im_params[-1], centre_ra=359.9, xtr_radius=1.)
+        image = tkp.db.Image(dataset=dataset, data=params)
+        image.update()
+        members = columns_from_table('assocskyrgn', keywords=['runcat'],
+                                     where={'skyrgn': image._data['skyrgn']})
+        self.assertEqual(sorted(m['runcat'] for m in members),
+                         sorted(r['id'] for r in runcat))
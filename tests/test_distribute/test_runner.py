@@ -1,5 +1,8 @@
+import time
 import unittest
 import tkp.distribute
+import tkp.distribute.multiproc
+import tkp.distribute.serial
 
 
 class TestRunner(unittest.TestCase):
@@ -10,6 +13,9 @@ class TestRunner(unittest.TestCase):
         for method in 'serial', 'multiproc':  # can't test celery without broker
             runner = tkp.distribute.Runner(method)
             runner.map("persistence_node_step", [])
+            self.assertEqual(list(runner.imap("process_image", [])), [])
+            self.assertEqual(
+                list(runner.imap_unordered("process_image", [])), [])
 
     def test_set_cores(self):
         cores = 10
@@ -26,4 +32,78 @@ class TestRunner(unittest.TestCase):
     def test_invalid_function(self):
         celery_runner = tkp.distribute.Runner('serial')
         self.assertRaises(NotImplementedError, celery_runner.map, "invalid",
-                          range(5))
\ No newline at end of file
+                          range(5))
+
+    def test_invalid_map_ahead(self):
+        runner = tkp.distribute.Runner('serial')
+        self.assertRaises(NotImplementedError, runner.map_ahead, "invalid",
+                          [range(5)])
+
+
+def square(zipped):
+    i, args = zipped
+    return i * i
+
+
+class TestImap(unittest.TestCase):
+    def test_serial(self):
+        results = tkp.distribute.serial.imap(lambda i, factor: i * factor,
+                                             range(5), [2])
+        self.assertEqual(list(results), [(i, 2 * i) for i in range(5)])
+
+    def test_multiproc(self):
+        # Restart the pool, as Runner does, so that the workers know square.
+        tkp.distribute.multiproc.set_cores(2)
+        expected = [(i, i * i) for i in range(10)]
+        for chunksize in 1, 3:
+            results = tkp.distribute.multiproc.imap(square, range(10), [],
+                                                    chunksize)
+            self.assertEqual(list(results), expected)
+            results = tkp.distribute.multiproc.imap(square, range(10), [],
+                                                    chunksize, ordered=False)
+            self.assertEqual(sorted(results), expected)
+
+
+class MockRunner(object):
+    """Squares the numbers in a chunk, recording which were mapped."""
+    def __init__(self):
+        self.mapped = []
+
+    def imap_unordered(self, func_name, iterable, args=[]):
+        if None in iterable:
+            raise ValueError("can't square None")
+        self.mapped.append(iterable)
+        return reversed([(n, i * i) for n, i in enumerate(iterable)])
+
+
+class TestMapAhead(unittest.TestCase):
+    def wait_for(self, runner, n_chunks):
+        for i in range(100):
+            if len(runner.mapped) >= n_chunks:
+                break
+            time.sleep(0.01)
+
+    def test_lookahead(self):
+        chunks = [[1, 2], [3], [4, 5, 6], [7], [8]]
+        for lookahead in 0, 1, 2:
+            runner = MockRunner()
+            mapped = tkp.distribute.MapAhead(runner, "square", chunks,
+                                             lookahead=lookahead)
+            results = []
+            for n, chunk_results in enumerate(mapped):
+                # Chunks are mapped up to lookahead ahead of this one.
+                expected = min(n + 1 + lookahead, len(chunks))
+                self.wait_for(runner, expected)
+                self.assertEqual(len(runner.mapped), expected)
+                results.append(sorted(chunk_results))
+            self.assertEqual(results, [[(0, 1), (1, 4)], [(0, 9)],
+                                       [(0, 16), (1, 25), (2, 36)], [(0, 49)],
+                                       [(0, 64)]])
+            self.assertEqual(runner.mapped, chunks)
+
+    def test_exception(self):
+        mapped = tkp.distribute.MapAhead(MockRunner(), "square",
+                                         [[1], [None], [2]])
+        chunks = iter(mapped)
+        self.assertEqual(list(next(chunks)), [(0, 1)])
+        self.assertRaises(ValueError, list, next(chunks))
@@ -1,4 +1,6 @@
 import os
+import sys
+import traceback
 import numpy
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 import unittest
@@ -30,6 +32,18 @@ class TestRms(unittest.TestCase):
         check = numpy.array([10] * (50*50-1))
         assert_array_equal(clipped,  check)
 
+    def test_clip_iterations(self):
+        # Every iteration clips only the largest few values; there are more
+        # iterations than the recursion limit allows.
+        a = 1.5 ** numpy.arange(200.)
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(len(traceback.extract_stack()) + 60)
+        try:
+            clipped = statistics.clip(a)
+        finally:
+            sys.setrecursionlimit(limit)
+        assert_array_equal(numpy.sort(clipped), a[:12])
+
     def test_rmsclippedsubregion(self):
         o = numpy.ones((800, 800))
         sub = statistics.subregion(o)
@@ -0,0 +1,105 @@
+import sys
+import numpy
+
+import unittest
+
+from tkp.sourcefinder.deblend import ComponentTree
+from tkp.sourcefinder.extract import Island, BIGNUM
+from tkp.sourcefinder.gaussian import gaussian
+
+
+CROSS = [[0, 1, 0], [1, 1, 1], [0, 1, 0]]
+BEAM = (1.5, 1.5, 0.)
+
+
+def blend(separation, peaks=(10., 7.)):
+    """Two Gaussians on a row, joined at low levels."""
+    x, y = numpy.indices((21, 31))
+    data = sum(gaussian(peak, 10, 8 + i * separation, 3., 3., 0.)(x, y)
+               for i, peak in enumerate(peaks))
+    return numpy.where(data > 0.5, data, -BIGNUM)
+
+
+class TestComponentTree(unittest.TestCase):
+    def setUp(self):
+        self.data = blend(8)
+        self.levels = numpy.linspace(1, 9, 17)
+        self.tree = ComponentTree(numpy.maximum(self.data, 0), self.levels,
+                                  CROSS, numpy.ones(self.data.shape))
+
+    def test_components(self):
+        # Below the saddle point, there is a single component; above it,
+        # there are two, until the fainter peak drops out.
+        self.assertEqual(len(self.tree.components([self.tree.root], 0)), 1)
+        self.assertEqual(len(self.tree.components([self.tree.root], 10)), 2)
+        self.assertEqual(len(self.tree.components([self.tree.root], 16)), 1)
+
+    def test_split(self):
+        parts = self.tree.split(0, 1.)
+        self.assertEqual(len(parts), 2)
+        chunks = [self.tree.component(node)[0] for node, k in parts]
+        # Raster order: the left component comes first.
+        self.assertTrue(chunks[0][1].stop <= chunks[1][1].start)
+        self.assertEqual(parts[0][1], parts[1][1])
+
+    def test_insignificant(self):
+        # Neither part is above the detection map.
+        tree = ComponentTree(numpy.maximum(self.data, 0), self.levels,
+                             CROSS, numpy.ones(self.data.shape) * 100)
+        self.assertEqual(tree.split(0, 1.), [(tree.root, None)])
+
+    def test_component(self):
+        node = self.tree.split(0, 1.)[0][0]
+        chunk, pixels = self.tree.component(node)
+        self.assertEqual(pixels.sum(), self.tree.count[node])
+        self.assertTrue((self.data[chunk][pixels] >= self.levels[0]).all())
+
+
+class TestIslandDeblend(unittest.TestCase):
+    def island(self, data, nthresh=32):
+        shape = data.shape
+        return Island(data, numpy.ones(shape), (slice(5, 5 + shape[0]),
+                      slice(7, 7 + shape[1])), 1., numpy.ones(shape) * 2.,
+                      BEAM, nthresh, 0.005, CROSS)
+
+    def test_deblend(self):
+        subislands = self.island(blend(8)).deblend()
+        self.assertEqual(len(subislands), 2)
+        for subisland in subislands:
+            self.assertEqual(subisland.analysis_threshold, 1)
+            self.assertEqual(subisland.data.shape, subisland.rms.shape)
+            self.assertEqual(subisland.chunk[0].stop - subisland.chunk[0].start,
+                             subisland.data.shape[0])
+            self.assertTrue(subisland.chunk[0].start >= 5)
+        peaks = [subisland.data.max() for subisland in subislands]
+        self.assertAlmostEqual(peaks[0], 10., delta=0.2)
+        self.assertAlmostEqual(peaks[1], 7., delta=0.2)
+
+    def test_single_source(self):
+        island = self.island(blend(30, peaks=(10., 0.)))
+        self.assertTrue(island.deblend() is island)
+
+    def test_nested(self):
+        # Three sources, two of which only separate at a higher level.
+        x, y = numpy.indices((21, 41))
+        data = sum(gaussian(peak, 10, ypos, 2.5, 2.5, 0.)(x, y)
+                   for peak, ypos in ((10., 8), (10., 14), (10., 24)))
+        data = numpy.where(data > 0.5, data, -BIGNUM)
+        subislands = self.island(data, nthresh=100).deblend()
+        self.assertEqual(len(subislands), 3)
+        # The pair is split off at a higher level than the single source.
+        self.assertTrue(subislands[0].rms[0, 0] > subislands[2].rms[0, 0])
+
+    def test_no_recursion(self):
+        # Deblending through many levels must not run into the recursion
+        # limit.
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(100)
+        try:
+            x, y = numpy.indices((11, 200))
+            data = sum(gaussian(10., 5, ypos, 1.5, 1.5, 0.)(x, y)
+                       for ypos in range(5, 200, 6))
+            subislands = self.island(data, nthresh=300).deblend()
+        finally:
+            sys.setrecursionlimit(limit)
+        self.assertEqual(len(subislands), 33)
@@ -3,6 +3,7 @@ import unittest
 import math
 from tkp.utility.coordinates import WCS
 from tkp.sourcefinder.extract import Detection
+from tkp.sourcefinder.extract import create_detections
 from tkp.utility.uncertain import Uncertain
 from tkp.sourcefinder.extract import ParamSet
 from tkp.sourcefinder.utils import get_error_radius
@@ -127,3 +128,25 @@ class TestPositionErrors(unittest.TestCase):
         d_ncp = Detection(self.p, self.ncp_image)
         d_equator = Detection(self.p, self.equator_image)
         self.assertEqual(d_ncp.error_radius, d_equator.error_radius)
+
+    def test_create_detections(self):
+        # Detections created in bulk are the same as those created one by
+        # one, also when the error box does not fit on the sky.
+        paramsets = []
+        for x, y, error in ((1025, 1025, 1), (125, 700, 2), (1, 1, 1e4)):
+            p = get_paramset()
+            p.values['xbar'] = Uncertain(x, error)
+            p.values['ybar'] = Uncertain(y, error)
+            paramsets.append(p)
+        detections = create_detections(paramsets, self.ncp_image)
+        self.assertEqual(detections[2].error_radius, float('inf'))
+        for p, det in zip(paramsets, detections):
+            reference = Detection(p, self.ncp_image)
+            for attr in ('ra', 'dec', 'smaj_asec', 'smin_asec', 'theta_celes'):
+                self.assertAlmostEqual(getattr(det, attr).value,
+                                       getattr(reference, attr).value, 10)
+                self.assertEqual(getattr(det, attr).error,
+                                 getattr(reference, attr).error)
+            self.assertEqual(det.error_radius, get_error_radius(
+                self.ncp_image.wcs, p['xbar'].value, p['xbar'].error,
+                p['ybar'].value, p['ybar'].error))
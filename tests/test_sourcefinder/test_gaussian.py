@@ -5,7 +5,7 @@ import numpy
 
 import unittest
 
-from tkp.sourcefinder.gaussian import gaussian
+from tkp.sourcefinder.gaussian import gaussian, jacobian
 from tkp.sourcefinder.fitting import moments, fitgaussian, FIT_PARAMS
 from tkp.sourcefinder.extract import source_profile_and_errors
 
@@ -282,3 +282,48 @@ class NoisyGaussTest(unittest.TestCase):
         self.assertTrue( 0.9 < self.fit_w_errs.chisq / npix < 1.1)
 
 
+class JacobianTest(unittest.TestCase):
+    """Analytic derivatives agree with finite differences"""
+    def testDerivatives(self):
+        params = [3.0, 10.3, 12.1, 4.0, 2.5, 0.7]
+        x, y = numpy.indices((20, 25))
+        derivatives = jacobian(*params)(x, y)
+        step = 1e-6
+        for i, param in enumerate(FIT_PARAMS):
+            upper, lower = list(params), list(params)
+            upper[i] += step
+            lower[i] -= step
+            numerical = (gaussian(*upper)(x, y) -
+                         gaussian(*lower)(x, y)) / (2 * step)
+            self.assertTrue(numpy.allclose(derivatives[i], numerical,
+                                           rtol=0, atol=1e-8), msg=param)
+
+
+class MaskedFixedGaussTest(unittest.TestCase):
+    """Fit only the unmasked pixels, with some parameters held fixed"""
+    def setUp(self):
+        Xin, Yin = numpy.indices((40, 40))
+        self.params = dict(zip(FIT_PARAMS, (5.0, 19.3, 20.6, 4.0, 3.0, 0.4)))
+        data = gaussian(*[self.params[p] for p in FIT_PARAMS])(Xin, Yin)
+        # Masked pixels carry garbage which must not affect the fit.
+        data[data < 0.5] = 1000.
+        self.mygauss = numpy.ma.array(data, mask=(data == 1000.))
+        self.initial = {'peak': 4.0, 'xbar': 19., 'ybar': 21.,
+                        'semimajor': 3.5, 'semiminor': 3.5, 'theta': 0.}
+
+    def testFreeFit(self):
+        fit = fitgaussian(self.mygauss, self.initial)
+        for param in FIT_PARAMS:
+            self.assertAlmostEqual(fit[param], self.params[param], places=4)
+
+    def testFixedShape(self):
+        fixed = {'semimajor': 4.0, 'semiminor': 3.0, 'theta': 0.4}
+        fit = fitgaussian(self.mygauss, self.initial, fixed=fixed)
+        for param in FIT_PARAMS:
+            self.assertAlmostEqual(fit[param], self.params[param], places=4)
+
+    def testFixedPosition(self):
+        fixed = {'xbar': 19.3, 'ybar': 20.6}
+        fit = fitgaussian(self.mygauss, self.initial, fixed=fixed)
+        self.assertAlmostEqual(fit['peak'], 5.0, places=4)
+        self.assertAlmostEqual(fit['semimajor'], 4.0, places=4)
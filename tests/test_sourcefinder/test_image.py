@@ -1,13 +1,19 @@
 import numpy as np
 import os
+import cPickle
+import shutil
+import tempfile
 
 import unittest
 
 from tkp.testutil.decorators import requires_data
 import tkp.sourcefinder
 from tkp.sourcefinder import image as sfimage
+from tkp.sourcefinder import mapcache
 from tkp import accessors
 from tkp.utility.uncertain import Uncertain
+from tkp.utility.coordinates import WCS
+from tkp.utility.containers import ColumnarExtractionResults
 from tkp.testutil.data import DATAPATH
 from tkp.testutil.data import fits_file
 
@@ -15,6 +21,28 @@ BOX_IN_BEAMPIX = 10 #HARDCODING - FIXME! (see also monitoringlist recipe)
 
 GRB120422A = os.path.join(DATAPATH, "sourcefinder/GRB120422A-120429.fits")
 
+def synthetic_image():
+    """
+    Noise with a number of point sources, and a simple WCS.
+    """
+    np.random.seed(3)
+    data = np.random.normal(scale=0.001, size=(256, 256))
+    x, y = np.indices(data.shape)
+    for xpos, ypos in np.random.uniform(20, 236, (15, 2)):
+        data += 0.05 * np.exp(-((x - xpos)**2 + (y - ypos)**2) / 8.)
+    # A blend, to be separated by deblending.
+    data += 0.03 * np.exp(-((x - 100)**2 + (y - 30)**2) / 8.)
+    data += 0.03 * np.exp(-((x - 106)**2 + (y - 30)**2) / 8.)
+    wcs = WCS()
+    wcs.cdelt = (-0.01, 0.01)
+    wcs.crota = (0.0, 0.0)
+    wcs.crpix = (129, 129)
+    wcs.crval = (15.0, 50.0)
+    wcs.ctype = ('RA---SIN', 'DEC--SIN')
+    wcs.cunit = ('deg', 'deg')
+    return data, wcs
+
+
 class TestNumpySubroutines(unittest.TestCase):
     def testBoxSlicing(self):
         """
@@ -42,6 +70,315 @@ class TestNumpySubroutines(unittest.TestCase):
                               list(chunk_3_by_3_round_down.reshape(9))
                               )
 
+class TestBackgroundGrids(unittest.TestCase):
+    """
+    Check the batched background grid engine against the per-cell loop.
+    """
+    def setUp(self):
+        np.random.seed(42)
+        data = np.random.normal(loc=0.01, scale=0.002, size=(200, 230))
+        # A few bright pixels to make the clipping iterate, and a corner of
+        # zeroes which should end up masked in the grids.
+        data[np.random.randint(0, 200, 50), np.random.randint(0, 230, 50)] = 1.
+        data[:40, :50] = 0.
+        self.image = sfimage.ImageData(data, (1.5, 1.5, 0.), None,
+                                       back_size_x=32, back_size_y=32)
+        self.image.data[100:180, 10:20] = np.ma.masked
+
+    def testBatchedMatchesPerCell(self):
+        rms_loop, bg_loop = self.image._per_cell_grids(self.image.data)
+        rms_loop = np.ma.array(rms_loop, mask=(np.array(rms_loop) == False))
+        bg_loop = np.ma.array(bg_loop, mask=(np.array(bg_loop) == False))
+        rms, bg = self.image._batched_grids(self.image.data)
+        self.assertEqual(rms.shape, (7, 8))
+        self.assertTrue(rms_loop.mask[0, 0])
+        self.assertListEqual(list(rms_loop.mask.ravel()),
+                             list((rms == 0).ravel()))
+        self.assertListEqual(list(bg_loop.mask.ravel()),
+                             list((bg == 0).ravel()))
+        self.assertTrue(np.allclose(rms_loop.filled(0), rms,
+                                    rtol=1e-12, atol=0))
+        self.assertTrue(np.allclose(bg_loop.filled(0), bg,
+                                    rtol=1e-12, atol=0))
+
+
+class TestInterpolation(unittest.TestCase):
+    """
+    Interpolated maps equal those of ndimage.map_coordinates().
+    """
+    def setUp(self):
+        np.random.seed(7)
+        data = np.ma.array(np.random.normal(size=(150, 170)))
+        data[:20] = np.ma.masked
+        data[:, 160:] = np.ma.masked
+        self.image = sfimage.ImageData(data, (1.5, 1.5, 0.), None,
+                                       back_size_x=32, back_size_y=32)
+
+    def reference(self, grid):
+        from scipy import ndimage
+        my_xdim, my_ydim = 130, 160
+        return ndimage.map_coordinates(
+            grid, np.mgrid[-0.5:-0.5 + my_xdim / 32.:my_xdim * 1j,
+                           -0.5:-0.5 + my_ydim / 32.:my_ydim * 1j],
+            mode='nearest', order=1)
+
+    def testMap(self):
+        grid = self.image.grids['bg']
+        bgmap = self.image._interpolate(grid)
+        self.assertTrue(bgmap.mask[:20].all())
+        self.assertTrue(bgmap.mask[:, 160:].all())
+        self.assertFalse(bgmap.mask[20:, :160].any())
+        self.assertTrue((bgmap[20:, :160] == self.reference(grid)).all())
+
+    def testBlocks(self):
+        grid = self.image.grids['rms']
+        rmsmap = self.image._interpolate(grid, roundup=True)
+        block = sfimage.INTERPOLATE_BLOCK
+        sfimage.INTERPOLATE_BLOCK = 1000
+        try:
+            self.assertTrue(
+                (self.image._interpolate(grid, roundup=True) == rmsmap).all())
+        finally:
+            sfimage.INTERPOLATE_BLOCK = block
+        self.assertTrue(rmsmap.min() >= grid.min())
+
+
+class TestParallelExtraction(unittest.TestCase):
+    """
+    Fitting islands in several processes gives the same results as serially.
+    """
+    def setUp(self):
+        self.data, self.wcs = synthetic_image()
+
+    def extract(self, **kwargs):
+        image = sfimage.ImageData(self.data, (2.0, 2.0, 0.), self.wcs)
+        results = image.extract(det=5, anl=3, **kwargs)
+        return ([r.serialize(0, 0) for r in results],
+                image.residuals_from_gauss_fitting)
+
+    def testSameResults(self):
+        for deblend_nthresh in (0, 32):
+            serial, serial_residuals = self.extract(
+                deblend_nthresh=deblend_nthresh)
+            parallel, parallel_residuals = self.extract(
+                deblend_nthresh=deblend_nthresh, workers=2)
+            self.assertTrue(len(serial) >= 15)
+            self.assertEqual(serial, parallel)
+            self.assertTrue((serial_residuals == parallel_residuals).all())
+
+    def tearDown(self):
+        sfimage.close_fitting_pools()
+
+    def testPoolReused(self):
+        self.extract(workers=2)
+        pool = sfimage._fitting_pool(2)
+        self.extract(workers=2)
+        self.assertIs(sfimage._fitting_pool(2), pool)
+
+    def testPoolsClosed(self):
+        self.extract(workers=2)
+        self.extract(workers=3)
+        # Only the pool of the last size is kept.
+        self.assertEqual(sfimage._fitting_pools.keys(), [(os.getpid(), 3)])
+        sfimage.close_fitting_pools()
+        self.assertEqual(sfimage._fitting_pools, {})
+
+
+class TestLabelIslands(unittest.TestCase):
+    """
+    Islands are selected within their bounding boxes.
+    """
+    def setUp(self):
+        self.data, self.wcs = synthetic_image()
+        x, y = np.indices(self.data.shape)
+        # A faint source, above the analysis threshold only.
+        self.data += 0.004 * np.exp(-((x - 200)**2 + (y - 200)**2) / 8.)
+        self.image = sfimage.ImageData(self.data, (2.0, 2.0, 0.), self.wcs)
+
+    def testLabels(self):
+        rmsmap = self.image.rmsmap
+        labels, labelled = self.image.label_islands(5 * rmsmap, 3 * rmsmap)
+        self.assertTrue(len(labels) >= 15)
+        self.assertEqual(sorted(set(labelled[labelled > 0])), labels)
+        # The faint source is dropped, and no pixels below the analysis
+        # threshold are selected.
+        self.assertEqual(labelled[200, 200], 0)
+        self.assertFalse(
+            (self.image.data_bgsubbed[labelled > 0] <= 3 * rmsmap[labelled > 0]).any())
+
+    def testMasked(self):
+        self.image.data[90:110, 20:40] = np.ma.masked
+        rmsmap = self.image.rmsmap
+        labels, labelled = self.image.label_islands(5 * rmsmap, 3 * rmsmap)
+        self.assertFalse(labelled[90:110, 20:40].any())
+        results = self.image.extract(det=5, anl=3)
+        for result in results:
+            self.assertFalse(90 <= result.x < 110 and 20 <= result.y < 40)
+
+
+class TestSinglePrecision(unittest.TestCase):
+    """
+    Images held in single precision give the same sources, within rounding.
+    """
+    def setUp(self):
+        self.data, self.wcs = synthetic_image()
+
+    def extract(self, dtype):
+        image = sfimage.ImageData(self.data, (2.0, 2.0, 0.), self.wcs,
+                                  dtype=dtype)
+        results = image.extract(det=5, anl=3, deblend_nthresh=32)
+        for full_size_map in (image.data, image.backmap, image.rmsmap,
+                              image.data_bgsubbed,
+                              image.residuals_from_gauss_fitting):
+            self.assertEqual(full_size_map.dtype, np.dtype(dtype))
+        return sorted(results, key=lambda result: result.x.value)
+
+    def testSameSources(self):
+        double = self.extract('float64')
+        single = self.extract('float32')
+        self.assertTrue(len(double) >= 15)
+        self.assertEqual(len(single), len(double))
+        for s, d in zip(single, double):
+            for attribute in ('x', 'y', 'peak', 'flux', 'smaj', 'smin'):
+                self.assertAlmostEqual(getattr(s, attribute).value,
+                                       getattr(d, attribute).value, places=5)
+                self.assertAlmostEqual(getattr(s, attribute).error,
+                                       getattr(d, attribute).error, places=5)
+            self.assertAlmostEqual(s.ra.value, d.ra.value, places=7)
+            self.assertAlmostEqual(s.dec.value, d.dec.value, places=7)
+
+
+class TestMapCache(unittest.TestCase):
+    """
+    Maps read from the map cache are those calculated for the same image.
+    """
+    def setUp(self):
+        self.data, self.wcs = synthetic_image()
+        self.directory = tempfile.mkdtemp()
+        self.cache = mapcache.MapCache(os.path.join(self.directory, 'maps'),
+                                       max_bytes=2**30)
+        # The image is only used for the key of its maps.
+        self.url = os.path.join(self.directory, 'image.fits')
+        open(self.url, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def maps(self, params):
+        image = sfimage.ImageData(self.data, (2.0, 2.0, 0.), self.wcs,
+            map_cache=self.cache.image(self.url, params))
+        return image.backmap, image.rmsmap
+
+    def testHit(self):
+        calculated = self.maps((32, 32))
+        cached = self.maps((32, 32))
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(self.cache.hits, 2)
+        for c, m in zip(cached, calculated):
+            self.assertTrue((np.ma.getdata(c) == np.ma.getdata(m)).all())
+            self.assertTrue((np.ma.getmaskarray(c) ==
+                             np.ma.getmaskarray(m)).all())
+
+    def testOtherParameters(self):
+        self.maps((32, 32))
+        self.maps((16, 16))
+        self.assertEqual(self.cache.hits, 0)
+
+    def testEviction(self):
+        self.cache.max_bytes = 0
+        self.maps((32, 32))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def testNotLocal(self):
+        self.assertIsNone(self.cache.image(
+            os.path.join(self.directory, 'missing.fits'), (32, 32)))
+
+    def testDirectoryChanged(self):
+        # A file inside an image directory is rewritten, as in a CASA image.
+        image_dir = os.path.join(self.directory, 'image')
+        os.mkdir(image_dir)
+        table = os.path.join(image_dir, 'table.f0')
+        open(table, 'w').close()
+        os.utime(image_dir, (1000, 1000))
+        os.utime(table, (1000, 1000))
+        before = self.cache.image(image_dir, (32, 32)).key
+        # Opening the image writes its lock file.
+        lock = os.path.join(image_dir, 'table.lock')
+        open(lock, 'w').close()
+        os.utime(lock, (3000, 3000))
+        os.utime(image_dir, (1000, 1000))
+        self.assertEqual(self.cache.image(image_dir, (32, 32)).key, before)
+        os.utime(table, (2000, 2000))
+        after = self.cache.image(image_dir, (32, 32)).key
+        self.assertNotEqual(before, after)
+
+
+class TestBatchedForcedFits(unittest.TestCase):
+    """
+    Forced fits of fixed position and shape, fitted in bulk.
+    """
+    def setUp(self):
+        data, wcs = synthetic_image()
+        self.image = sfimage.ImageData(data, (2.0, 2.0, 0.), wcs)
+        # Positions of the sources, a few random ones and one off the image.
+        pixels = [(r.x.value, r.y.value) for r in
+                  self.image.extract(det=5, anl=3)]
+        pixels += [(50.3, 70.8), (200.1, 10.9), (128.5, 254.6), (300., 100.)]
+        self.positions = [wcs.p2s(pixel) for pixel in pixels]
+
+    def testSameAsFitToPoint(self):
+        boxsize = 10
+        fits, ids = self.image.fit_fixed_positions(
+            self.positions, boxsize, ids=range(len(self.positions)))
+        self.assertEqual(ids, range(len(self.positions) - 1))
+        for fit, position in zip(fits, self.positions):
+            x, y = self.image.wcs.s2p(position)
+            reference = self.image.fit_to_point(x, y, boxsize, None,
+                                                'position+shape')
+            for value, reference_value in zip(fit.serialize(0, 0),
+                                              reference.serialize(0, 0)):
+                if isinstance(value, float):
+                    self.assertAlmostEqual(value, reference_value, places=5)
+                else:
+                    self.assertEqual(value, reference_value)
+
+    def testFixedPosition(self):
+        # Shape free: done one by one with the non-linear fitter.
+        fits = self.image.fit_fixed_positions(self.positions, 10,
+                                              fixed='position')
+        self.assertEqual(len(fits), len(self.positions) - 1)
+
+
+class TestColumnarResults(unittest.TestCase):
+    """
+    Columnar results serialize as the detections they were made from.
+    """
+    def setUp(self):
+        data, wcs = synthetic_image()
+        image = sfimage.ImageData(data, (2.0, 2.0, 0.), wcs)
+        self.detections = image.extract(det=5, anl=3)
+        # A moments-only measurement has no chi-squared.
+        self.detections[0].chisq = None
+        self.detections[0].reduced_chisq = None
+
+    def testSerialize(self):
+        results = ColumnarExtractionResults.from_detections(
+            self.detections, 1.5, 2.5)
+        self.assertEqual(len(results), len(self.detections))
+        self.assertEqual(list(results),
+                         [det.serialize(1.5, 2.5) for det in self.detections])
+        self.assertEqual(list(results)[0][16:], [None, None])
+
+    def testPickle(self):
+        results = ColumnarExtractionResults.from_detections(self.detections)
+        pickled = cPickle.dumps(results, cPickle.HIGHEST_PROTOCOL)
+        self.assertTrue(len(pickled) < 1.1 * results.data.nbytes + 200)
+        unpickled = cPickle.loads(pickled)
+        self.assertEqual(unpickled.serialize(), results.serialize())
+        empty = cPickle.loads(cPickle.dumps(ColumnarExtractionResults()))
+        self.assertEqual(len(empty), 0)
+
+
 class TestMapsType(unittest.TestCase):
     """
     Check that rms, bg maps are of correct type.
@@ -5,6 +5,7 @@ from tkp.utility.uncertain import Uncertain
 
 import unittest
 
+from tkp.sourcefinder import utils
 from tkp.sourcefinder.utils import maximum_pixel_method_variance, fudge_max_pix
 from tkp.sourcefinder.utils import generate_result_maps
 from tkp.sourcefinder.utils import circular_mask
@@ -66,6 +67,28 @@ class UtilsTest(unittest.TestCase):
         for (semimajor, semiminor, theta, correction, variance) in self.correct_data:
             self.assertAlmostEqual(fudge_max_pix(semimajor, semiminor, theta), correction)
 
+    def testBeamCache(self):
+        semimajor, semiminor, theta, correction, variance = self.correct_data[0]
+        fudge_max_pix.cache.clear()
+        first = fudge_max_pix(semimajor, semiminor, theta)
+        self.assertEqual(fudge_max_pix.cache.keys(),
+                         [(semimajor, semiminor, theta)])
+        self.assertEqual(fudge_max_pix(semimajor, semiminor, theta), first)
+        self.assertEqual(len(fudge_max_pix.cache), 1)
+
+    def testBeamCacheSize(self):
+        cache_size = utils.BEAM_CACHE_SIZE
+        utils.BEAM_CACHE_SIZE = 2
+        try:
+            fudge_max_pix.cache.clear()
+            for (semimajor, semiminor, theta, correction, variance) in self.correct_data:
+                fudge_max_pix(semimajor, semiminor, theta)
+        finally:
+            utils.BEAM_CACHE_SIZE = cache_size
+        # The least recently used beam was dropped.
+        self.assertEqual(fudge_max_pix.cache.keys(),
+                         [tuple(beam[:3]) for beam in self.correct_data[1:]])
+
 
 class SubthresholdingTest(unittest.TestCase):
     def test_ranges(self):
@@ -0,0 +1,106 @@
+import sys
+import numpy
+from numpy.testing import assert_array_equal
+
+import unittest
+
+from tkp.sourcefinder.stats import sigma_clip, sigma_clip_cells
+
+
+BEAM = (1.5, 1.5, 0.)
+
+
+class TestSigmaClip(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(7)
+        self.data = rng.normal(loc=1.0, scale=0.1, size=5000)
+        self.data[rng.randint(0, 5000, 40)] += 10.
+
+    def test_clips_outliers(self):
+        clipped, sigma, centre, its, converged = sigma_clip(
+            self.data, BEAM, full_output=True)
+        self.assertTrue(converged)
+        self.assertTrue(its > 0)
+        self.assertTrue(clipped.max() < 2.)
+        self.assertAlmostEqual(sigma, 0.1, places=2)
+        self.assertAlmostEqual(centre, numpy.median(self.data), places=2)
+
+    def test_default_output(self):
+        self.assertEqual(len(sigma_clip(self.data, BEAM)), 4)
+
+    def test_input_unchanged(self):
+        original = self.data.copy()
+        sigma_clip(self.data, BEAM)
+        assert_array_equal(self.data, original)
+
+    def test_masked_input(self):
+        masked = numpy.ma.array(self.data, mask=(self.data > 5.))
+        clipped, sigma, centre, its = sigma_clip(masked, BEAM)
+        self.assertTrue(len(clipped) <= len(masked.compressed()))
+        self.assertTrue(clipped.max() < 2.)
+
+    def test_max_iter(self):
+        # A hard limit of 0.5 sigma clips away data on every iteration.
+        clipped, sigma, centre, its, converged = sigma_clip(
+            self.data, BEAM, sigma=0.5, max_iter=3, full_output=True)
+        self.assertEqual(its, 3)
+        self.assertFalse(converged)
+        self.assertTrue(0 < len(clipped) < len(self.data))
+
+    def test_no_recursion(self):
+        # Many iterations must not run into the recursion limit.
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(100)
+        try:
+            clipped, sigma, centre, its = sigma_clip(
+                self.data, BEAM, sigma=0.9, max_iter=500)
+        finally:
+            sys.setrecursionlimit(limit)
+        self.assertTrue(its > 0)
+
+    def test_too_small(self):
+        clipped, sigma, centre, its, converged = sigma_clip(
+            numpy.ones(3), (10., 10., 0.), full_output=True)
+        self.assertEqual(len(clipped), 0)
+        self.assertFalse(converged)
+
+    def test_all_clipped(self):
+        # A negative hard limit clips every pixel.
+        clipped, sigma, centre, its, converged = sigma_clip(
+            self.data, BEAM, sigma=-1., full_output=True)
+        self.assertEqual(len(clipped), 0)
+        self.assertFalse(converged)
+
+    def test_custom_functions(self):
+        clipped, sigma, centre, its = sigma_clip(
+            self.data, BEAM, centref=numpy.mean, distf=numpy.var)
+        self.assertTrue(clipped.max() < 2.)
+
+
+class TestSigmaClipCells(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(11)
+        data = rng.normal(loc=0.01, scale=0.002, size=(20, 1024))
+        data[rng.randint(0, 20, 60), rng.randint(0, 1024, 60)] = 1.
+        self.cells = numpy.ma.array(data, mask=(rng.uniform(size=data.shape) < 0.1))
+
+    def test_matches_sigma_clip(self):
+        for sigma in (0.5, 2.):
+            count, std, centre, mean, its = sigma_clip_cells(
+                self.cells, BEAM, sigma=sigma)
+            for i, cell in enumerate(self.cells):
+                clipped, c_std, c_centre, c_its = sigma_clip(
+                    cell, BEAM, sigma=sigma)
+                self.assertEqual(count[i], len(clipped))
+                self.assertEqual(its[i], c_its)
+                self.assertEqual(centre[i], c_centre)
+                self.assertTrue(numpy.allclose(std[i], c_std, rtol=1e-10))
+                self.assertTrue(numpy.allclose(mean[i], clipped.mean(),
+                                               rtol=1e-10))
+
+    def test_all_clipped(self):
+        # A negative hard limit clips every pixel, as in sigma_clip().
+        count, std, centre, mean, its = sigma_clip_cells(
+            self.cells, BEAM, sigma=-1.)
+        self.assertFalse(count.any())
+        self.assertFalse(its.any())
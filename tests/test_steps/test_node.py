@@ -0,0 +1,53 @@
+import unittest
+from ConfigParser import SafeConfigParser
+import tkp.accessors
+import tkp.steps.node
+import tkp.steps.source_extraction
+from tkp.config import parse_to_dict, initialize_pipeline_config
+from tkp.testutil.decorators import requires_data
+from tkp.testutil.data import default_job_config, default_pipeline_config
+from tkp.testutil.data import fits_file
+
+
+@requires_data(fits_file)
+class TestNode(unittest.TestCase):
+    def setUp(self):
+        config = SafeConfigParser()
+        config.read(default_job_config)
+        self.job_config = parse_to_dict(config)
+        pipe_config = initialize_pipeline_config(default_pipeline_config,
+                                                 job_name="test_node")
+        self.image_cache_pars = pipe_config['image_cache']
+        # Quality bounds which accept the test image
+        quality = self.job_config['quality_lofar']
+        quality['low_bound'] = 0
+        quality['high_bound'] = float('inf')
+        quality['oversampled_x'] = float('inf')
+        quality['elliptical_x'] = float('inf')
+        quality['min_separation'] = 0
+
+    def test_image_timestamp(self):
+        timestamp = tkp.steps.node.image_timestamp(fits_file)
+        self.assertEqual(timestamp,
+                         tkp.accessors.open(fits_file).taustart_ts)
+
+    def test_process_image(self):
+        results = tkp.steps.node.process_image(fits_file,
+                                               self.image_cache_pars,
+                                               self.job_config)
+        self.assertIn('rms_qc', results.metadata)
+        self.assertIsNone(results.rejected)
+        extraction_params = self.job_config.source_extraction
+        expected = tkp.steps.source_extraction.extract_sources(
+            fits_file, extraction_params)
+        self.assertEqual(len(results.extraction.sources),
+                         len(expected.sources))
+
+    def test_process_rejected_image(self):
+        # An RMS bound far above the noise of the image rejects it
+        self.job_config['quality_lofar']['low_bound'] = 1e12
+        results = tkp.steps.node.process_image(fits_file,
+                                               self.image_cache_pars,
+                                               self.job_config)
+        self.assertIsNotNone(results.rejected)
+        self.assertIsNone(results.extraction)
@@ -2,6 +2,7 @@ import unittest
 from ConfigParser import SafeConfigParser
 import tkp.steps.quality
 import tkp.accessors
+import tkp.db.quality
 from tkp.telescope.lofar.quality import reject_check_lofar
 from tkp.testutil.decorators import requires_data
 from tkp.testutil.data import default_job_config
@@ -24,3 +25,10 @@ class TestQuality(unittest.TestCase):
         self.accessor._tau_time = 0
         result = reject_check_lofar(self.accessor, self.job_config)
         self.assertTrue(result)
+
+    def test_stored_rms(self):
+        # An RMS far below the theoretical noise, as if it had been stored
+        # for this image by the persistence step, rejects the image.
+        result = reject_check_lofar(self.accessor, self.job_config,
+                                    rms_qc=1e-12)
+        self.assertEqual(result[0], tkp.db.quality.reason['rms'].id)
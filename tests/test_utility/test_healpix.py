@@ -0,0 +1,90 @@
+import math
+import unittest
+
+import numpy
+
+from tkp.utility import healpix
+
+
+def random_vectors(n, seed):
+    rng = numpy.random.RandomState(seed)
+    v = rng.normal(size=(3, n))
+    return v / numpy.sqrt((v ** 2).sum(axis=0))
+
+
+class TestPixels(unittest.TestCase):
+    def test_known_pixels(self):
+        # As calculated by the HEALPix library, for nside 4096 and 1.
+        known = [((0, 0, 1), 16777215, 0),
+                 ((0, 0, -1), 134217728, 8),
+                 ((1, 0, 0), 74099370, 4),
+                 ((0, 1, 0), 90876586, 5),
+                 ((-0.5, -0.5, 0.70710678), 46186496, 2)]
+        for (x, y, z), pix12, pix0 in known:
+            self.assertEqual(healpix.xyz2nest(x, y, z), pix12)
+            self.assertEqual(healpix.xyz2nest(x, y, z, order=0), pix0)
+
+    def test_nested(self):
+        # The parent of the pixel of a position at order k is its pixel at
+        # order k - 1.
+        x, y, z = random_vectors(10000, seed=1)
+        for order in (1, 5, 12):
+            self.assertTrue((healpix.xyz2nest(x, y, z, order) >> 2 ==
+                             healpix.xyz2nest(x, y, z, order - 1)).all())
+
+    def test_centres(self):
+        for order in (0, 2, 4):
+            pix = numpy.arange(healpix.npix(order))
+            x, y, z = healpix.nest2xyz(pix, order)
+            self.assertTrue(numpy.allclose(x ** 2 + y ** 2 + z ** 2, 1))
+            self.assertEqual(healpix.xyz2nest(x, y, z, order).tolist(),
+                             pix.tolist())
+
+    def test_radec(self):
+        self.assertEqual(healpix.radec2nest(90., 0.),
+                         healpix.xyz2nest(0, 1, 0))
+
+
+class TestDiscRanges(unittest.TestCase):
+    def check(self, ra, decl, radius):
+        ra, decl = math.radians(ra), math.radians(decl)
+        centre = numpy.array([math.cos(decl) * math.cos(ra),
+                              math.cos(decl) * math.sin(ra),
+                              math.sin(decl)])
+        ranges = healpix.disc_ranges(centre[0], centre[1], centre[2], radius)
+        self.assertTrue((ranges[:, 0] <= ranges[:, 1]).all())
+        self.assertTrue((ranges[1:, 0] > ranges[:-1, 1] + 1).all())
+
+        # Random positions in the disc, including close to its edge.
+        v = random_vectors(20000, seed=2)
+        v = centre[:, numpy.newaxis] + v * math.radians(radius)
+        v /= numpy.sqrt((v ** 2).sum(axis=0))
+        inside = numpy.degrees(numpy.arccos(numpy.clip(
+            centre.dot(v), -1, 1))) <= radius
+        pix = healpix.xyz2nest(*v[:, inside])
+        index = numpy.searchsorted(ranges[:, 0], pix, side='right') - 1
+        self.assertTrue((index >= 0).all())
+        self.assertTrue((pix <= ranges[index, 1]).all())
+
+    def test_small(self):
+        self.check(123., 30., 0.01)
+
+    def test_field(self):
+        self.check(123., 30., 5.)
+
+    def test_meridian(self):
+        self.check(0.5, -10., 3.)
+
+    def test_pole(self):
+        self.check(10., 89.5, 2.)
+
+    def test_whole_sky(self):
+        ranges = healpix.disc_ranges(1, 0, 0, 180.)
+        self.assertEqual(ranges.tolist(),
+                         [[0, healpix.npix(healpix.ORDER) - 1]])
+
+    def test_merge(self):
+        ranges = [[10, 20], [0, 4], [21, 25], [15, 18], [30, 30]]
+        self.assertEqual(healpix.merge_ranges(ranges).tolist(),
+                         [[0, 4], [10, 25], [30, 30]])
+        self.assertEqual(healpix.merge_ranges([]).shape, (0, 2))
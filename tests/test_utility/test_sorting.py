@@ -2,7 +2,7 @@ import unittest
 from collections import namedtuple
 from datetime import datetime, timedelta
 import random
-from tkp.steps.misc import group_per_timestep
+from tkp.steps.misc import group_per_timestep, group_urls_per_timestep
 
 MockOrmImage = namedtuple('MockOrmImage', ['taustart_ts', 'freq_eff', 'stokes'])
 
@@ -47,3 +47,11 @@ class TestSorting(unittest.TestCase):
         should_be = create_output()
         evaluated = group_per_timestep(input)
         self.assertEqual(should_be, evaluated)
+
+    def test_url_sorting(self):
+        later = now + timedelta(hours=1)
+        urls = ['a.fits', 'b.fits', 'c.fits', 'd.fits', 'e.fits']
+        timestamps = [later, now, None, later, now]
+        self.assertEqual(group_urls_per_timestep(urls, timestamps),
+                         [(now, ['b.fits', 'e.fits']),
+                          (later, ['a.fits', 'd.fits'])])
@@ -1,5 +1,7 @@
 import unittest
 
+import numpy
+
 from tkp.utility import coordinates
 from tkp.sourcefinder import extract
 from tkp.utility.uncertain import Uncertain
@@ -109,6 +111,31 @@ class wcsSin(unittest.TestCase):
             result = map(round, self.wcs.s2p(spatial))
             self.assertEqual(result, pixel)
 
+    def testPixelToSpatialMany(self):
+        ra, dec = self.wcs.p2s_many([pixel for pixel, spatial in self.known_values])
+        for i, (pixel, spatial) in enumerate(self.known_values):
+            self.assertAlmostEqual(ra[i], spatial[0], nod)
+            self.assertAlmostEqual(dec[i], spatial[1], nod)
+
+    def testSpatialToPixelMany(self):
+        x, y = self.wcs.s2p_many([spatial for pixel, spatial in self.known_values])
+        for i, (pixel, spatial) in enumerate(self.known_values):
+            self.assertEqual([round(x[i]), round(y[i])], pixel)
+
+    def testInvalidMany(self):
+        # A position far outside the projection gives NaN rather than an
+        # error, without affecting the other positions.
+        self.assertRaises(RuntimeError, self.wcs.p2s, [1e5, 1e5])
+        ra, dec = self.wcs.p2s_many([[1442.0, 1442.0], [1e5, 1e5]])
+        self.assertAlmostEqual(ra[0], 350.785563529949, nod)
+        self.assertAlmostEqual(dec[0], 58.848317299883, nod)
+        self.assertTrue(numpy.isnan(ra[1]) and numpy.isnan(dec[1]))
+
+    def testEmptyMany(self):
+        ra, dec = self.wcs.p2s_many([])
+        self.assertEqual(len(ra), 0)
+        self.assertEqual(len(dec), 0)
+
     def testSanity(self):
         import random
         pixel = [random.randrange(500, 1500), random.randrange(500, 1500)]
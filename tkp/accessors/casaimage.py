@@ -23,7 +23,10 @@ class CasaImage(DataAccessor):
         super(CasaImage, self).__init__()
         self.url = url
         self.table = pyrap_table(self.url.encode(), ack=False)
-        self.data = self.parse_data(plane)
+        # The data is only read when first used, so that metadata and parts
+        # of the image (see read_window()) can be read without it.
+        self.plane = plane
+        self._data = None
         self.wcs = self.parse_coordinates()
         self.centre_ra, self.centre_decl = self.parse_phase_centre()
         self.freq_eff, self.freq_bw = self.parse_frequency()
@@ -37,6 +40,55 @@ class CasaImage(DataAccessor):
             bmaj, bmin, bpa, self.pixelsize[0], self.pixelsize[1])
 
 
+    @property
+    def data(self):
+        """Image data, read from the table when first used."""
+        if self._data is None:
+            self._data = self.parse_data(self.plane)
+        return self._data
+
+    @property
+    def shape(self):
+        """The shape of the image data, read from the table description."""
+        return tuple(reversed(self._map_shape()[-2:]))
+
+    def _map_shape(self):
+        """The shape of the map stored in the table, in numpy order."""
+        shape = self.table.getcolshapestring('map', 0, 1)
+        if isinstance(shape, list):
+            shape = shape[0]
+        return [int(length) for length in shape.strip('[]').split(',')]
+
+    def read_window(self, window):
+        """
+        Read the pixel values within a window of the image.
+
+        Only the window is read from the table, with getcellslice(). The
+        plane is selected as by parse_data(). See
+        :meth:`DataAccessor.read_window`.
+        """
+        if self._data is not None:
+            return self._data[window]
+        map_shape = self._map_shape()
+        xstart, xstop, xstep = window[0].indices(map_shape[-1])
+        ystart, ystop, ystep = window[1].indices(map_shape[-2])
+        if xstop <= xstart or ystop <= ystart or (xstep, ystep) != (1, 1):
+            return self.data[window]
+        # As in parse_data(), the plane is taken along the first of any
+        # further axes which are longer than one.
+        blc = []
+        plane = self.plane
+        for length in map_shape[:-2]:
+            if length > 1 and plane is not None:
+                blc.append(plane)
+                plane = None
+            else:
+                blc.append(0)
+        trc = blc + [ystop - 1, xstop - 1]
+        blc = blc + [ystart, xstart]
+        data = self.table.getcellslice('map', 0, blc, trc)
+        return data.reshape(ystop - ystart, xstop - xstart).transpose()
+
     def parse_data(self, plane=0):
         """extract and massage data from CASA table"""
         data = self.table[0]['map'].squeeze()
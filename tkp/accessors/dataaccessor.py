@@ -1,5 +1,5 @@
 import logging
-from tkp.quality.statistics import rms_with_clipped_subregion
+from tkp.quality.statistics import clipped_rms, subregion_window
 from tkp.accessors.requiredatts import RequiredAttributesMetaclass
 from math import degrees, sqrt, sin, pi, cos
 
@@ -53,7 +53,9 @@ class DataAccessor(object):
             centre_decl (float): Declination at the central pixel of the image.
                 Units of J2000 decimal degrees.
             data(numpy.ndarray): Two dimensional numpy.ndarray of floating point
-                pixel values.
+                pixel values, in the type in which they are stored: this may
+                be single precision, or big-endian as in FITS files. Convert
+                it where a particular type is needed.
                 (TODO: Definitive statement on orientation/transposing.)
             freq_bw(float): The frequency bandwidth of this image in Hz.
             freq_eff(float): Effective frequency of the image in Hz.
@@ -71,10 +73,51 @@ class DataAccessor(object):
                 describing the mapping from data pixels to sky-coordinates.
 
         The class also provides some common functionality:
-        static methods used for parsing datafiles, and an 'extract_metadata'
-        function which provides key info in a simple dict format.
+        static methods used for parsing datafiles, an 'extract_metadata'
+        function which provides key info in a simple dict format,
+        'read_window', which reads part of the image only, and 'close'.
         """
 
+    def close(self):
+        """
+        Release the file handles and memory maps held for the image. Its
+        data may not be used afterwards.
+
+        Accessors which keep their image open override this.
+        """
+        pass
+
+    @property
+    def shape(self):
+        """The shape of the image data, (x, y)."""
+        return self.data.shape
+
+    def read_window(self, window):
+        """
+        Read the pixel values within a window of the image.
+
+        Args:
+            window (tuple): two slices, selecting ranges along the x and y
+                axes of the image data.
+
+        Returns:
+            numpy.ndarray: the same as data[window].
+
+        Accessors which can read part of an image from disk, without reading
+        all of it, override this.
+        """
+        return self.data[window]
+
+    def rms_with_clipped_subregion(self, rms_est_sigma=3, rms_est_fraction=4):
+        """
+        RMS for quality-control.
+
+        See :func:`tkp.quality.statistics.rms_with_clipped_subregion`. Only
+        the central subsection of the image is read.
+        """
+        window = subregion_window(self.shape, rms_est_fraction)
+        return clipped_rms(self.read_window(window), rms_est_sigma)
+
     def extract_metadata(self):
         """
         Massage the class attributes into a flat dictionary with
@@ -35,17 +35,22 @@ casa_telescope_keyword_mapping = {
 }
 
 
-def isfits(filename):
-    """returns True if filename is a fits file"""
+def fits_header(filename):
+    """returns the primary header of filename, or None if it is not a fits
+    file"""
     if not os.path.isfile(filename):
-        return False
+        return None
     if filename[-4:].lower() != 'fits':
-        return False
+        return None
     try:
-        pyfits.open(filename)
+        return pyfits.getheader(filename)
     except IOError:
-        return False
-    return True
+        return None
+
+
+def isfits(filename):
+    """returns True if filename is a fits file"""
+    return fits_header(filename) is not None
 
 
 def iscasa(filename):
@@ -79,15 +84,17 @@ def islofarhdf5(filename):
     return True
 
 
-def fits_detect(filename):
+def fits_detect(filename, hdr=None):
     """
     Detect which telescope produced FITS data, return corresponding accessor.
 
     Checks for known FITS image types where we expect additional metadata.
     If the telescope is unknown we default to a regular FitsImage.
+
+    The primary header may be passed in as hdr, if it has been read already.
     """
-    hdu = pyfits.open(filename)
-    hdr = hdu[0].header
+    if hdr is None:
+        hdr = pyfits.getheader(filename)
     for fits_test in fits_type_mapping:
         if fits_test.test(hdr):
             return fits_test.accessor
@@ -108,8 +115,9 @@ def casa_detect(filename):
 
 def detect(filename):
     """returns the accessor class that should be used to process filename"""
-    if isfits(filename):
-        return fits_detect(filename)
+    hdr = fits_header(filename)
+    if hdr is not None:
+        return fits_detect(filename, hdr)
     elif iscasa(filename):
         return casa_detect(filename)
     elif islofarhdf5(filename):
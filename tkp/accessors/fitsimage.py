@@ -24,9 +24,14 @@ class FitsImage(DataAccessor):
     def __init__(self, url, plane=None, beam=None, hdu_index=0):
         super(FitsImage, self).__init__()
         self.url = url
-        self.header = self._get_header(hdu_index)
+        # The file is opened only once. Its data is memory-mapped, so that
+        # pixels are read from disk only when, and where, they are used; the
+        # file stays open until close() is called.
+        self._hdulist = pyfits.open(self.url, memmap=True)
+        hdu = self._hdulist[hdu_index]
+        self.header = hdu.header.copy()
         self.wcs = self.parse_coordinates()
-        self.data = self.read_data(hdu_index, plane)
+        self.data = self.read_data(hdu, plane)
         self.taustart_ts, self.tau_time = self.parse_times()
         self.freq_eff, self.freq_bw = self.parse_frequency()
         self.pixelsize = self.parse_pixelsize()
@@ -43,16 +48,20 @@ class FitsImage(DataAccessor):
         if 'TELESCOP' in self.header:
             self.telescope = self.header['TELESCOP']
 
-    def _get_header(self, hdu_index):
-        hdulist = pyfits.open(self.url)
-        hdu = hdulist[hdu_index]
-        return hdu.header.copy()
-
-
+    def close(self):
+        """
+        Close the FITS file, and with it the memory map of the data.
+        """
+        self._hdulist.close()
 
-    def read_data(self, hdu_index, plane):
+    def read_data(self, hdu, plane):
         """
-        Read and store data from our FITS file.
+        Select the image plane from the data of a FITS HDU.
+
+        The data is not copied: the result is a view of the memory-mapped
+        file, of the type in which it is stored there. Consumers which need
+        floating point data of a particular type, such as
+        :class:`tkp.sourcefinder.image.ImageData`, convert it themselves.
 
         NOTE: PyFITS reads the data into an array indexed as [y][x]. We
         take the transpose to make this more intuitively reasonable and
@@ -60,8 +69,7 @@ class FitsImage(DataAccessor):
         before viewing the array with RO.DS9, saving to a FITS file,
         etc.
         """
-        hdu = pyfits.open(self.url)[hdu_index]
-        data = numpy.float64(hdu.data.squeeze())
+        data = hdu.data.squeeze()
         if plane is not None and len(data.shape) > 2:
             data = data[plane].squeeze()
         n_dim = len(data.shape)
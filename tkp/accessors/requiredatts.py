@@ -21,7 +21,9 @@ class RequiredAttributesMetaclass(ABCMeta):
             ]
 
     Then, any inheriting classes will only instantiate if all the required
-    attributes are both defined and not None.
+    attributes are both defined and not None. Attributes provided by a
+    property of the class are not evaluated, so that they can be loaded
+    lazily.
     Defining the inheriting class works as normal, e.g.::
 
         class SomeBasicClass(BasicRequirements):
@@ -64,6 +66,8 @@ class RequiredAttributesMetaclass(ABCMeta):
             if hasattr(cls,'_required_attributes'):
                 required_atts = required_atts.union(cls._required_attributes)
         for attr in required_atts:
+            if isinstance(getattr(obj.__class__, attr, None), property):
+                continue
             if not hasattr(obj,attr) or (getattr(obj,attr) is None):
                 raise NotImplementedError(
                     "Uninitialized attribute: {}\n"
@@ -143,6 +143,7 @@ def handle_args(args=None):
     parser.add_option("--sigmap", action="store_true", help="Generate significance map")
     parser.add_option("--force-beam", action="store_true", help="Force fit axis lengths to beam size")
     parser.add_option("--detection-image", type="string", help="Find islands on different image")
+    parser.add_option("--dtype", default="float64", choices=["float32", "float64"], help="Type of image & maps in memory; float32 halves memory use")
     parser.add_option('--fixed-posns', help="List of position coordinates to "
         "force-fit (decimal degrees, JSON, e.g [[123.4,56.7],[359.9,89.9]]) "
         "(Will not perform blind extraction in this mode)"              ,
@@ -216,6 +217,7 @@ def get_sourcefinder_configuration(options):
         "back_size_y": options.grid,
         "margin": options.margin,
         "radius": options.radius,
+        "dtype": options.dtype,
     }
     if options.residuals or options.islands:
         configuration['residuals'] = True
@@ -6,13 +6,16 @@ from tkp.db.orm import DataSet, Image, ExtractedSource
 
 logger = logging.getLogger(__name__)
 
-def execute(query, parameters={}, commit=False):
+def execute(query, parameters={}, commit=False, prepare=None):
     """
     A generic wrapper for doing any query to the database
 
     :param query: the query string
     :param parameters: The query parameters. These will be converted and escaped.
     :param commit: should a commit be performed afterwards, boolean
+    :param prepare: optional name of a server-side prepared statement for
+        this query, so that it is only planned once per connection. Only
+        used with PostgreSQL; see :meth:`Database.prepared`.
 
     :returns: a database cursor object
     """
@@ -20,6 +23,8 @@ def execute(query, parameters={}, commit=False):
     database = Database()
     cursor = database.connection.cursor()
     try:
+        if prepare and database.engine == 'postgresql':
+            query, parameters = database.prepared(prepare, query, parameters)
         cursor.execute(query, sanitize_db_inputs(parameters))
         if commit:
             database.connection.commit()
@@ -3,13 +3,35 @@ A collection of back end subroutines (mostly SQL queries), In this module we
 deal with source association.
 """
 import logging
+import math
+from collections import namedtuple
 import tkp.db
+from tkp.db.database import StatementRegistry
+from tkp.db import matching
+from tkp.db.general import (copy_rows, empty_temppixelrange,
+                             fill_temppixelrange)
 
 
 logger = logging.getLogger(__name__)
 
+# The queries below are timed, and prepared once per connection. Those which
+# read temprunningcatalog are scaled: its contents differ completely from one
+# image to the next, and a plan made for one image (most likely the first,
+# when the table is nearly empty) can be disastrous for later ones. They are
+# prepared anew for every order of magnitude of its number of rows.
+_statements = StatementRegistry('association_')
 
-def associate_extracted_sources(image_id, deRuiter_r, new_source_sigma_margin):
+
+def log_statement_timings():
+    """
+    Log the number of executions of the association statements and the time
+    spent on them, slowest first.
+    """
+    _statements.log_timings()
+
+
+def associate_extracted_sources(image_id, deRuiter_r, new_source_sigma_margin,
+                                in_memory=False):
     """
     Associate extracted sources with sources detected in the running
     catalog.
@@ -19,8 +41,95 @@ def associate_extracted_sources(image_id, deRuiter_r, new_source_sigma_margin):
 
     The dimensionless distance between two sources is given by the
     "De Ruiter radius", see Chapters 2 & 3 of Scheers' thesis.
+
+    If in_memory is True, the candidate associations are found and the
+    many-to-many associations flagged in Python rather than by the database,
+    see :mod:`tkp.db.matching`. The results are the same.
     """
+    associate_images([image_id], deRuiter_r, new_source_sigma_margin,
+                     in_memory)
+
+
+def group_independent_images(image_ids):
+    """
+    Split images into groups which can be associated together.
+
+    The images of a group are in the same dataset only if the regions
+    around them, within which their extracted sources may be associated,
+    do not overlap; and they either all cross the meridian or none does.
+    The images of different bands in the same skyregion therefore end up in
+    different groups. An image is placed in the first group after all those
+    holding an earlier image which overlaps it, so that associating the
+    groups in turn, with :func:`associate_images`, gives the same results as
+    associating the images one by one in their original order.
+
+    Args:
+        image_ids (list): the ids of the images, in the order in which they
+            would be associated one by one.
 
+    Returns:
+        list of lists of image ids.
+    """
+    _insert_tempimage(image_ids)
+    groups = _group_regions(_image_regions(image_ids))
+    return [[region.image for region in group] for group in groups]
+
+
+# The region around an image within which its extracted sources may be
+# associated: the disc of the given radius (in degrees) around the unit
+# vector x, y, z. q_across is True if the extraction region of the image
+# crosses the ra = 0/360 meridian, in which case the association query
+# needs to take into account sources across it.
+ImageRegion = namedtuple('ImageRegion',
+                         'image dataset x y z radius q_across')
+
+
+def _group_regions(regions):
+    """Group images by their regions, see :func:`group_independent_images`."""
+    groups = []
+    for region in regions:
+        first = 0
+        for n, group in enumerate(groups):
+            if any(_regions_overlap(region, other) for other in group):
+                first = n + 1
+        while (first < len(groups) and
+               groups[first][0].q_across != region.q_across):
+            first += 1
+        if first == len(groups):
+            groups.append([])
+        groups[first].append(region)
+    return groups
+
+
+def _regions_overlap(a, b):
+    """True if the regions of two images in the same dataset overlap."""
+    if a.dataset != b.dataset:
+        return False
+    radius = math.radians(a.radius + b.radius)
+    if radius >= math.pi:
+        return True
+    return a.x * b.x + a.y * b.y + a.z * b.z > math.cos(radius)
+
+
+def associate_images(image_ids, deRuiter_r, new_source_sigma_margin,
+                     in_memory=False):
+    """
+    Associate the extracted sources of a group of images together.
+
+    The association queries run once for all the images, rather than once
+    per image, with the same results as :func:`associate_extracted_sources`
+    for each image in turn. This requires that their sources cannot be
+    associated with the same running catalog sources: see
+    :func:`group_independent_images`.
+
+    Raises:
+        ValueError: if the images are not independent.
+    """
+    _insert_tempimage(image_ids)
+    regions = _image_regions(image_ids)
+    if len(regions) > 1 and len(_group_regions(regions)) > 1:
+        raise ValueError("Images %s cannot be associated together" %
+                         (image_ids,))
     logger.debug("Using a De Ruiter radius of %s" % (deRuiter_r,))
     ##This is used as a check that everything from the sourcefinder is sensible.
     ##Currently switched off as it's incompatible with sources about the meridian.
@@ -33,13 +142,21 @@ def associate_extracted_sources(image_id, deRuiter_r, new_source_sigma_margin):
     #| which may be matching one of the following cases:    |
     #| many-to-many, many-to-one, one-to-many, one-to-many  |
     #+------------------------------------------------------+
-    mw = _check_meridian_wrap(image_id)
-    _insert_temprunningcatalog(image_id, deRuiter_r, mw)
-    #+------------------------------------------------------+
-    #| Here we process (flag) the many-to-many associations.|
-    #+------------------------------------------------------+
-    # _process_many_to_many()
-    _flag_many_to_many_tempruncat()
+    q_across = regions[0].q_across
+    _insert_image_pixelranges(regions)
+    if in_memory:
+        rows = 0
+        for region in regions:
+            rows += matching.insert_temprunningcatalog(region.image,
+                                                       deRuiter_r, q_across)
+        _statements.set_rows(rows)
+    else:
+        _statements.set_rows(_insert_temprunningcatalog(deRuiter_r, q_across))
+        #+------------------------------------------------------+
+        #| Here we process (flag) the many-to-many associations.|
+        #+------------------------------------------------------+
+        # _process_many_to_many()
+        _flag_many_to_many_tempruncat()
     #+------------------------------------------------------+
     #| After this, the assocs have been reduced to many-to-1|
     #| which are treated identical as 1-to-1, and 1-to-many.|
@@ -88,13 +205,14 @@ def associate_extracted_sources(image_id, deRuiter_r, new_source_sigma_margin):
     #| Here we take care of the extracted sources that could |
     #| not be associated with any runningcatalog source      |
     #+-------------------------------------------------------+
-    _insert_new_runcat(image_id)
-    _insert_new_runcat_flux(image_id)
-    _insert_new_runcat_skyrgn_assocs(image_id)
-    _insert_new_assocxtrsource(image_id)
-    _determine_newsource_previous_limits(image_id, new_source_sigma_margin)
+    _insert_new_runcat()
+    _insert_new_runcat_flux()
+    _insert_new_runcat_skyrgn_assocs()
+    _insert_new_assocxtrsource()
+    _determine_newsource_previous_limits(new_source_sigma_margin)
 
     _empty_temprunningcatalog()
+    empty_temppixelrange()
     _update_ff_runcat_extractedsource()
     _delete_inactive_runcat()
 
@@ -149,7 +267,7 @@ WHERE image = %(imgid)s
 """
 
     qry_params = {'imgid':image_id}
-    cursor = tkp.db.execute(query, qry_params, commit=True)
+    cursor = _statements.execute('delete_bad_blind_extractions', query, qry_params, commit=True)
     n_deleted = cursor.rowcount
     if n_deleted:
         logger.warn("Removed %s bad blind extractions for image %s"
@@ -165,131 +283,108 @@ def _empty_temprunningcatalog():
     the current observed sources.
     """
     query = "DELETE FROM temprunningcatalog"
-    tkp.db.execute(query, commit=True)
-
+    _statements.execute('empty_temprunningcatalog', query, commit=True)
 
 
-def _check_meridian_wrap(image_id):
-    """
-    Checks whether an image is close to the meridian ra = 0 or ra = 360
-
-    When so, the association query needs to be rewritten to take into account
-    sources across the 0/360 meridian.
-
-    The query returns:
 
-    q_across: true, if the extraction region of the image crosses
-              the ra=0/360 border
-
-    ra_min:   the min value of the ra-between for the normal case,
-              when the image is outside the ra=0/360 meridian,
-              otherwise NULL
-
-    ra_max:   the max value of the ra-between for the normal case,
-              when the image is outside the ra=0/360 meridian,
-              otherwise NULL
+def _insert_tempimage(image_ids):
+    """Replace the contents of tempimage by the images to associate."""
+    _statements.execute('empty_tempimage', "DELETE FROM tempimage",
+                        commit=True)
+    if len(image_ids) == 1:
+        # A single row is cheaper to insert with a prepared statement.
+        _statements.execute('insert_tempimage',
+                            "INSERT INTO tempimage (image) VALUES (%(image)s)",
+                            {'image': image_ids[0]}, commit=True)
+    else:
+        copy_rows('tempimage', 'image',
+                  ['%d' % image_id for image_id in image_ids])
 
-    ra_min1/max1 and ra_min2/max2 are the values which may be used
-    for the case of a cross-meridian image.
-    F.ex. using a search radius of 5 degrees, and when a source is at
-    359.99 the ra-betweens 1 and 2 are :
-    ... AND (ra BETWEEN ra_min1 AND ra_max1 OR ra BETWEEN ra_min2 AND ra_max2) ...
-    ... AND (ra BETWEEN 354.99 AND 360 OR ra BETWEEN 0 AND 4.99) ...
 
-    ra_min1:  the min value of the high-end ra-between, if the
-              extraction region of the image crosses the ra=0/360 border,
-              otherwise NULL
+def _image_regions(image_ids):
+    """
+    Look up the regions around the images in tempimage.
 
-    ra_max1:  the min value of the high-end ra-between, if the
-              extraction region of the image crosses the ra=0/360 border,
-              otherwise NULL
+    The running catalog sources which may be associated with the extracted
+    sources of an image lie within the beam semi-major axis (rb_smaj) of
+    them. The region of an image is therefore the disc around the centre of
+    its skyregion which includes all the extracted sources, plus a margin of
+    rb_smaj.
 
-    ra_min2, ra_max2: As ra_min1/max1, but for the low-end ra values.
+    Args:
+        image_ids (list): the ids of the images in tempimage.
 
-    These values are not being used in the cross-meridian association query,
-    but are merely reported to notice the search area.
-    The cross-meridian association query uses the cartesian dot product,
-    to get the search area.
+    Returns:
+        list of :class:`ImageRegion`, in the order of image_ids.
     """
-
-    meridian_wrap_query = """\
-SELECT CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) < 0 OR
+    query = """\
+SELECT i.id
+      ,i.dataset
+      ,s.x
+      ,s.y
+      ,s.z
+      ,s.xtr_radius
+      ,i.rb_smaj
+      ,x.min_cos
+      ,CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) < 0 OR
                  s.centre_ra + alpha(s.xtr_radius, s.centre_decl) > 360
             THEN TRUE
             ELSE FALSE
        END AS q_across
-      ,CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) > 0 AND
-                 s.centre_ra + alpha(s.xtr_radius, s.centre_decl) < 360
-            THEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl)
-            ELSE NULL
-       END AS ra_min
-      ,CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) > 0 AND
-                 s.centre_ra + alpha(s.xtr_radius, s.centre_decl) < 360
-            THEN s.centre_ra + alpha(s.xtr_radius, s.centre_decl)
-            ELSE NULL
-       END AS ra_max
-      ,CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) < 0
-            THEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) + 360.0
-            ELSE CASE WHEN s.centre_ra + alpha(s.xtr_radius, s.centre_decl) > 360
-                      THEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl)
-                      ELSE NULL
-                 END
-       END AS ra_min1
-      ,CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) < 0 OR
-                 s.centre_ra + alpha(s.xtr_radius, s.centre_decl) > 360
-            THEN 360
-            ELSE NULL
-       END AS ra_max1
-      ,CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) < 0 OR
-                 s.centre_ra + alpha(s.xtr_radius, s.centre_decl) > 360
-            THEN 0
-            ELSE NULL
-       END AS ra_min2
-      ,CASE WHEN s.centre_ra - alpha(s.xtr_radius, s.centre_decl) < 0
-            THEN s.centre_ra + alpha(s.xtr_radius, s.centre_decl)
-            ELSE CASE WHEN s.centre_ra + alpha(s.xtr_radius, s.centre_decl) > 360
-                      THEN s.centre_ra + alpha(s.xtr_radius, s.centre_decl) - 360
-                      ELSE NULL
-                 END
-       END AS ra_max2
-  FROM image i
-      ,skyregion s
- WHERE i.skyrgn = s.id
-   AND i.id = %(image_id)s
+  FROM tempimage t
+       JOIN image i
+         ON i.id = t.image
+       JOIN skyregion s
+         ON s.id = i.skyrgn
+       LEFT OUTER JOIN (SELECT x0.image
+                              ,MIN(x0.x * s0.x + x0.y * s0.y + x0.z * s0.z)
+                               AS min_cos
+                          FROM tempimage t0
+                              ,image i0
+                              ,skyregion s0
+                              ,extractedsource x0
+                         WHERE i0.id = t0.image
+                           AND s0.id = i0.skyrgn
+                           AND x0.image = t0.image
+                        GROUP BY x0.image
+                       ) x
+         ON x.image = i.id
 """
-    args = {'image_id': image_id}
-    cursor = tkp.db.execute(meridian_wrap_query, args, commit=True)
-    results = zip(*cursor.fetchall())
-
-    if len(results) != 0:
-        q_across = results[0]
-        ra_min = results[1]
-        ra_max = results[2]
-        ra_min1 = results[3]
-        ra_max1 = results[4]
-        ra_min2 = results[5]
-        ra_max2 = results[6]
-        if len(q_across) != 1:
-            raise ValueError("More than one FoVs for image '%s'" % image_id)
-    else:
-        raise ValueError("No FoV information present for image '%s'" % image_id)
-
-    return {
-        'q_across': q_across[0],
-        'ra_min': ra_min[0],
-        'ra_max': ra_max[0],
-        'ra_min1': ra_min1[0],
-        'ra_max1': ra_max1[0],
-        'ra_min2': ra_min2[0],
-        'ra_max2': ra_max2[0]
-    }
+    cursor = _statements.execute('image_regions', query, commit=True)
+    regions = {}
+    for (image_id, dataset, x, y, z, xtr_radius, rb_smaj, min_cos,
+         q_across) in cursor.fetchall():
+        radius = xtr_radius
+        if min_cos is not None:
+            # Fitted positions may lie just beyond the extraction radius.
+            radius = max(radius,
+                         math.degrees(math.acos(min(max(min_cos, -1), 1))))
+        regions[image_id] = ImageRegion(image_id, dataset, x, y, z,
+                                        radius + rb_smaj, q_across)
+    for image_id in image_ids:
+        if image_id not in regions:
+            raise ValueError("No FoV information present for image '%s'" %
+                             image_id)
+    return [regions[image_id] for image_id in image_ids]
+
+
+def _insert_image_pixelranges(regions):
+    """Fill temppixelrange with the pixels around the sources of images
+
+    The running catalog sources which may be associated with the extracted
+    sources of the images are found by joining their HEALPix pixel numbers
+    with the ranges of pixels in temppixelrange, which cover the regions of
+    the images, see :func:`_image_regions`.
+    """
+    fill_temppixelrange([(r.x, r.y, r.z, r.radius) for r in regions])
 
 
-def _insert_temprunningcatalog(image_id, deRuiter_r, mw):
+def _insert_temprunningcatalog(deRuiter_r, q_across):
     """Select matched sources
 
-    Here we select the extractedsource that have a positional match
-    with the sources in the running catalogue table (runningcatalog).
+    Here we select the extractedsource, of the images in tempimage, that have
+    a positional match with the sources in the running catalogue table
+    (runningcatalog).
     Those sources which *do* have a potential match, will be inserted into the
     temporary running catalogue table (temprunningcatalog).
 
@@ -313,6 +408,11 @@ def _insert_temprunningcatalog(image_id, deRuiter_r, mw):
 
     NOTE: Beware of the extra condition on x0.image in the WHERE clause,
     preventing the query to grow exponentially in response time
+
+    The running catalog sources are looked up by their HEALPix pixel, in
+    the ranges inserted in temppixelrange by _insert_image_pixelranges.
+    
+    Returns the number of rows inserted.
     """
 
     # The cross-meridian differs slightly from the normal association query.
@@ -538,14 +638,15 @@ INSERT INTO temprunningcatalog
                  / (datapoints + 1) AS avg_weight_decl
             FROM extractedsource x0
                 ,runningcatalog rc0
+                ,temppixelrange p0
+                ,tempimage ti
                 ,image i0
-           WHERE i0.id = %(image_id)s
+           WHERE i0.id = ti.image
              AND x0.image = i0.id
-             AND x0.image = %(image_id)s
+             AND x0.image = ti.image
              AND i0.dataset = rc0.dataset
              AND rc0.mon_src = FALSE
-             AND rc0.zone BETWEEN CAST(FLOOR(x0.decl - i0.rb_smaj) as INTEGER)
-                              AND CAST(FLOOR(x0.decl + i0.rb_smaj) as INTEGER)
+             AND rc0.hpx BETWEEN p0.hpx_min AND p0.hpx_max
              AND rc0.wm_decl BETWEEN x0.decl - i0.rb_smaj
                                  AND x0.decl + i0.rb_smaj
              AND rc0.x*x0.x + rc0.y*x0.y + rc0.z*x0.z > cos(radians(i0.rb_smaj))
@@ -744,14 +845,15 @@ INSERT INTO temprunningcatalog
                  / (datapoints + 1) AS avg_weight_decl
             FROM extractedsource x0
                 ,runningcatalog rc0
+                ,temppixelrange p0
+                ,tempimage ti
                 ,image i0
-           WHERE i0.id = %(image_id)s
+           WHERE i0.id = ti.image
              AND x0.image = i0.id
-             AND x0.image = %(image_id)s
+             AND x0.image = ti.image
              AND i0.dataset = rc0.dataset
              AND rc0.mon_src = FALSE
-             AND rc0.zone BETWEEN CAST(FLOOR(x0.decl - i0.rb_smaj) AS INTEGER)
-                              AND CAST(FLOOR(x0.decl + i0.rb_smaj) AS INTEGER)
+             AND rc0.hpx BETWEEN p0.hpx_min AND p0.hpx_max
              AND rc0.wm_decl BETWEEN x0.decl - i0.rb_smaj
                                  AND x0.decl + i0.rb_smaj
              AND rc0.wm_ra BETWEEN x0.ra - alpha(i0.rb_smaj, x0.decl)
@@ -769,13 +871,15 @@ INSERT INTO temprunningcatalog
          AND t0.band = rf0.band
          AND t0.stokes = rf0.stokes
 """
-    #mw = _check_meridian_wrap(conn, image_id)
-    if mw['q_across'] == True:
-        logger.debug("Search across 0/360 meridian: %s" % mw)
+    name = 'insert_temprunningcatalog'
+    if q_across == True:
+        logger.debug("Search across 0/360 meridian")
         query = q_across_ra0
+        name = 'insert_temprunningcatalog_across_ra0'
 
-    args = {'image_id': image_id, 'deRuiter': deRuiter_r}
-    tkp.db.execute(query, args, commit=True)
+    args = {'deRuiter': deRuiter_r}
+    cursor = _statements.execute(name, query, args, commit=True)
+    return cursor.rowcount
 
 
 def _flag_many_to_many_tempruncat():
@@ -848,7 +952,7 @@ UPDATE temprunningcatalog
                   AND t2.xtrsrc = temprunningcatalog.xtrsrc
               )
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('flag_many_to_many_tempruncat', query, commit=True, scaled=True)
 
 
 def _insert_1_to_many_runcat():
@@ -886,6 +990,7 @@ INSERT INTO runningcatalog
   ,x
   ,y
   ,z
+  ,hpx
   )
   SELECT xtrsrc
         ,dataset
@@ -904,6 +1009,7 @@ INSERT INTO runningcatalog
         ,x
         ,y
         ,z
+        ,hpxNest(x, y, z)
     FROM (SELECT runcat
             FROM temprunningcatalog
            WHERE inactive = FALSE
@@ -914,7 +1020,7 @@ INSERT INTO runningcatalog
    WHERE tmprc.runcat = one_to_many.runcat
      AND tmprc.inactive = FALSE
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('insert_1_to_many_runcat', query, commit=True, scaled=True)
 
 
 def _insert_1_to_many_runcat_flux():
@@ -972,7 +1078,7 @@ INSERT INTO runningcatalog_flux
      AND tmprc.inactive = FALSE
      AND r.xtrsrc = tmprc.xtrsrc
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('insert_1_to_many_runcat_flux', query, commit=True, scaled=True)
 
 
 def _insert_1_to_many_basepoint_assocxtrsource():
@@ -1049,7 +1155,7 @@ INSERT INTO assocxtrsource
              AND runcat.xtrsrc = tmprc.xtrsrc
          ) t0
     """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('insert_1_to_many_basepoint_assocxtrsource', query, commit=True, scaled=True)
 
 
 def _insert_1_to_many_replacement_assocxtrsource():
@@ -1110,7 +1216,7 @@ INSERT INTO assocxtrsource
      AND r.xtrsrc = tmprc.xtrsrc
      AND a.runcat = tmprc.runcat
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('insert_1_to_many_replacement_assocxtrsource', query, commit=True, scaled=True)
 
 
 def _insert_1_to_many_assocskyrgn():
@@ -1145,7 +1251,7 @@ INSERT INTO assocskyrgn
      AND r.xtrsrc = tmprc.xtrsrc
      AND a.runcat = tmprc.runcat
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('insert_1_to_many_assocskyrgn', query, commit=True, scaled=True)
 
 
 def _insert_1_to_many_newsource():
@@ -1183,7 +1289,7 @@ INSERT INTO newsource
      AND tr.runcat = one_to_many.old_runcat_id
      AND r.xtrsrc = tmprc.xtrsrc
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('insert_1_to_many_newsource', query, commit=True, scaled=True)
 
 
 def _delete_1_to_many_inactive_assocskyrgn():
@@ -1202,7 +1308,7 @@ DELETE
                        HAVING COUNT(*) > 1
                     )
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('delete_1_to_many_inactive_assocskyrgn', query, commit=True, scaled=True)
 
 
 def _delete_1_to_many_inactive_newsource():
@@ -1221,7 +1327,7 @@ DELETE
                        HAVING COUNT(*) > 1
                     )
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('delete_1_to_many_inactive_newsource', query, commit=True, scaled=True)
 
 
 def _delete_1_to_many_inactive_assocxtrsource():
@@ -1251,7 +1357,7 @@ DELETE
                    HAVING COUNT(*) > 1
                 )
     """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('delete_1_to_many_inactive_assocxtrsource', query, commit=True, scaled=True)
 
 
 def _delete_1_to_many_inactive_runcat_flux():
@@ -1271,7 +1377,7 @@ DELETE
                    HAVING COUNT(*) > 1
                 )
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('delete_1_to_many_inactive_runcat_flux', query, commit=True, scaled=True)
 
 
 def _flag_1_to_many_inactive_runcat():
@@ -1290,7 +1396,7 @@ UPDATE runningcatalog
               HAVING COUNT(*) > 1
              )
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('flag_1_to_many_inactive_runcat', query, commit=True, scaled=True)
 
 
 def _flag_1_to_many_inactive_tempruncat():
@@ -1314,7 +1420,7 @@ UPDATE temprunningcatalog
                   HAVING COUNT(*) > 1
                  )
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('flag_1_to_many_inactive_tempruncat', query, commit=True, scaled=True)
 
 
 # This is the "master" 1-to-1 association query. We reuse it for associating
@@ -1378,7 +1484,7 @@ def _insert_1_to_1_assoc():
     We also calculate the variability indices at the timestamp of the
     the current image.
     """
-    tkp.db.execute(ONE_TO_ONE_ASSOC_QUERY, {'type': 3}, commit=True)
+    _statements.execute('insert_1_to_1_assoc', ONE_TO_ONE_ASSOC_QUERY, {'type': 3}, commit=True, scaled=True)
 
 
 def _update_1_to_1_runcat():
@@ -1460,13 +1566,18 @@ def _update_1_to_1_runcat():
                      WHERE temprunningcatalog.runcat = runningcatalog.id
                           AND temprunningcatalog.inactive = FALSE
                    )
+              ,hpx = (SELECT hpxNest(x, y, z)
+                        FROM temprunningcatalog
+                       WHERE temprunningcatalog.runcat = runningcatalog.id
+                          AND temprunningcatalog.inactive = FALSE
+                     )
          WHERE EXISTS (SELECT runcat
                          FROM temprunningcatalog
                         WHERE temprunningcatalog.runcat = runningcatalog.id
                           AND temprunningcatalog.inactive = FALSE
                       )
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('update_1_to_1_runcat', query, commit=True, scaled=True)
 
 def _update_1_to_1_runcat_flux():
     """Updates the fluxes in runningcatalog_flux of an existing band
@@ -1563,7 +1674,7 @@ UPDATE runningcatalog_flux
                   AND temprunningcatalog.f_datapoints > 1
               )
 """
-    cursor = tkp.db.execute(query, commit=True)
+    cursor = _statements.execute('update_1_to_1_runcat_flux', query, commit=True, scaled=True)
     return cursor.rowcount
 
 
@@ -1615,15 +1726,15 @@ INSERT INTO runningcatalog_flux
    WHERE inactive = FALSE
      AND f_datapoints=1
 """
-    cursor = tkp.db.execute(query, commit=True)
+    cursor = _statements.execute('insert_1_to_1_runcat_flux', query, commit=True, scaled=True)
     return cursor.rowcount
 
 
 
-def _insert_new_runcat(image_id):
+def _insert_new_runcat():
     """Insert previously unknown sources into the ``runningcatalog`` table.
 
-    Extractedsources for which no counterpart was found in the
+    Extractedsources of the images in tempimage for which no counterpart was found in the
     runningcatalog (i.e. no pair exists in tempruncat),
     will be added as a new source to the assocxtrsource,
     runningcatalog and runningcatalog_flux tables.
@@ -1651,6 +1762,7 @@ INSERT INTO runningcatalog
   ,x
   ,y
   ,z
+  ,hpx
   )
   SELECT new_src.xtrsrc
         ,new_src.dataset
@@ -1669,6 +1781,7 @@ INSERT INTO runningcatalog
         ,new_src.x
         ,new_src.y
         ,new_src.z
+        ,new_src.hpx
     FROM (SELECT x0.id AS xtrsrc
                 ,i0.dataset
                 ,1 AS datapoints
@@ -1686,26 +1799,28 @@ INSERT INTO runningcatalog
                 ,x0.x
                 ,x0.y
                 ,x0.z
+                ,x0.hpx
             FROM extractedsource x0
                 ,image i0
            WHERE x0.image = i0.id
-             AND x0.image = %s
+             AND x0.image IN (SELECT image FROM tempimage)
              AND x0.extract_type = 0
          ) new_src
          LEFT OUTER JOIN temprunningcatalog tmprc
          ON new_src.xtrsrc = tmprc.xtrsrc
    WHERE tmprc.xtrsrc IS NULL
 """
-    cursor = tkp.db.execute(query, (image_id,), True)
+    cursor = _statements.execute('insert_new_runcat', query, commit=True, scaled=True)
     ins = cursor.rowcount
     if ins > 0:
         logger.debug("Added %s new sources to runningcatalog" % ins)
 
 
 
-def _insert_new_runcat_flux(image_id):
+def _insert_new_runcat_flux():
     """
-	Insert previously unknown sources into the ``runningcatalog_flux`` table.
+	Insert previously unknown sources of the images in tempimage into the
+	``runningcatalog_flux`` table.
 
 	(i.e. those without *any* previous runcat-counterpart)
     """
@@ -1745,20 +1860,20 @@ INSERT INTO runningcatalog_flux
             FROM extractedsource x1
                  LEFT OUTER JOIN temprunningcatalog tmprc
                  ON x1.id = tmprc.xtrsrc
-            WHERE x1.image = %(image_id)s
+            WHERE x1.image IN (SELECT image FROM tempimage)
               AND x1.extract_type = 0
               AND tmprc.xtrsrc IS NULL
           ) new_src
         ,runningcatalog r0
         ,extractedsource x0
-   WHERE i0.id = %(image_id)s
+   WHERE i0.id = x0.image
      AND r0.xtrsrc = new_src.xtrsrc
      AND x0.id = r0.xtrsrc
 """
-    tkp.db.execute(query, {'image_id': image_id}, True)
+    _statements.execute('insert_new_runcat_flux', query, commit=True, scaled=True)
 
 
-def _insert_new_runcat_skyrgn_assocs(image_id):
+def _insert_new_runcat_skyrgn_assocs():
     """
     Process newly created entries from the runningcatalog,
     determine which skyregions they lie within.
@@ -1778,7 +1893,7 @@ def _insert_new_runcat_skyrgn_assocs(image_id):
     """
 
     # First, mark membership in the skyregion of the image of initial detection.
-    # We look for extracted sources from this image
+    # We look for extracted sources from the images in tempimage
     # that are not in temprunningcatalog, i.e. have no association candidates.
 
     # By dealing with these separately, we save a number of radius comparison
@@ -1796,7 +1911,7 @@ SELECT t0.runcat
           FROM extractedsource ex
               ,runningcatalog rc
               ,image im
-         WHERE ex.image = %(img_id)s
+         WHERE ex.image IN (SELECT image FROM tempimage)
            AND rc.xtrsrc = ex.id
            AND ex.image = im.id
        ) t0
@@ -1804,7 +1919,7 @@ SELECT t0.runcat
        ON t0.xtrsrc = tmprc.xtrsrc
 WHERE tmprc.xtrsrc IS NULL
 """
-    tkp.db.execute(assocskyrgn_parent_qry, {'img_id':image_id}, True)
+    _statements.execute('insert_new_runcat_skyrgn_assocs_parent', assocskyrgn_parent_qry, commit=True, scaled=True)
 
     #Now search all the other skyregions *in same dataset* to determine matches:
     assocskyrgn_others_qry = """\
@@ -1830,7 +1945,7 @@ SELECT new_src.runcat as runcatid
                   FROM extractedsource ex
                       ,runningcatalog rc0
                       ,image im
-                 WHERE ex.image = %(img_id)s
+                 WHERE ex.image IN (SELECT image FROM tempimage)
                    AND rc0.xtrsrc = ex.id
                    AND ex.image = im.id
                ) t0
@@ -1847,12 +1962,13 @@ SELECT new_src.runcat as runcatid
                                     ) / 2)
                ) < sky.xtr_radius
 """
-    tkp.db.execute(assocskyrgn_others_qry, {'img_id':image_id}, True)
+    _statements.execute('insert_new_runcat_skyrgn_assocs_others', assocskyrgn_others_qry, commit=True, scaled=True)
 
 
-def _insert_new_assocxtrsource(image_id):
+def _insert_new_assocxtrsource():
     """
-    Insert new associations for previously unknown sources.
+    Insert new associations for previously unknown sources of the images in
+    tempimage.
     """
 
     query = """\
@@ -1878,18 +1994,19 @@ INSERT INTO assocxtrsource
             FROM extractedsource x1
                  LEFT OUTER JOIN temprunningcatalog tmprc
                  ON x1.id = tmprc.xtrsrc
-            WHERE x1.image = %(image_id)s
+            WHERE x1.image IN (SELECT image FROM tempimage)
               AND x1.extract_type = 0
               AND tmprc.xtrsrc IS NULL
           ) new_src
         ,runningcatalog r0
    WHERE r0.xtrsrc = new_src.xtrsrc
 """
-    tkp.db.execute(query, {'image_id':image_id}, True)
+    _statements.execute('insert_new_assocxtrsource', query, commit=True, scaled=True)
 
-def _determine_newsource_previous_limits(image_id, new_source_sigma_margin):
+def _determine_newsource_previous_limits(new_source_sigma_margin):
     """
-    Determines which new-runcat sources are also probably transient.
+    Determines which new-runcat sources, of the images in tempimage, are also
+    probably transient.
 
     Looks up previous images relevant to this source-position, using the
     following criteria - images must:
@@ -1898,7 +2015,7 @@ def _determine_newsource_previous_limits(image_id, new_source_sigma_margin):
        information;
      - be in the same dataset;
      - be in the same frequency band;
-     - have an earlier timestamp than the current image;
+     - have an earlier timestamp than the image of the new source;
      - have not been rejected.
 
     For those images we calculate the per-previous-image detection-thresholds,
@@ -1945,7 +2062,7 @@ def _determine_newsource_previous_limits(image_id, new_source_sigma_margin):
     # This is another hairy query, but it breaks down like so:
     #
     # The innermost SELECT (unassoc_xtr) is a standard query
-    # that we use to grab extractedsources from the current image that
+    # that we use to grab extractedsources from the current images that
     # do not have a candidate  runcat counterpart from previous images.
     # Note that, by the time this query is run, a new runningcatalog entry has
     # been inserted for them, and the skyregion matching has been done.
@@ -2001,9 +2118,10 @@ INSERT INTO newsource
                             (prev_imgs.detection_thresh + %(sigma_margin)s))
                         AS high_flux_threshold
                 FROM (SELECT x1.id AS xtrsrc_id
+                          ,x1.image
                           ,x1.f_peak
                       FROM extractedsource x1
-                      WHERE x1.image = %(image_id)s
+                      WHERE x1.image IN (SELECT image FROM tempimage)
                       AND x1.id NOT IN (SELECT xtrsrc FROM temprunningcatalog)
                       AND x1.extract_type = 0
                     ) unassoc_xtr
@@ -2011,7 +2129,7 @@ INSERT INTO newsource
                    ,assocskyrgn asky1
                    ,image this_img
                    ,image prev_imgs
-                WHERE this_img.id = %(image_id)s
+                WHERE this_img.id = unassoc_xtr.image
                 AND runcat1.xtrsrc = unassoc_xtr.xtrsrc_id
                 AND asky1.runcat = runcat1.id
                 AND prev_imgs.dataset = this_img.dataset
@@ -2024,9 +2142,8 @@ INSERT INTO newsource
   WHERE row_num = 1
     AND new_src_flux > low_flux_threshold
 """
-    params = {'image_id': image_id,
-              'sigma_margin': new_source_sigma_margin}
-    cursor = tkp.db.execute(query, params, commit=True)
+    params = {'sigma_margin': new_source_sigma_margin}
+    cursor = _statements.execute('determine_newsource_previous_limits', query, params, commit=True, scaled=True)
     ins = cursor.rowcount
     if ins > 0:
         logger.debug("Added %s new sources to newsource table" % (ins,))
@@ -2046,7 +2163,7 @@ UPDATE extractedsource
                   AND runningcatalog.inactive = TRUE
               )
 """
-    cursor = tkp.db.execute(query, commit=True)
+    cursor = _statements.execute('update_ff_runcat_extractedsource', query, commit=True)
     cnt = cursor.rowcount
     if cnt > 0:
         logger.debug("Unset ff_runcat for %s extractedsources" % cnt)
@@ -2064,5 +2181,5 @@ DELETE
   FROM runningcatalog
  WHERE inactive = TRUE
 """
-    tkp.db.execute(query, commit=True)
+    _statements.execute('delete_inactive_runcat', query, commit=True)
 
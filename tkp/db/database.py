@@ -1,14 +1,33 @@
+import contextlib
 import exceptions
 import logging
+import os
+import re
+import threading
+import time
 import numpy
 import tkp.config
+import tkp.db
 from tkp.utility import substitute_inf
 
 logger = logging.getLogger(__name__)
 
 # The version of the TKP DB schema which is assumed by the current tree.
 # Increment whenever the schema changes.
-DB_VERSION = 34
+DB_VERSION = 36
+
+# The default maximum number of connections per process.
+DB_POOL_SIZE = 4
+
+# Prepared statements are planned anew after this many executions, so that
+# their plans follow the growth of the tables. A plan made while the tables
+# were still (nearly) empty can otherwise be disastrous later on.
+REPLAN_INTERVAL = 20
+
+# Connections inherited from a parent process. They are kept referenced, but
+# never used: closing them, or letting them be garbage collected, would end
+# the session which the parent is still using.
+_inherited_connections = []
 
 class DBExceptions(object):
     """
@@ -72,12 +91,131 @@ def sanitize_db_inputs(params):
     return cleaned
 
 
+class ConnectionPool(object):
+    """
+    A bounded pool of database connections, private to a process.
+
+    Connections are made on demand with the ``connect`` callable, up to
+    ``maxconn`` at a time. When all of them are in use, :meth:`getconn`
+    blocks until one is returned with :meth:`putconn`.
+
+    The pool is fork-aware: a child process never uses the connections of
+    its parent, but makes its own.
+    """
+    def __init__(self, connect, maxconn=DB_POOL_SIZE):
+        self._connect = connect
+        self.maxconn = maxconn
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._idle = []
+        self._used = []
+
+    def _check_process(self):
+        if os.getpid() != self._pid:
+            logger.debug("Process forked: discarding inherited connections")
+            _inherited_connections.extend(self._idle + self._used)
+            self._reset()
+
+    def getconn(self):
+        """
+        Get a connection from the pool, making a new one if necessary.
+        """
+        self._check_process()
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                connection = self._idle.pop()
+                self._used.append(connection)
+                return connection
+        try:
+            connection = self._connect()
+        except:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._used.append(connection)
+        return connection
+
+    def putconn(self, connection, close=False):
+        """
+        Return a connection obtained with :meth:`getconn` to the pool.
+
+        Any uncommitted changes are rolled back. If ``close`` is set, the
+        connection is closed rather than kept for reuse.
+        """
+        self._check_process()
+        with self._lock:
+            if connection not in self._used:
+                # Inherited from the parent, or returned already.
+                return
+            self._used.remove(connection)
+            if close:
+                connection.close()
+            else:
+                connection.rollback()
+                self._idle.append(connection)
+        self._slots.release()
+
+    def closeall(self):
+        """
+        Close all the connections in the pool.
+        """
+        self._check_process()
+        with self._lock:
+            for connection in self._idle + self._used:
+                connection.close()
+        self._reset()
+
+    def __len__(self):
+        return len(self._idle) + len(self._used)
+
+
+def _prepared_parameters(query, parameters):
+    """
+    Rewrite a query with DB-API parameters for use in a PREPARE statement.
+
+    Returns the query with the placeholders replaced by $1, $2, etc, and the
+    parameter values in the corresponding order.
+    """
+    values = []
+    if hasattr(parameters, "iteritems"):
+        names = []
+        def placeholder(match):
+            if match.group(0) == '%%':
+                return '%'
+            if match.group(1) not in names:
+                names.append(match.group(1))
+                values.append(parameters[match.group(1)])
+            return '$%d' % (names.index(match.group(1)) + 1)
+        query = re.sub(r"%%|%\((\w+)\)s", placeholder, query)
+    else:
+        parameters = iter(parameters)
+        def placeholder(match):
+            if match.group(0) == '%%':
+                return '%'
+            values.append(next(parameters))
+            return '$%d' % len(values)
+        query = re.sub(r"%%|%s", placeholder, query)
+    return query, values
+
+
 class Database(object):
     """
     An object representing a database connection.
+
+    The connection is taken from a pool of connections private to the
+    current process, see :class:`ConnectionPool`. After a fork, the child
+    transparently connects anew. Further connections from the same pool are
+    available through :meth:`pooled_connection`.
     """
     _connection = None
     _configured = False
+    _cursor = None
+    _pid = None
 
     # this makes this class a singleton
     _instance = None
@@ -107,11 +245,27 @@ class Database(object):
         self._configured = True
         # Provide placeholders for engine-specific Exception classes
         self.exceptions = DBExceptions(self.engine)
+        self.pool = ConnectionPool(self._new_connection,
+                                   kwargs.get('pool_size', DB_POOL_SIZE))
+        self._pid = os.getpid()
+        # Executions of the statements prepared on the current connection.
+        self._prepared = {}
 
     def connect(self):
         """
         connect to the configured database
         """
+        if self._connection and self._pid == os.getpid():
+            self.pool.putconn(self._connection, close=True)
+        self._pid = os.getpid()
+        self._connection = self.pool.getconn()
+        self._cursor = self._connection.cursor()
+        self._prepared = {}
+
+    def _new_connection(self):
+        """
+        Make a new connection to the configured database.
+        """
         logger.info("connecting to database...")
 
         kwargs = {}
@@ -131,11 +285,11 @@ class Database(object):
         if self.engine == 'monetdb':
             import monetdb.sql
             kwargs['autocommit'] = False
-            self._connection = monetdb.sql.connect(**kwargs)
+            connection = monetdb.sql.connect(**kwargs)
         elif self.engine == 'postgresql':
             import psycopg2
-            self._connection = psycopg2.connect(**kwargs)
-            self._connection.autocommit = False
+            connection = psycopg2.connect(**kwargs)
+            connection.autocommit = False
         else:
             msg = "engine %s not supported " % self.engine
             logger.error(msg)
@@ -143,26 +297,22 @@ class Database(object):
 
         # Check that our database revision matches that expected by the
         # codebase.
-        cursor = self.connection.cursor()
+        cursor = connection.cursor()
         cursor.execute("SELECT value FROM version WHERE name='revision'")
         schema_version = cursor.fetchone()[0]
         if schema_version != DB_VERSION:
             error = ("Database version incompatibility (needed %d, got %d)" %
                         (DB_VERSION, schema_version))
             logger.error(error)
-            self._connection.close()
-            self._connection = None
+            connection.close()
             raise Exception(error)
 
-        # I don't like this but it is used in some parts of TKP
-        self.cursor = self._connection.cursor()
-
         logger.info("connected to: %s://%s@%s:%s/%s" % (self.engine,
                                                            self.user,
                                                            self.host,
                                                            self.port,
                                                            self.database))
-
+        return connection
 
     @property
     def connection(self):
@@ -173,18 +323,132 @@ class Database(object):
 
         :return: a database connection
         """
+        if self._pid != os.getpid():
+            # Forked: the connection belongs to the parent.
+            self._connection = None
         if not self._connection:
             self.connect()
+        return self._connection
 
-        # I don't like this but it is used in some parts of TKP
-        self.cursor = self._connection.cursor()
+    @property
+    def cursor(self):
+        """
+        A cursor on the database connection.
 
-        return self._connection
+        It is made once per connection, and shared by the parts of TKP which
+        use it directly.
+        """
+        self.connection
+        return self._cursor
+
+    @contextlib.contextmanager
+    def pooled_connection(self):
+        """
+        Context manager providing a further connection from the pool.
+
+        The connection is returned to the pool afterwards; any changes which
+        have not been committed by then are rolled back.
+        """
+        connection = self.pool.getconn()
+        try:
+            yield connection
+        finally:
+            self.pool.putconn(connection)
+
+    def prepared(self, name, query, parameters):
+        """
+        Execute a query as a server-side prepared statement.
+
+        The statement is prepared under ``name`` the first time it is used on
+        a connection, and again every REPLAN_INTERVAL executions; the query
+        and parameters are as for :func:`tkp.db.execute`. This is only
+        supported for PostgreSQL, which must be able to infer the types of
+        all parameters from the query.
+
+        :return: the EXECUTE statement and its parameters
+        """
+        query, values = _prepared_parameters(query, parameters)
+        if self._prepared.get(name, 0) >= REPLAN_INTERVAL:
+            self.cursor.execute("DEALLOCATE %s" % name)
+            del self._prepared[name]
+        if name not in self._prepared:
+            self.cursor.execute("PREPARE %s AS %s" % (name, query))
+            self._prepared[name] = 0
+        self._prepared[name] += 1
+        if not values:
+            return "EXECUTE %s" % name, values
+        return ("EXECUTE %s (%s)" % (name, ", ".join(["%s"] * len(values))),
+                values)
 
     def close(self):
         """
         close the connection if open
         """
-        if self._connection:
-            self._connection.close()
+        if self._connection and self._pid == os.getpid():
+            self.pool.putconn(self._connection, close=True)
         self._connection = None
+        self._cursor = None
+
+
+class StatementRegistry(object):
+    """
+    A registry of named queries, executed as prepared statements.
+
+    Each query is prepared once per database connection, and afterwards
+    executed by name, rather than sent and planned afresh every time. This
+    is done for PostgreSQL only; with other engines, the queries are
+    executed as usual.
+
+    Statements registered with ``scaled=True`` read a table whose size
+    varies wildly between executions. They are prepared once per order of
+    magnitude of the number of rows set with :meth:`set_rows`, so that a
+    plan made for a few rows is never used for many thousands, or the other
+    way around.
+
+    The number of executions and the time spent on them are recorded per
+    statement in ``timings``, whether prepared or not.
+    """
+    def __init__(self, prefix):
+        # Prefix for the statement names, which are global to a connection.
+        self.prefix = prefix
+        self._queries = {}
+        self.timings = {}
+        self.magnitude = 0
+
+    def set_rows(self, rows):
+        """
+        Set the number of rows in the table read by the scaled statements.
+        """
+        self.magnitude = len(str(int(rows))) if rows > 0 else 0
+
+    def execute(self, name, query, parameters={}, commit=False, prepare=True,
+                scaled=False):
+        """
+        Execute query as the statement called name.
+
+        Arguments and return value are as for :func:`tkp.db.execute`. If
+        prepare is False, the query is planned afresh on every execution. If
+        scaled is True, it is planned anew whenever the number of rows set
+        with :meth:`set_rows` has changed by an order of magnitude.
+        """
+        if self._queries.setdefault(name, query) != query:
+            raise ValueError("Statement %s registered with another query" %
+                             (name,))
+        statement = self.prefix + name
+        if scaled:
+            statement += "_%d" % self.magnitude
+        start = time.time()
+        cursor = tkp.db.execute(query, parameters, commit,
+                                prepare=prepare and statement)
+        count, total = self.timings.get(name, (0, 0.))
+        self.timings[name] = (count + 1, total + time.time() - start)
+        return cursor
+
+    def log_timings(self):
+        """
+        Log the timings of all statements, slowest first.
+        """
+        for name, (count, total) in sorted(self.timings.iteritems(),
+                                           key=lambda item: -item[1][1]):
+            logger.info("%s: %d executions, %.3f s (%.2f ms each)" % (
+                name, count, total, 1000 * total / count))
@@ -8,11 +8,13 @@ that don't fit into a more specific collection.
 import math
 import logging
 import itertools
+from cStringIO import StringIO
+
+import numpy
 
 import tkp.db
-from tkp.utility.coordinates import eq_to_cart
-from tkp.utility.coordinates import alpha_inflate
-from tkp.utility import substitute_inf
+from tkp.utility import healpix
+from tkp.utility.containers import ColumnarExtractionResults
 
 
 logger = logging.getLogger(__name__)
@@ -132,7 +134,28 @@ def insert_image(dataset, freq_eff, freq_bw,
         xtr_radius(float): Radius in degrees from field centre that will be used
             for source extraction.
 
+    If the image is the first of a new skyregion, the running catalog sources
+    in the skyregion are looked up by their HEALPix pixel; the ranges of
+    pixels covering the skyregion are inserted beforehand, see
+    :func:`fill_temppixelrange`, and removed afterwards.
+    """
+    query = """\
+    SELECT COUNT(*)
+      FROM skyregion
+     WHERE dataset = %(dataset)s
+       AND centre_ra = %(centre_ra)s
+       AND centre_decl = %(centre_decl)s
+       AND xtr_radius = %(xtr_radius)s
     """
+    args = {'dataset': dataset, 'centre_ra': centre_ra,
+            'centre_decl': centre_decl, 'xtr_radius': xtr_radius}
+    new_skyregion = not tkp.db.execute(query, args).fetchone()[0]
+    if new_skyregion:
+        ra, decl = math.radians(centre_ra), math.radians(centre_decl)
+        fill_temppixelrange([(math.cos(decl) * math.cos(ra),
+                              math.cos(decl) * math.sin(ra),
+                              math.sin(decl), xtr_radius)])
+
     query = """\
     SELECT insertImage(%(dataset)s
                       ,%(tau_time)s
@@ -175,11 +198,189 @@ def insert_image(dataset, freq_eff, freq_bw,
                  'detection_thresh': detection_thresh,
                  'analysis_thresh': analysis_thresh,
                  }
-    cursor = tkp.db.execute(query, arguments, commit=True)
-    image_id = cursor.fetchone()[0]
+    try:
+        cursor = tkp.db.execute(query, arguments, commit=True)
+        image_id = cursor.fetchone()[0]
+    finally:
+        if new_skyregion:
+            empty_temppixelrange()
     return image_id
 
 
+# Codes for the extract_type column of extractedsource.
+_extract_type_codes = {'blind': 0, 'ff_nd': 1, 'ff_ms': 2}
+
+_extractedsource_columns = """\
+ra
+,decl
+,ra_fit_err
+,decl_fit_err
+,f_peak
+,f_peak_err
+,f_int
+,f_int_err
+,det_sigma
+,semimajor
+,semiminor
+,pa
+,ew_sys_err
+,ns_sys_err
+,error_radius
+,fit_type
+,chisq
+,reduced_chisq
+,ra_err
+,decl_err
+,uncertainty_ew
+,uncertainty_ns
+,image
+,zone
+,hpx
+,x
+,y
+,z
+,racosdecl
+,extract_type
+,ff_runcat
+,ff_monitor"""
+
+# One line of COPY data. The float columns are formatted beforehand, see
+# _copy_floats(), and so are the nullable ones, with NULL as an empty field.
+_extractedsource_row_format = ','.join(
+    ['%s'] * 15 + ['%d', '%s', '%s'] + ['%s'] * 4 + ['%d', '%d', '%d'] +
+    ['%s'] * 4 + ['%d', '%s', '%s'])
+
+
+def _extracted_sources_array(results):
+    """
+    The serialized sourcefinder results as a 2D array of floats, with NaN
+    for missing (None) values.
+    """
+    if isinstance(results, ColumnarExtractionResults):
+        return numpy.column_stack([results.data[name].astype(float)
+                                   for name in results.serialized_columns])
+    return numpy.array([[numpy.nan if value is None else value
+                         for value in src] for src in results], dtype=float)
+
+
+def _copy_floats(values, nan='NaN'):
+    """
+    COPY fields for an array of floats.
+
+    Floats use repr() to retain full precision. Non-finite values are spelled
+    out as the database expects them, with nan as the field for NaN.
+    """
+    values = numpy.asarray(values, dtype=float)
+    fields = [repr(value) for value in values.tolist()]
+    for i in numpy.flatnonzero(~numpy.isfinite(values)).tolist():
+        if math.isnan(values[i]):
+            fields[i] = nan
+        elif values[i] > 0:
+            fields[i] = 'Infinity'
+        else:
+            fields[i] = '-Infinity'
+    return fields
+
+
+def _nullable_floats(values):
+    """COPY fields for an array of floats, with NULL for NaN."""
+    return _copy_floats(values, nan='')
+
+
+def _nullable_ids(ids, keep):
+    """COPY fields for the ids of the rows selected by keep, or NULL."""
+    if ids is None:
+        return [''] * int(keep.sum())
+    return [str(id) for id, selected in zip(ids, keep) if selected]
+
+
+def _alpha_inflate(theta, decl):
+    """As tkp.utility.coordinates.alpha_inflate(), for arrays."""
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        alpha = numpy.degrees(numpy.abs(numpy.arctan(
+            numpy.sin(numpy.radians(theta)) /
+            numpy.sqrt(numpy.abs(numpy.cos(numpy.radians(decl - theta)) *
+                                 numpy.cos(numpy.radians(decl + theta)))))))
+    return numpy.where(numpy.abs(decl) + theta > 89.9, 180.0, alpha)
+
+
+def copy_rows(table, columns, lines):
+    """
+    Bulk load rows into a table.
+
+    Rather than through an INSERT statement, which the database would have
+    to parse, the rows are streamed as CSV using COPY, in the dialect of the
+    configured database engine.
+
+    Args:
+        table (str): the table to load the rows into.
+        columns (str): comma separated names of the columns in the rows.
+        lines (list): one line of comma separated values per row, with
+            NULL as an empty field. Floats should be formatted with
+            _copy_floats().
+    """
+    data = '\n'.join(lines)
+    database = tkp.db.Database()
+    cursor = database.connection.cursor()
+    try:
+        if database.engine == 'postgresql':
+            query = "COPY %s (%s) FROM STDIN WITH CSV" % (table, columns)
+            cursor.copy_expert(query, StringIO(data + '\n'))
+        elif database.engine == 'monetdb':
+            query = ("COPY %d RECORDS INTO %s (%s) FROM STDIN "
+                     "USING DELIMITERS ',','\\n' NULL AS ''" % (
+                         len(lines), table, columns))
+            cursor.execute(query + ";\n" + data + "\n")
+        else:
+            raise NotImplementedError(
+                "Bulk load not implemented for %s" % database.engine)
+        database.connection.commit()
+    except database.connection.Error as e:
+        logger.error("Bulk load into %s failed: %s" % (table, e))
+        raise
+    finally:
+        cursor.close()
+
+
+def fill_temppixelrange(discs):
+    """
+    Replaces the contents of temppixelrange by the ranges of HEALPix pixels
+    which cover one or more discs.
+
+    Queries find the sources in the discs by joining their pixel numbers
+    with these ranges; see :func:`tkp.utility.healpix.disc_ranges`. The
+    ranges of several discs are merged, so that no source is found twice.
+
+    Args:
+        discs (list): tuples (x, y, z, radius) of the unit vector of the
+            centre of a disc and its radius in degrees.
+    """
+    ranges = []
+    for x, y, z, radius in discs:
+        ranges.extend(healpix.disc_ranges(x, y, z, radius).tolist())
+    ranges = healpix.merge_ranges(ranges)
+    empty_temppixelrange()
+    copy_rows('temppixelrange', 'hpx_min,hpx_max',
+              ['%d,%d' % (first, last) for first, last in ranges.tolist()])
+
+
+def empty_temppixelrange():
+    """
+    Removes all ranges from temppixelrange.
+
+    The table should be left empty after use: updateSkyRgnMembers, called
+    when an image with a new skyregion is inserted, only searches the ranges
+    in temppixelrange if there are any.
+    """
+    tkp.db.execute("DELETE FROM temppixelrange", commit=True)
+
+
+def _copy_extracted_sources(rows):
+    """Bulk load rows into the extractedsource table."""
+    copy_rows('extractedsource', _extractedsource_columns,
+              [_extractedsource_row_format % row for row in rows])
+
+
 def insert_extracted_sources(image_id, results, extract_type,
                              ff_runcat_ids=None, ff_monitor_ids=None):
     """
@@ -239,123 +440,97 @@ def insert_extracted_sources(image_id, results, extract_type,
         - the zone in which an extracted source falls is calculated, based
           on its declination. We adopt a zoneheight of 1 degree, so
           the floor of the declination represents the zone.
+        - the HEALPix pixel in which an extracted source falls, see
+          :mod:`tkp.utility.healpix`.
         - the positional errors are converted from degrees to arcsecs
         - the Cartesian coordinates of the source position
         - ra * cos(radians(decl)), this is very often being used in
           source-distance calculations
+
+    The derived columns are calculated for all sources at once, and the rows
+    are bulk loaded with COPY. The results may be given as a list of
+    serialized sources, or as a
+    :class:`tkp.utility.containers.ColumnarExtractionResults`.
     """
     if not len(results):
         logger.info("No extract_type=%s sources added to extractedsource for"
                     " image %s" % (extract_type, image_id))
         return
 
-    xtrsrc = []
-    for i, src in enumerate(results):
-        r = list(src)
-        # Drop any fits with infinite flux errors
-        if math.isinf(r[5]) or math.isinf(r[7]):
-            logger.warn("Dropped source fit with infinite flux errors "
-                        "at position %s %s" % (r[0], r[1]))
-            continue
-        # Use 360 degree rather than infinite uncertainty for
-        # unconstrained positions.
-        r[14] = substitute_inf(r[14], 360.0)
-        r[15] = int(r[15])
-        # ra_err: sqrt of quadratic sum of fitted and systematic errors.
-        r.append(math.sqrt(r[2]**2 + alpha_inflate(r[12]/3600., r[1])**2))
-        # decl_err: sqrt of quadratic sum of fitted and systematic errors.
-        r.append(math.sqrt(r[3]**2 + (r[13]/3600.)**2))
-        # uncertainty_ew: sqrt of quadratic sum of systematic error and error_radius
-        # divided by 3600 because uncertainty in degrees and others in arcsec.
-        r.append(math.sqrt(r[12]**2 + r[14]**2)/3600.)
-        # uncertainty_ns: sqrt of quadratic sum of systematic error and error_radius
-        # divided by 3600 because uncertainty in degrees and others in arcsec.
-        r.append(math.sqrt(r[13]**2 + r[14]**2)/3600.)
-        r.append(image_id) # id of the image
-        r.append(int(math.floor(r[1]))) # zone
-        r.extend(eq_to_cart(r[0], r[1])) # Cartesian x,y,z
-        r.append(r[0] * math.cos(math.radians(r[1]))) # ra * cos(radians(decl))
-        if extract_type == 'blind':
-            r.append(0)
-        elif extract_type == 'ff_nd':
-            r.append(1)
-        elif extract_type == 'ff_ms':
-            r.append(2)
-        else:
-            raise ValueError("Not a valid extractedsource insert type: '%s'"
-                             % extract_type)
-        if ff_runcat_ids is not None:
-            assert len(results)==len(ff_runcat_ids)
-            r.append(ff_runcat_ids[i])
-        else:
-            r.append(None)
-
-        if ff_monitor_ids is not None:
-            assert len(results)==len(ff_monitor_ids)
-            r.append(ff_monitor_ids[i])
-        else:
-            r.append(None)
-
-        xtrsrc.append(r)
-
-    insertion_query = """\
-INSERT INTO extractedsource
-  (ra
-  ,decl
-  ,ra_fit_err
-  ,decl_fit_err
-  ,f_peak
-  ,f_peak_err
-  ,f_int
-  ,f_int_err
-  ,det_sigma
-  ,semimajor
-  ,semiminor
-  ,pa
-  ,ew_sys_err
-  ,ns_sys_err
-  ,error_radius
-  ,fit_type
-  ,chisq
-  ,reduced_chisq
-  ,ra_err
-  ,decl_err
-  ,uncertainty_ew
-  ,uncertainty_ns
-  ,image
-  ,zone
-  ,x
-  ,y
-  ,z
-  ,racosdecl
-  ,extract_type
-  ,ff_runcat
-  ,ff_monitor
-  )
-VALUES {placeholder}
-"""
-    if xtrsrc:
-        cols_per_row = len(xtrsrc[0])
-        placeholder_per_row = '('+ ','.join(['%s']*cols_per_row) +')'
-
-        placeholder_full = ','.join([placeholder_per_row]*len(xtrsrc))
-
-        query = insertion_query.format(placeholder= placeholder_full)
-        cursor = tkp.db.execute(query, tuple(itertools.chain.from_iterable(xtrsrc)),
-                                commit=True)
-        insert_num = cursor.rowcount
-        #if insert_num == 0:
-        #    logger.info("No forced-fit sources added to extractedsource for "
-        #                "image %s" % (image_id,))
-        if extract_type == 'blind':
-            logger.info("Inserted %d sources in extractedsource for image %s" %
-                        (insert_num, image_id))
-        elif extract_type == 'ff_nd':
-            logger.info("Inserted %d forced-fit null detections in extractedsource"
-                        " for image %s" % (insert_num, image_id))
-        elif extract_type == 'ff_ms':
-            logger.info("Inserted %d forced-fit for monitoring in extractedsource"
-                        " for image %s" % (insert_num, image_id))
+    if extract_type not in _extract_type_codes:
+        raise ValueError("Not a valid extractedsource insert type: '%s'"
+                         % extract_type)
+    if ff_runcat_ids is not None:
+        assert len(results)==len(ff_runcat_ids)
+    if ff_monitor_ids is not None:
+        assert len(results)==len(ff_monitor_ids)
+
+    sources = _extracted_sources_array(results)
+    # Drop any fits with infinite flux errors
+    keep = ~(numpy.isinf(sources[:, 5]) | numpy.isinf(sources[:, 7]))
+    for ra, decl in sources[~keep, :2]:
+        logger.warn("Dropped source fit with infinite flux errors "
+                    "at position %s %s" % (ra, decl))
+    if not keep.any():
+        return
+    sources = sources[keep]
+    ff_runcat_ids = _nullable_ids(ff_runcat_ids, keep)
+    ff_monitor_ids = _nullable_ids(ff_monitor_ids, keep)
+
+    ra, decl = sources[:, 0], sources[:, 1]
+    ew_sys_err, ns_sys_err = sources[:, 12], sources[:, 13]
+    # Use 360 degree rather than infinite uncertainty for
+    # unconstrained positions.
+    error_radius = numpy.where(numpy.isinf(sources[:, 14]), 360.0,
+                               sources[:, 14])
+    cos_decl = numpy.cos(numpy.radians(decl))
+
+    columns = [_copy_floats(sources[:, i]) for i in range(14)]
+    columns.append(_copy_floats(error_radius))
+    columns.append(sources[:, 15].astype(int).tolist())
+    # chisq and reduced_chisq are NULL for non-Gaussian fits.
+    columns.append(_nullable_floats(sources[:, 16]))
+    columns.append(_nullable_floats(sources[:, 17]))
+    # ra_err: sqrt of quadratic sum of fitted and systematic errors.
+    columns.append(_copy_floats(numpy.sqrt(
+        sources[:, 2]**2 + _alpha_inflate(ew_sys_err/3600., decl)**2)))
+    # decl_err: sqrt of quadratic sum of fitted and systematic errors.
+    columns.append(_copy_floats(numpy.sqrt(
+        sources[:, 3]**2 + (ns_sys_err/3600.)**2)))
+    # uncertainty_ew: sqrt of quadratic sum of systematic error and error_radius
+    # divided by 3600 because uncertainty in degrees and others in arcsec.
+    columns.append(_copy_floats(
+        numpy.sqrt(ew_sys_err**2 + error_radius**2)/3600.))
+    # uncertainty_ns: sqrt of quadratic sum of systematic error and error_radius
+    # divided by 3600 because uncertainty in degrees and others in arcsec.
+    columns.append(_copy_floats(
+        numpy.sqrt(ns_sys_err**2 + error_radius**2)/3600.))
+    columns.append([image_id] * len(sources)) # id of the image
+    columns.append(numpy.floor(decl).astype(int).tolist()) # zone
+    # Cartesian x,y,z
+    x = cos_decl * numpy.cos(numpy.radians(ra))
+    y = cos_decl * numpy.sin(numpy.radians(ra))
+    z = numpy.sin(numpy.radians(decl))
+    columns.append(healpix.xyz2nest(x, y, z).tolist()) # hpx
+    columns.append(_copy_floats(x))
+    columns.append(_copy_floats(y))
+    columns.append(_copy_floats(z))
+    columns.append(_copy_floats(ra * cos_decl)) # ra * cos(radians(decl))
+    columns.append([_extract_type_codes[extract_type]] * len(sources))
+    columns.append(ff_runcat_ids)
+    columns.append(ff_monitor_ids)
+
+    _copy_extracted_sources(zip(*columns))
+    insert_num = len(sources)
+    if extract_type == 'blind':
+        logger.info("Inserted %d sources in extractedsource for image %s" %
+                    (insert_num, image_id))
+    elif extract_type == 'ff_nd':
+        logger.info("Inserted %d forced-fit null detections in extractedsource"
+                    " for image %s" % (insert_num, image_id))
+    elif extract_type == 'ff_ms':
+        logger.info("Inserted %d forced-fit for monitoring in extractedsource"
+                    " for image %s" % (insert_num, image_id))
 
 
 def lightcurve(xtrsrcid):
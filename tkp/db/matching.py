@@ -0,0 +1,427 @@
+"""
+In-memory positional matching of extracted sources with the running catalog.
+
+This is an alternative to the SQL query which fills temprunningcatalog in
+:func:`tkp.db.associations.associate_extracted_sources`. The running catalog
+sources which may be associated with an image are read from the database
+once, and the candidate pairs are found with a KD-tree over their unit
+vectors. The De Ruiter radii and the updated weighted means of all pairs are
+calculated with numpy, with the same expressions as the SQL query. The
+many-to-many associations are flagged as they are by
+:func:`tkp.db.associations._flag_many_to_many_tempruncat`, and the rows are
+then bulk loaded into temprunningcatalog. The rest of the association is
+done by the usual queries.
+"""
+import logging
+
+import numpy
+import scipy
+from scipy.spatial import cKDTree
+
+import tkp.db
+from tkp.db.general import copy_rows, _alpha_inflate, _copy_floats
+
+
+logger = logging.getLogger(__name__)
+
+_image_query = """\
+SELECT i.dataset
+      ,i.band
+      ,i.stokes
+      ,i.rb_smaj
+  FROM image i
+ WHERE i.id = %(image_id)s
+"""
+
+_extractedsource_query = """\
+SELECT x.id
+      ,x.ra
+      ,x.decl
+      ,x.uncertainty_ew
+      ,x.uncertainty_ns
+      ,x.ra_err
+      ,x.decl_err
+      ,x.x
+      ,x.y
+      ,x.z
+      ,x.f_peak
+      ,x.f_peak_err
+      ,x.f_int
+      ,x.f_int_err
+  FROM extractedsource x
+ WHERE x.image = %(image_id)s
+"""
+_extractedsource_fields = ('id', 'ra', 'decl', 'uncertainty_ew',
+                           'uncertainty_ns', 'ra_err', 'decl_err', 'x', 'y',
+                           'z', 'f_peak', 'f_peak_err', 'f_int', 'f_int_err')
+
+# The running catalog sources in the HEALPix pixel ranges around the
+# extracted sources (see tkp.db.associations._insert_image_pixelranges),
+# with their fluxes in the band and Stokes parameter of the image (NULL if
+# there are none yet).
+_runningcatalog_query = """\
+SELECT rc.id
+      ,rc.wm_ra
+      ,rc.wm_decl
+      ,rc.wm_uncertainty_ew
+      ,rc.wm_uncertainty_ns
+      ,rc.x
+      ,rc.y
+      ,rc.z
+      ,rc.datapoints
+      ,rc.avg_ra_err
+      ,rc.avg_decl_err
+      ,rc.avg_wra
+      ,rc.avg_wdecl
+      ,rc.avg_weight_ra
+      ,rc.avg_weight_decl
+      ,rf.f_datapoints
+      ,rf.avg_f_peak
+      ,rf.avg_f_peak_sq
+      ,rf.avg_f_peak_weight
+      ,rf.avg_weighted_f_peak
+      ,rf.avg_weighted_f_peak_sq
+      ,rf.avg_f_int
+      ,rf.avg_f_int_sq
+      ,rf.avg_f_int_weight
+      ,rf.avg_weighted_f_int
+      ,rf.avg_weighted_f_int_sq
+  FROM temppixelrange p
+       JOIN runningcatalog rc
+         ON rc.hpx BETWEEN p.hpx_min AND p.hpx_max
+       LEFT OUTER JOIN runningcatalog_flux rf
+       ON rc.id = rf.runcat
+       AND rf.band = %(band)s
+       AND rf.stokes = %(stokes)s
+ WHERE rc.dataset = %(dataset)s
+   AND rc.mon_src = FALSE
+"""
+_runningcatalog_fields = ('id', 'wm_ra', 'wm_decl',
+                          'wm_uncertainty_ew', 'wm_uncertainty_ns', 'x', 'y',
+                          'z', 'datapoints', 'avg_ra_err', 'avg_decl_err',
+                          'avg_wra', 'avg_wdecl', 'avg_weight_ra',
+                          'avg_weight_decl', 'f_datapoints', 'avg_f_peak',
+                          'avg_f_peak_sq', 'avg_f_peak_weight',
+                          'avg_weighted_f_peak', 'avg_weighted_f_peak_sq',
+                          'avg_f_int', 'avg_f_int_sq', 'avg_f_int_weight',
+                          'avg_weighted_f_int', 'avg_weighted_f_int_sq')
+
+_temprunningcatalog_columns = """\
+runcat
+,xtrsrc
+,distance_arcsec
+,r
+,dataset
+,band
+,stokes
+,datapoints
+,zone
+,wm_ra
+,wm_decl
+,wm_uncertainty_ew
+,wm_uncertainty_ns
+,avg_ra_err
+,avg_decl_err
+,avg_wra
+,avg_wdecl
+,avg_weight_ra
+,avg_weight_decl
+,x
+,y
+,z
+,inactive
+,f_datapoints
+,avg_f_peak
+,avg_f_peak_sq
+,avg_f_peak_weight
+,avg_weighted_f_peak
+,avg_weighted_f_peak_sq
+,avg_f_int
+,avg_f_int_sq
+,avg_f_int_weight
+,avg_weighted_f_int
+,avg_weighted_f_int_sq"""
+
+_temprunningcatalog_row_format = ','.join(
+    ['%d', '%d', '%s', '%s', '%d', '%d', '%d', '%d', '%d'] + ['%s'] * 13 +
+    ['%s', '%d'] + ['%s'] * 10)
+
+
+def check_scipy():
+    """
+    Raises ImportError if the installed scipy is too old for the matching:
+    cKDTree.query_ball_point() is new in scipy 0.12.
+    """
+    if not hasattr(cKDTree, 'query_ball_point'):
+        raise ImportError("In-memory association requires scipy 0.12 or "
+                          "later, found scipy %s" % scipy.__version__)
+
+
+def _columns(rows, fields):
+    """The rows of a query as a dict of arrays, with NaN for NULL."""
+    values = numpy.array(rows, dtype=float).reshape(len(rows), len(fields))
+    return dict((name, values[:, i]) for i, name in enumerate(fields))
+
+
+def _wrapped_ra(ra):
+    """
+    RA shifted by 180 degrees, as MOD(CAST(ra + 180 AS NUMERIC(11,8)), 360)
+    in the association query.
+    """
+    return numpy.mod(numpy.round(ra + 180, 8), 360)
+
+
+def candidate_pairs(xtr, runcat, rb_smaj, deRuiter_r, q_across):
+    """
+    Find the running catalog sources that may be associated with each
+    extracted source.
+
+    The conditions are those of the association query: the sources are in
+    the declination range within rb_smaj of the extracted source,
+    within rb_smaj on the sky and within the De Ruiter radius. If the
+    extraction region does not cross the RA = 0/360 meridian, they are also
+    within the RA range within rb_smaj.
+
+    Args:
+        xtr (dict): arrays of the extractedsource columns.
+        runcat (dict): arrays of the runningcatalog columns.
+        rb_smaj (float): the search radius in degrees.
+        deRuiter_r (float): the De Ruiter radius.
+        q_across (bool): whether the extraction region crosses the RA = 0/360
+            meridian.
+
+    Returns:
+        the indices of the extracted sources and of the running catalog
+        sources of the pairs, and the distances in arcsec and De Ruiter radii
+        between them.
+    """
+    empty = (numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int),
+             numpy.zeros(0), numpy.zeros(0))
+    if not len(xtr['id']) or not len(runcat['id']):
+        return empty
+
+    # The KD-tree finds all sources within the chord that corresponds to the
+    # search radius, slightly widened: the exact condition follows below.
+    runcat_xyz = numpy.column_stack((runcat['x'], runcat['y'], runcat['z']))
+    xtr_xyz = numpy.column_stack((xtr['x'], xtr['y'], xtr['z']))
+    chord = 2 * numpy.sin(numpy.radians(rb_smaj) / 2) * (1 + 1e-9) + 1e-12
+    neighbours = cKDTree(runcat_xyz).query_ball_point(xtr_xyz, chord)
+    counts = [len(n) for n in neighbours]
+    if not sum(counts):
+        return empty
+    xi = numpy.repeat(numpy.arange(len(neighbours)), counts)
+    ri = numpy.concatenate([n for n in neighbours if n]).astype(int)
+
+    x_ra, x_decl = xtr['ra'][xi], xtr['decl'][xi]
+    rc_ra, rc_decl = runcat['wm_ra'][ri], runcat['wm_decl'][ri]
+    keep = ((rc_decl >= x_decl - rb_smaj) & (rc_decl <= x_decl + rb_smaj) &
+            ((runcat_xyz[ri] * xtr_xyz[xi]).sum(axis=1) >
+             numpy.cos(numpy.radians(rb_smaj))))
+    if not q_across:
+        alpha = _alpha_inflate(rb_smaj, x_decl)
+        keep &= (rc_ra >= x_ra - alpha) & (rc_ra <= x_ra + alpha)
+
+    d_ra = rc_ra - x_ra
+    if q_across:
+        wrap = (rc_ra < 90) | (rc_ra > 270)
+        d_ra = numpy.where(wrap, _wrapped_ra(rc_ra) - _wrapped_ra(x_ra), d_ra)
+    d_ra = d_ra * numpy.cos(numpy.radians((rc_decl + x_decl) / 2))
+    r = numpy.sqrt(
+        d_ra * d_ra / (runcat['wm_uncertainty_ew'][ri] ** 2 +
+                       xtr['uncertainty_ew'][xi] ** 2) +
+        (rc_decl - x_decl) ** 2 / (runcat['wm_uncertainty_ns'][ri] ** 2 +
+                                   xtr['uncertainty_ns'][xi] ** 2))
+    keep &= r < deRuiter_r
+
+    xi, ri, r = xi[keep], ri[keep], r[keep]
+    chord_sq = ((runcat_xyz[ri] - xtr_xyz[xi]) ** 2).sum(axis=1)
+    distance_arcsec = 3600 * numpy.degrees(
+        2 * numpy.arcsin(numpy.sqrt(chord_sq) / 2))
+    return xi, ri, distance_arcsec, r
+
+
+def flag_many_to_many(runcat_ids, xtrsrc_ids, r):
+    """
+    Flag the pairs of many-to-many associations which are not the closest.
+
+    As in :func:`tkp.db.associations._flag_many_to_many_tempruncat`: of the
+    pairs whose extracted source has more than one counterpart and whose
+    running catalog source has more than one such pair, all but the pairs
+    with the smallest De Ruiter radius per extracted source are flagged.
+
+    Returns:
+        a boolean array, True for the pairs to flag inactive.
+    """
+    inactive = numpy.zeros(len(r), dtype=bool)
+    if not len(r):
+        return inactive
+    xtr_values, xtr_index = numpy.unique(xtrsrc_ids, return_inverse=True)
+    multi_xtr = numpy.bincount(xtr_index)[xtr_index] > 1
+    # The running catalog sources which have more than one pair with such
+    # an extracted source.
+    rc_values, rc_index = numpy.unique(runcat_ids, return_inverse=True)
+    rc_counts = numpy.bincount(rc_index, weights=multi_xtr)
+    subset = multi_xtr & (rc_counts[rc_index] > 1)
+    if not subset.any():
+        return inactive
+    # The smallest De Ruiter radius per extracted source: sorted by source
+    # and then by radius, it is that of the first pair of every source.
+    subset_xtr, subset_r = xtr_index[subset], r[subset]
+    order = numpy.lexsort((subset_r, subset_xtr))
+    first = numpy.concatenate(([True], numpy.diff(subset_xtr[order]) != 0))
+    min_r = numpy.empty(len(xtr_values))
+    min_r.fill(numpy.inf)
+    min_r[subset_xtr[order][first]] = subset_r[order][first]
+    inactive[subset] = min_r[subset_xtr] < subset_r
+    return inactive
+
+
+def _running_means(xtr, runcat, xi, ri, q_across):
+    """
+    The columns of temprunningcatalog for the pairs, with the running
+    catalog averages updated with the extracted sources.
+
+    The expressions are those of the association query; if the extraction
+    region crosses the RA = 0/360 meridian, the RA averages of sources near
+    it are taken in shifted RA.
+    """
+    d = runcat['datapoints'][ri]
+    ra, decl = xtr['ra'][xi], xtr['decl'][xi]
+    weight_ra = 1 / xtr['uncertainty_ew'][xi] ** 2
+    weight_decl = 1 / xtr['uncertainty_ns'][xi] ** 2
+    avg_weight_ra = runcat['avg_weight_ra'][ri]
+    avg_weight_decl = runcat['avg_weight_decl'][ri]
+    sum_weight_ra = d * avg_weight_ra + weight_ra
+    sum_weight_decl = d * avg_weight_decl + weight_decl
+
+    columns = {}
+    columns['datapoints'] = d + 1
+    wm_ra = (d * runcat['avg_wra'][ri] + ra * weight_ra) / sum_weight_ra
+    avg_wra = (d * runcat['avg_wra'][ri] + ra * weight_ra) / (d + 1)
+    wm_decl = (d * runcat['avg_wdecl'][ri] + decl * weight_decl) / sum_weight_decl
+    if q_across:
+        rc_ra = runcat['wm_ra'][ri]
+        wrap = (rc_ra < 90) | (rc_ra > 270)
+        shifted_rc_ra, shifted_ra = _wrapped_ra(rc_ra), _wrapped_ra(ra)
+        wm_ra = numpy.where(
+            wrap,
+            (d * avg_weight_ra * shifted_rc_ra + shifted_ra * weight_ra) /
+            sum_weight_ra - 180,
+            wm_ra)
+        numerator = (d * avg_weight_ra * shifted_rc_ra + shifted_ra * weight_ra
+                     - d * avg_weight_ra * 180 - 180 * weight_ra) / (d + 1)
+        period = 360 * sum_weight_ra / (d + 1)
+        avg_wra = numpy.where(
+            wrap, numerator - period * numpy.floor(numerator / period),
+            avg_wra)
+        wm_decl = ((d * avg_weight_decl * runcat['wm_decl'][ri] +
+                    decl * weight_decl) / sum_weight_decl)
+    columns['x'] = numpy.cos(numpy.radians(wm_decl)) * numpy.cos(
+        numpy.radians(wm_ra))
+    columns['y'] = numpy.cos(numpy.radians(wm_decl)) * numpy.sin(
+        numpy.radians(wm_ra))
+    columns['z'] = numpy.sin(numpy.radians(wm_decl))
+    if q_across:
+        # A tiny negative RA is snapped to zero, see the association query.
+        wm_ra = numpy.where(
+            wm_ra < 0, numpy.where(numpy.abs(wm_ra) > 8e-14, wm_ra + 360, 0.0),
+            wm_ra)
+    columns['wm_ra'] = wm_ra
+    columns['wm_decl'] = wm_decl
+    columns['zone'] = numpy.floor(wm_decl)
+    columns['wm_uncertainty_ew'] = numpy.sqrt(
+        1 / ((d + 1) * (sum_weight_ra / (d + 1))))
+    columns['wm_uncertainty_ns'] = numpy.sqrt(
+        1 / ((d + 1) * (sum_weight_decl / (d + 1))))
+    columns['avg_ra_err'] = (d * runcat['avg_ra_err'][ri] +
+                             xtr['ra_err'][xi]) / (d + 1)
+    columns['avg_decl_err'] = (d * runcat['avg_decl_err'][ri] +
+                               xtr['decl_err'][xi]) / (d + 1)
+    columns['avg_wra'] = avg_wra
+    columns['avg_wdecl'] = (d * runcat['avg_wdecl'][ri] +
+                            decl * weight_decl) / (d + 1)
+    columns['avg_weight_ra'] = sum_weight_ra / (d + 1)
+    columns['avg_weight_decl'] = sum_weight_decl / (d + 1)
+
+    # Fluxes; a running catalog source without fluxes in this band starts
+    # with those of the extracted source.
+    n = runcat['f_datapoints'][ri]
+    new_band = numpy.isnan(n)
+    n = numpy.where(new_band, 0, n)
+    columns['f_datapoints'] = n + 1
+    for kind in ('peak', 'int'):
+        flux = xtr['f_%s' % kind][xi]
+        weight = 1 / xtr['f_%s_err' % kind][xi] ** 2
+        new_values = {
+            'avg_f_%s' % kind: flux,
+            'avg_f_%s_sq' % kind: flux * flux,
+            'avg_f_%s_weight' % kind: weight,
+            'avg_weighted_f_%s' % kind: flux * weight,
+            'avg_weighted_f_%s_sq' % kind: flux * flux * weight,
+        }
+        for name, value in new_values.items():
+            old = numpy.where(new_band, 0, runcat[name][ri])
+            columns[name] = numpy.where(new_band, value,
+                                        (n * old + value) / (n + 1))
+    return columns
+
+
+def insert_temprunningcatalog(image_id, deRuiter_r, q_across):
+    """
+    Fill temprunningcatalog with the candidate associations of the
+    extracted sources of an image, flagging the many-to-many ones.
+
+    This has the same result as
+    :func:`tkp.db.associations._insert_temprunningcatalog` followed by
+    :func:`tkp.db.associations._flag_many_to_many_tempruncat`. As for
+    those, the pixel ranges around the image must be in temppixelrange.
+
+    Returns:
+        the number of rows inserted.
+    """
+    check_scipy()
+    args = {'image_id': image_id}
+    dataset, band, stokes, rb_smaj = tkp.db.execute(
+        _image_query, args).fetchone()
+    xtr = _columns(tkp.db.execute(_extractedsource_query, args).fetchall(),
+                   _extractedsource_fields)
+    if not len(xtr['id']):
+        return 0
+
+    args = {'dataset': dataset, 'band': band, 'stokes': stokes}
+    runcat = _columns(
+        tkp.db.execute(_runningcatalog_query, args).fetchall(),
+        _runningcatalog_fields)
+    logger.debug("Matching %s extracted sources with %s running catalog "
+                 "sources" % (len(xtr['id']), len(runcat['id'])))
+
+    xi, ri, distance_arcsec, r = candidate_pairs(xtr, runcat, rb_smaj,
+                                                 deRuiter_r, q_across)
+    if not len(xi):
+        return 0
+    runcat_ids = runcat['id'][ri].astype(int)
+    xtrsrc_ids = xtr['id'][xi].astype(int)
+    inactive = flag_many_to_many(runcat_ids, xtrsrc_ids, r)
+    columns = _running_means(xtr, runcat, xi, ri, q_across)
+
+    n = len(r)
+    fields = [runcat_ids.tolist(), xtrsrc_ids.tolist(),
+              _copy_floats(distance_arcsec), _copy_floats(r),
+              [dataset] * n, [band] * n, [stokes] * n,
+              columns['datapoints'].astype(int).tolist(),
+              columns['zone'].astype(int).tolist()]
+    fields.extend(_copy_floats(columns[name]) for name in (
+        'wm_ra', 'wm_decl', 'wm_uncertainty_ew', 'wm_uncertainty_ns',
+        'avg_ra_err', 'avg_decl_err', 'avg_wra', 'avg_wdecl', 'avg_weight_ra',
+        'avg_weight_decl', 'x', 'y', 'z'))
+    fields.append(['true' if flag else 'false' for flag in inactive])
+    fields.append(columns['f_datapoints'].astype(int).tolist())
+    fields.extend(_copy_floats(columns[name]) for name in (
+        'avg_f_peak', 'avg_f_peak_sq', 'avg_f_peak_weight',
+        'avg_weighted_f_peak', 'avg_weighted_f_peak_sq', 'avg_f_int',
+        'avg_f_int_sq', 'avg_f_int_weight', 'avg_weighted_f_int',
+        'avg_weighted_f_int_sq'))
+    rows = zip(*fields)
+    copy_rows('temprunningcatalog', _temprunningcatalog_columns,
+              [_temprunningcatalog_row_format % row for row in rows])
+    return len(rows)
@@ -348,6 +348,7 @@ INSERT INTO runningcatalog
   ,x
   ,y
   ,z
+  ,hpx
   ,mon_src
   )
   SELECT x.id AS xtrsrc
@@ -367,6 +368,7 @@ INSERT INTO runningcatalog
         ,x.x
         ,x.y
         ,x.z
+        ,x.hpx
         ,TRUE
     FROM image i
          JOIN extractedsource x
@@ -487,7 +487,8 @@ class Image(DBObject):
 
         insert_extracted_sources(self._id, results=results, extract_type=extract)
 
-    def associate_extracted_sources(self, deRuiter_r, new_source_sigma_margin):
+    def associate_extracted_sources(self, deRuiter_r, new_source_sigma_margin,
+                                    in_memory=False):
         """Associate sources from the last images with previously
         extracted sources within the same dataset
 
@@ -496,9 +497,11 @@ class Image(DBObject):
             deRuiter_r (float): The De Ruiter radius for source
                 association. The default value is set through the
                 tkp.config module
+            in_memory (bool): find the candidate associations in Python,
+                see tkp.db.matching
         """
         associate_extracted_sources(self._id, deRuiter_r,
-                                    new_source_sigma_margin)
+                                    new_source_sigma_margin, in_memory)
 
 
 class ExtractedSource(DBObject):
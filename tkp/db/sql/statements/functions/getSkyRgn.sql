@@ -8,7 +8,8 @@
  * In this case we also trigger execution of `updateSkyRgnMembers` for the new
  * skyregion - this performs a simple assocation with current members of the
  * runningcatalog to find sources that should be visible in the new skyregion,
- * and updates the assocskyrgn table accordingly.
+ * and updates the assocskyrgn table accordingly. If temppixelrange is not
+ * empty, it must hold the HEALPix pixel ranges which cover the new skyregion.
  */
 
 CREATE FUNCTION getSkyRgn(idataset INTEGER, icentre_ra DOUBLE PRECISION,
@@ -51,6 +52,7 @@ BEGIN
       ,x
       ,y
       ,z
+      ,hpx
       ) 
     SELECT idataset
 	      ,icentre_ra
@@ -59,6 +61,7 @@ BEGIN
 	      ,cart.x
 	      ,cart.y
 	      ,cart.z
+	      ,hpxNest(cart.x, cart.y, cart.z)
     FROM (SELECT *
 		  FROM cartesian(icentre_ra,icentre_decl)
 		  ) cart
@@ -115,6 +118,7 @@ BEGIN
       ,x
       ,y
       ,z
+      ,hpx
       )
     SELECT oskyrgnid
 	      ,idataset
@@ -124,6 +128,7 @@ BEGIN
 	      ,cart.x
 	      ,cart.y
 	      ,cart.z
+	      ,hpxNest(cart.x, cart.y, cart.z)
     FROM (SELECT *
 		  FROM cartesian(icentre_ra,icentre_decl)
 		  ) cart
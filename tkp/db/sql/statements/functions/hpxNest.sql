@@ -0,0 +1,170 @@
+--DROP FUNCTION hpxNest;
+
+/**
+ * This function computes the HEALPix pixel number in the nested scheme,
+ * at order 12, of a position given by its x,y,z co-ordinates on the
+ * cartesian unit sphere.
+ *
+ * The calculation is that of tkp.utility.healpix.xyz2nest, which gives the
+ * pixel numbers of the extracted sources when they are inserted. The
+ * pixel numbers of both must agree, and the order must be
+ * tkp.utility.healpix.ORDER.
+ */
+CREATE FUNCTION hpxNest(ix DOUBLE PRECISION, iy DOUBLE PRECISION,
+                        iz DOUBLE PRECISION)
+RETURNS BIGINT
+
+{% ifdb postgresql %}
+AS $$
+  DECLARE nside BIGINT := 4096;
+  DECLARE za DOUBLE PRECISION;
+  DECLARE tt DOUBLE PRECISION;
+  DECLARE tp DOUBLE PRECISION;
+  DECLARE tmp DOUBLE PRECISION;
+  DECLARE jp BIGINT;
+  DECLARE jm BIGINT;
+  DECLARE ntt BIGINT;
+  DECLARE face BIGINT;
+  DECLARE fx BIGINT;
+  DECLARE fy BIGINT;
+  DECLARE pix BIGINT := 0;
+  DECLARE bit BIGINT := 1;
+BEGIN
+  za := ABS(iz);
+  tt := ATAN2(iy, ix) / (PI() / 2);
+  IF tt < 0 THEN
+    tt := tt + 4;
+  END IF;
+  IF tt >= 4 THEN
+    tt := 0;
+  END IF;
+
+  IF za <= 2.0 / 3 THEN
+    jp := CAST(FLOOR(nside * (0.5 + tt) - nside * iz * 0.75) AS BIGINT);
+    jm := CAST(FLOOR(nside * (0.5 + tt) + nside * iz * 0.75) AS BIGINT);
+    IF jp / nside = jm / nside THEN
+      face := MOD(jp / nside, 4) + 4;
+    ELSIF jp / nside < jm / nside THEN
+      face := jp / nside;
+    ELSE
+      face := jm / nside + 8;
+    END IF;
+    fx := MOD(jm, nside);
+    fy := nside - MOD(jp, nside) - 1;
+  ELSE
+    ntt := CAST(FLOOR(tt) AS BIGINT);
+    IF ntt > 3 THEN
+      ntt := 3;
+    END IF;
+    tp := tt - ntt;
+    tmp := nside * SQRT(3 * (ix * ix + iy * iy) / (1 + za));
+    jp := CAST(FLOOR(tp * tmp) AS BIGINT);
+    jm := CAST(FLOOR((1 - tp) * tmp) AS BIGINT);
+    IF jp > nside - 1 THEN
+      jp := nside - 1;
+    END IF;
+    IF jm > nside - 1 THEN
+      jm := nside - 1;
+    END IF;
+    IF iz >= 0 THEN
+      face := ntt;
+      fx := nside - jm - 1;
+      fy := nside - jp - 1;
+    ELSE
+      face := ntt + 8;
+      fx := jp;
+      fy := jm;
+    END IF;
+  END IF;
+
+  WHILE fx > 0 OR fy > 0 LOOP
+    pix := pix + MOD(fx, 2) * bit + MOD(fy, 2) * 2 * bit;
+    fx := fx / 2;
+    fy := fy / 2;
+    bit := bit * 4;
+  END LOOP;
+
+  RETURN face * nside * nside + pix;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+{% endifdb %}
+
+
+{% ifdb monetdb %}
+BEGIN
+  DECLARE nside BIGINT;
+  DECLARE za DOUBLE PRECISION;
+  DECLARE tt DOUBLE PRECISION;
+  DECLARE tp DOUBLE PRECISION;
+  DECLARE tmp DOUBLE PRECISION;
+  DECLARE jp BIGINT;
+  DECLARE jm BIGINT;
+  DECLARE ntt BIGINT;
+  DECLARE face BIGINT;
+  DECLARE fx BIGINT;
+  DECLARE fy BIGINT;
+  DECLARE pix BIGINT;
+  DECLARE bit BIGINT;
+
+  SET nside = 4096;
+  SET pix = 0;
+  SET bit = 1;
+  SET za = ABS(iz);
+  SET tt = ATAN(iy, ix) / (PI() / 2);
+  IF tt < 0 THEN
+    SET tt = tt + 4;
+  END IF;
+  IF tt >= 4 THEN
+    SET tt = 0;
+  END IF;
+
+  IF za <= 2.0 / 3 THEN
+    SET jp = CAST(FLOOR(nside * (0.5 + tt) - nside * iz * 0.75) AS BIGINT);
+    SET jm = CAST(FLOOR(nside * (0.5 + tt) + nside * iz * 0.75) AS BIGINT);
+    IF jp / nside = jm / nside THEN
+      SET face = MOD(jp / nside, 4) + 4;
+    ELSE
+      IF jp / nside < jm / nside THEN
+        SET face = jp / nside;
+      ELSE
+        SET face = jm / nside + 8;
+      END IF;
+    END IF;
+    SET fx = MOD(jm, nside);
+    SET fy = nside - MOD(jp, nside) - 1;
+  ELSE
+    SET ntt = CAST(FLOOR(tt) AS BIGINT);
+    IF ntt > 3 THEN
+      SET ntt = 3;
+    END IF;
+    SET tp = tt - ntt;
+    SET tmp = nside * SQRT(3 * (ix * ix + iy * iy) / (1 + za));
+    SET jp = CAST(FLOOR(tp * tmp) AS BIGINT);
+    SET jm = CAST(FLOOR((1 - tp) * tmp) AS BIGINT);
+    IF jp > nside - 1 THEN
+      SET jp = nside - 1;
+    END IF;
+    IF jm > nside - 1 THEN
+      SET jm = nside - 1;
+    END IF;
+    IF iz >= 0 THEN
+      SET face = ntt;
+      SET fx = nside - jm - 1;
+      SET fy = nside - jp - 1;
+    ELSE
+      SET face = ntt + 8;
+      SET fx = jp;
+      SET fy = jm;
+    END IF;
+  END IF;
+
+  WHILE fx > 0 OR fy > 0 DO
+    SET pix = pix + MOD(fx, 2) * bit + MOD(fy, 2) * 2 * bit;
+    SET fx = fx / 2;
+    SET fy = fy / 2;
+    SET bit = bit * 4;
+  END WHILE;
+
+  RETURN face * nside * nside + pix;
+END;
+{% endifdb %}
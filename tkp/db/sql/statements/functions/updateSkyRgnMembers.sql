@@ -13,9 +13,14 @@
  * comparison.
  * 
  * 
- * Note 2. (To Do:) This distance check could be made more efficient by 
- * restricting to a range of RA values, as we do with the Dec. 
- * However, this optimization is complicated by the meridian wrap-around issue. 
+ * Note 2. If temppixelrange holds any ranges, the distance check is
+ * restricted to the runningcatalog sources whose HEALPix pixel (hpx) lies in
+ * one of them; they must then cover the skyregion. They are inserted by
+ * tkp.db.general.insert_image() for a new skyregion, see
+ * tkp.utility.healpix. Unlike a range of declinations, this restricts the
+ * search also in RA, without a special case for the meridian wrap-around.
+ * If temppixelrange is empty, the search is restricted to the range of
+ * declinations of the skyregion instead.
  * 
  */
 CREATE FUNCTION updateSkyRgnMembers(isky_rgn_id INTEGER)
@@ -25,6 +30,7 @@ RETURNS DOUBLE PRECISION
 AS $$
   DECLARE inter DOUBLE PRECISION;
   DECLARE inter_sq DOUBLE PRECISION;
+  DECLARE nranges INT;
 BEGIN
   DELETE
     FROM assocskyrgn
@@ -36,6 +42,8 @@ BEGIN
                    WHERE id=isky_rgn_id);
 
   inter_sq := inter * inter;
+
+  nranges := (SELECT COUNT(*) FROM temppixelrange);
 {% endifdb %}
 
 
@@ -43,6 +51,7 @@ BEGIN
 BEGIN
   DECLARE inter DOUBLE PRECISION;
   DECLARE inter_sq DOUBLE PRECISION;
+  DECLARE nranges INT;
 
   DELETE
     FROM assocskyrgn
@@ -54,6 +63,8 @@ BEGIN
                    WHERE id=isky_rgn_id);
 
   SET inter_sq = inter*inter;
+
+  SET nranges = (SELECT COUNT(*) FROM temppixelrange);
 {% endifdb %}
 
 
@@ -71,8 +82,27 @@ BEGIN
                       		  ) / 2 )
           		 )
     FROM skyregion sky
+    	,temppixelrange p
     	,runningcatalog rc
    WHERE sky.id = isky_rgn_id
+     AND rc.dataset = sky.dataset
+     AND rc.hpx BETWEEN p.hpx_min AND p.hpx_max
+ 	 AND (  (rc.x - sky.x) * (rc.x - sky.x)
+            + (rc.y - sky.y) * (rc.y - sky.y)
+            + (rc.z - sky.z) * (rc.z - sky.z)
+         ) < inter_sq
+  UNION ALL
+  SELECT rc.id as runcat
+        ,sky.id as skyrgn
+        ,DEGREES(2 * ASIN(SQRT( (rc.x - sky.x) * (rc.x - sky.x)
+                       			+ (rc.y - sky.y) * (rc.y - sky.y)
+                       			+ (rc.z - sky.z) * (rc.z - sky.z)
+                      		  ) / 2 )
+          		 )
+    FROM skyregion sky
+    	,runningcatalog rc
+   WHERE nranges = 0
+     AND sky.id = isky_rgn_id
      AND rc.dataset = sky.dataset
    	 AND rc.wm_decl BETWEEN sky.centre_decl - sky.xtr_radius
                         AND sky.centre_decl + sky.xtr_radius
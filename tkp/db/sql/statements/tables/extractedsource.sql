@@ -16,6 +16,7 @@ CREATE TABLE extractedsource
   ,x DOUBLE PRECISION NOT NULL
   ,y DOUBLE PRECISION NOT NULL
   ,z DOUBLE PRECISION NOT NULL
+  ,hpx BIGINT NOT NULL
   ,racosdecl DOUBLE PRECISION NOT NULL
   ,margin BOOLEAN NOT NULL DEFAULT FALSE
   ,det_sigma DOUBLE PRECISION NOT NULL
@@ -48,6 +49,7 @@ CREATE INDEX "extractedsource_ra" ON "extractedsource" ("ra");
 CREATE INDEX "extractedsource_x" ON "extractedsource" ("x");
 CREATE INDEX "extractedsource_y" ON "extractedsource" ("y");
 CREATE INDEX "extractedsource_z" ON "extractedsource" ("z");
+CREATE INDEX "extractedsource_hpx" ON "extractedsource" ("hpx");
 CREATE INDEX "extractedsource_ra_err" ON "extractedsource" ("ra_err");
 CREATE INDEX "extractedsource_decl_err" ON "extractedsource" ("decl_err");
 {% endifdb %}
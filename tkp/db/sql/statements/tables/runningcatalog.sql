@@ -17,6 +17,7 @@ CREATE TABLE runningcatalog
   ,x DOUBLE PRECISION NOT NULL
   ,y DOUBLE PRECISION NOT NULL
   ,z DOUBLE PRECISION NOT NULL
+  ,hpx BIGINT NOT NULL
   ,inactive BOOLEAN NOT NULL DEFAULT FALSE
   ,mon_src BOOLEAN NOT NULL DEFAULT FALSE
 {% ifdb postgresql %}
@@ -38,6 +39,7 @@ CREATE INDEX "runningcatalog_wm_decl" ON "runningcatalog" ("wm_decl");
 CREATE INDEX "runningcatalog_x" ON "runningcatalog" ("x");
 CREATE INDEX "runningcatalog_y" ON "runningcatalog" ("y");
 CREATE INDEX "runningcatalog_z" ON "runningcatalog" ("z");
+CREATE INDEX "runningcatalog_hpx" ON "runningcatalog" ("hpx");
 CREATE INDEX "runningcatalog_wm_uncertainty_ew" ON "runningcatalog" ("wm_uncertainty_ew");
 CREATE INDEX "runningcatalog_wm_uncertainty_ns" ON "runningcatalog" ("wm_uncertainty_ns");
 {% endifdb %}
@@ -2,6 +2,7 @@
  * This table stores representations of regions of sky. 
  * centre_ra, centre_decl, and xtr_radius should all be in degrees.
  * x,y,z are the cartesian representation of the central ra,decl.
+ * hpx is the HEALPix pixel of the centre, see tkp.utility.healpix.
  */
 
 {% ifdb monetdb %}
@@ -24,6 +25,7 @@ CREATE TABLE skyregion
   ,x DOUBLE PRECISION NOT NULL
   ,y DOUBLE PRECISION NOT NULL
   ,z DOUBLE PRECISION NOT NULL
+  ,hpx BIGINT NOT NULL
   ,PRIMARY KEY (id)
   ,FOREIGN KEY (dataset) REFERENCES dataset (id)
   )
@@ -31,4 +33,5 @@ CREATE TABLE skyregion
 
 {% ifdb postgresql %}
 CREATE INDEX "skyregion_dataset" ON "skyregion" ("dataset");
+CREATE INDEX "skyregion_hpx" ON "skyregion" ("hpx");
 {% endifdb %}
\ No newline at end of file
@@ -0,0 +1,10 @@
+/**
+ * This table holds the ids of the images whose extracted sources are being
+ * associated. The association queries join it, rather than select a single
+ * image, so that the sources of a group of images are associated in one go,
+ * see tkp.db.associations.associate_images().
+ */
+CREATE TABLE tempimage
+  (image INT NOT NULL
+  )
+;
@@ -0,0 +1,13 @@
+/**
+ * This table holds ranges of HEALPix pixel numbers, which together cover a
+ * region of the sky. Queries find the sources in the region by joining
+ * their hpx column with these ranges. The ranges are replaced for each query,
+ * see tkp.db.general.fill_temppixelrange(), and removed after use.
+ *
+ * hpx_min and hpx_max are the first and last pixel of a range.
+ */
+CREATE TABLE temppixelrange
+  (hpx_min BIGINT NOT NULL
+  ,hpx_max BIGINT NOT NULL
+  )
+;
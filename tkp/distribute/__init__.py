@@ -6,6 +6,10 @@ sub modules should communicate with the other parts of TKP through the
 
 import importlib
 import logging
+import Queue
+import sys
+import threading
+import time
 
 
 logger = logging.getLogger(__name__)
@@ -41,9 +45,122 @@ class Runner(object):
         func = self.get_func(func_name)
         return self.module.map(func, iterable, args)
 
+    def imap(self, func_name, iterable, args=[], chunksize=1):
+        """
+        As map, but returns the results as soon as they are available, in
+        the order of iterable.
+
+        args:
+            chunksize: the number of items sent to a worker at a time
+        returns:
+            an iterator over (index, result) tuples, where index is the
+            index in iterable of the item of the result
+        """
+        func = self.get_func(func_name)
+        return self.module.imap(func, iterable, args, chunksize, ordered=True)
+
+    def imap_unordered(self, func_name, iterable, args=[], chunksize=1):
+        """
+        As imap, but returns every result as soon as it is available, in the
+        order in which they are completed.
+        """
+        func = self.get_func(func_name)
+        return self.module.imap(func, iterable, args, chunksize,
+                                ordered=False)
+
+    def map_ahead(self, func_name, chunks, args=[], lookahead=1):
+        """
+        Maps a function over successive chunks of work in the background.
+
+        args:
+            func_name: The function to be called
+            chunks: a list of lists of objects to iterate over
+            args: list of arguments to give to the function
+            lookahead: the number of chunks which may be mapped ahead of
+                the one being processed by the caller
+        returns:
+            a :class:`MapAhead`, which iterates over the chunks, in order;
+            the results of each chunk are as for imap_unordered.
+        """
+        self.get_func(func_name)
+        return MapAhead(self, func_name, chunks, args, lookahead)
+
     def get_func(self, func_name):
         try:
             return getattr(self.tasks, func_name)
         except AttributeError:
             raise NotImplementedError('%s not implemented for %s' %
                                       (func_name, self.mod_path))
+
+
+class MapAhead(object):
+    """
+    Iterates over the results of mapping a function over successive chunks
+    of work, such as the images of successive timesteps. The maps run one
+    after another in a background thread, while the caller processes the
+    results of earlier chunks, up to lookahead chunks ahead of the chunk
+    being processed. The caller is done with a chunk when it asks for the
+    results of the next one.
+
+    The results of a chunk are iterated over as they are completed, as
+    (index, result) tuples, see :meth:`Runner.imap_unordered`, so that the
+    caller can start on them before the whole chunk is done.
+
+    The time spent in the maps and the time the caller waited for their
+    results are recorded, to show how busy either side was.
+    """
+    def __init__(self, runner, func_name, chunks, args=[], lookahead=1):
+        self.runner = runner
+        self.func_name = func_name
+        self.chunks = list(chunks)
+        self.args = args
+        self.lookahead = lookahead
+        # Seconds spent mapping, and waiting for the results of a map.
+        self.busy = 0.
+        self.waited = 0.
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __iter__(self):
+        # The queues of the results of each chunk, as they are mapped.
+        chunk_results = Queue.Queue()
+        # The chunks which may be mapped: the one being processed by the
+        # caller and those ahead of it.
+        slots = threading.Semaphore(self.lookahead + 1)
+        thread = threading.Thread(target=self._map_chunks,
+                                  args=(chunk_results, slots))
+        thread.daemon = True
+        thread.start()
+        for n in range(len(self.chunks)):
+            if n:
+                slots.release()
+            yield self._results(chunk_results.get())
+
+    def _results(self, results):
+        while True:
+            start = time.time()
+            item, exc_info = results.get()
+            self.waited += time.time() - start
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if item is None:
+                return
+            yield item
+
+    def _map_chunks(self, chunk_results, slots):
+        for chunk in self.chunks:
+            slots.acquire()
+            results = Queue.Queue()
+            chunk_results.put(results)
+            start = time.time()
+            try:
+                for item in self.runner.imap_unordered(self.func_name, chunk,
+                                                       self.args):
+                    results.put((item, None))
+            except Exception:
+                results.put((None, sys.exc_info()))
+                return
+            self.busy += time.time() - start
+            # The end of the results of the chunk.
+            results.put((None, None))
@@ -4,6 +4,7 @@ a celeryconfig.py from you PYTHONPATH. The celery app can then be accessed
 using tkp.distribute.celery.celery_app
 """
 from __future__ import absolute_import
+import time
 import warnings
 import logging
 from celery import Celery, group
@@ -36,6 +37,45 @@ def map(func, iterable, arguments=[]):
         # leading to an AttributeError with get().
         return []
 
+def imap(func, iterable, arguments=[], chunksize=1, ordered=True):
+    """
+    All tasks are sent off at once; with chunksize > 1, as tasks which each
+    run func for chunksize items. The results are returned as they come in,
+    polled for every POLL_INTERVAL seconds if not ordered.
+    """
+    calls = [(i,) + tuple(arguments) for i in iterable]
+    if not calls:
+        return iter([])
+    if chunksize > 1:
+        result = func.chunks(calls, chunksize).group()()
+    else:
+        result = group(func.s(*call) for call in calls)()
+    return _imap_results(result.results, chunksize, ordered)
+
+
+# Seconds between checks for finished tasks, for imap with ordered=False.
+POLL_INTERVAL = 0.1
+
+
+def _imap_results(results, chunksize, ordered):
+    pending = list(enumerate(results))
+    while pending:
+        if ordered:
+            ready = pending[:1]
+        else:
+            ready = [(n, r) for n, r in pending if r.ready()]
+            if not ready:
+                time.sleep(POLL_INTERVAL)
+                continue
+        for n, r in ready:
+            pending.remove((n, r))
+            if chunksize > 1:
+                for k, value in enumerate(r.get()):
+                    yield n * chunksize + k, value
+            else:
+                yield n, r.get()
+
+
 def set_cores(cores=0):
     """
     doesn't do anything for celery
@@ -49,6 +49,18 @@ def extract_sources(url, extraction_params):
     return tkp.steps.source_extraction.extract_sources(url, extraction_params)
 
 
+@celery_app.task
+def image_timestamp(url):
+    worker_logger.info("running image timestamp task")
+    return tkp.steps.node.image_timestamp(url)
+
+
+@celery_app.task
+def process_image(url, image_cache_config, job_config):
+    worker_logger.info("running image node task")
+    return tkp.steps.node.process_image(url, image_cache_config, job_config)
+
+
 @celery_app.task
 def test_log():
     """
@@ -1,10 +1,17 @@
 """
 A computation distribution implementation using the build in multiprocessing
 module. the Pool.map function only accepts one argument, so we need to
-zip the iterable together with the arguments.
+zip the iterable together with the arguments. For imap, the index of each
+item in the iterable is sent along with it, and returned with its result.
 """
 from multiprocessing import Pool, cpu_count
 
+# Defined before the pool is started, so that its worker processes know it.
+def _call_indexed(indexed):
+    index, func, zipped = indexed
+    return index, func(zipped)
+
+
 pool = Pool(processes=cpu_count())
 
 
@@ -22,3 +29,10 @@ def map(func, iterable, args):
     zipped = ((i, args) for i in iterable)
     return pool.map(func, zipped)
 
+
+def imap(func, iterable, args, chunksize=1, ordered=True):
+    indexed = ((index, func, (i, args)) for index, i in enumerate(iterable))
+    if ordered:
+        return pool.imap(_call_indexed, indexed, chunksize)
+    else:
+        return pool.imap_unordered(_call_indexed, indexed, chunksize)
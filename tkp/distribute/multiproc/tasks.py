@@ -29,3 +29,16 @@ def extract_sources(zipped):
     url, args = zipped
     extraction_params = args[0]
     return tkp.steps.source_extraction.extract_sources(url, extraction_params)
+
+
+def image_timestamp(zipped):
+    logger.info("running image timestamp task")
+    url, args = zipped
+    return tkp.steps.node.image_timestamp(url)
+
+
+def process_image(zipped):
+    logger.info("running image node task")
+    url, args = zipped
+    image_cache_config, job_config = args
+    return tkp.steps.node.process_image(url, image_cache_config, job_config)
@@ -4,6 +4,15 @@ def map(func, iterable, arguments=[]):
     return x
 
 
+def imap(func, iterable, arguments=[], chunksize=1, ordered=True):
+    """
+    Results are computed one by one when asked for, so they are always in
+    order, and chunksize makes no difference.
+    """
+    for index, i in enumerate(iterable):
+        yield index, func(i, *arguments)
+
+
 def set_cores(cores=0):
     """
     doesn't do anything for serial
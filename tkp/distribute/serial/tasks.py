@@ -20,3 +20,13 @@ def quality_reject_check(url, job_config):
 def extract_sources(url, extraction_params):
     logger.info("running extracted sources task")
     return tkp.steps.source_extraction.extract_sources(url, extraction_params)
+
+
+def image_timestamp(url):
+    logger.info("running image timestamp task")
+    return tkp.steps.node.image_timestamp(url)
+
+
+def process_image(url, image_cache_config, job_config):
+    logger.info("running image node task")
+    return tkp.steps.node.process_image(url, image_cache_config, job_config)
@@ -11,17 +11,20 @@ The exceptions are a couple of celery-specific subroutines.
 import imp
 import logging
 import os
+import time
+from itertools import izip
 from tkp import steps
 from tkp.config import initialize_pipeline_config, get_database_config
 from tkp.db import consistency as dbconsistency
 from tkp.db import Image
 from tkp.db import general as dbgen
 from tkp.db import associations as dbass
+from tkp.db import matching
 from tkp.distribute import Runner
 from tkp.steps.misc import (load_job_config, dump_configs_to_logdir,
                                    check_job_configs_match,
                                    setup_log_file, dump_database_backup,
-                                group_per_timestep
+                                group_per_timestep, group_urls_per_timestep
                             )
 from tkp.db.configstore import store_config, fetch_config
 from tkp.steps.persistence import create_dataset, store_images
@@ -42,6 +45,9 @@ def run(job_name, supplied_mon_coords=[]):
                                                                     'multiproc'))
     runner = Runner(distributor=distributor,
                     cores=parallelise.get('cores', 0))
+    # The number of timesteps whose images may be processed ahead of the
+    # one being stored and associated.
+    lookahead = parallelise.get('lookahead', 1)
 
     debug = pipe_config.logging.debug
     #Setup logfile before we do anything else
@@ -61,6 +67,10 @@ def run(job_name, supplied_mon_coords=[]):
     job_config = load_job_config(pipe_config)
     se_parset = job_config.source_extraction
     deruiter_radius = job_config.association.deruiter_radius
+    in_memory_association = job_config.association.get('in_memory', False)
+    if in_memory_association:
+        matching.check_scipy()
+    batch_association = job_config.association.get('batch_timestep', False)
     new_src_sigma = job_config.transient_search.new_source_sigma_margin
 
     all_images = imp.load_source('images_to_process',
@@ -97,78 +107,126 @@ def run(job_name, supplied_mon_coords=[]):
 
     dump_configs_to_logdir(log_dir, job_config, pipe_config)
 
-    logger.info("performing persistence step")
     image_cache_params = pipe_config.image_cache
-    imgs = [[img] for img in all_images]
-
-    rms_est_sigma = job_config.persistence.rms_est_sigma
-    rms_est_fraction = job_config.persistence.rms_est_fraction
-    metadatas = runner.map("persistence_node_step", imgs,
-                           [image_cache_params, rms_est_sigma, rms_est_fraction])
-    metadatas = [m[0] for m in metadatas if m]
-
-    logger.info("Storing images")
-    image_ids = store_images(metadatas,
-                             job_config.source_extraction.extraction_radius_pix,
-                             dataset_id)
-
-    db_images = [Image(id=image_id) for image_id in image_ids]
-
-    logger.info("performing quality check")
-    urls = [img.url for img in db_images]
-    arguments = [job_config]
-    rejecteds = runner.map("quality_reject_check", urls, arguments)
-
-    good_images = []
-    for image, rejected in zip(db_images, rejecteds):
-        if rejected:
-            reason, comment = rejected
-            steps.quality.reject_image(image.id, reason, comment)
-        else:
-            good_images.append(image)
-
-    if not good_images:
-        logger.warn("No good images under these quality checking criteria")
-        return
-
-    grouped_images = group_per_timestep(good_images)
-    timestep_num = len(grouped_images)
-    for n, (timestep, images) in enumerate(grouped_images):
+    logger.info("reading the start times of the images")
+    # Only the headers are read here, to group the images per timestep.
+    timestamps = runner.map("image_timestamp", all_images)
+    grouped_urls = group_urls_per_timestep(all_images, timestamps)
+    timestep_num = len(grouped_urls)
+
+    # Every image is opened once, on a node, for its metadata, its quality
+    # check and the extraction of its sources. The workers process up to
+    # lookahead timesteps ahead; the database is only written to here, one
+    # timestep after another, and the results of a timestep are dropped once
+    # they are stored.
+    node_results = runner.map_ahead(
+        "process_image", [urls for _, urls in grouped_urls],
+        [image_cache_params, job_config], lookahead)
+
+    total_db_time = 0.
+    n_good_images = 0
+    pipeline_start = time.time()
+    for n, ((timestep, urls), results) in enumerate(
+            izip(grouped_urls, node_results)):
+        # In the order of the images, so that they are stored in the same
+        # order in every run.
+        results = [r for _, r in sorted(results) if r]
         msg = "processing %s images in timestep %s (%s/%s)"
-        logger.info(msg % (len(images), timestep, n+1, timestep_num))
-
-        logger.info("performing source extraction")
-        urls = [img.url for img in images]
-        arguments = [se_parset]
-
-        extraction_results = runner.map("extract_sources", urls, arguments)
+        logger.info(msg % (len(results), timestep, n+1, timestep_num))
+
+        logger.info("storing images")
+        db_time = 0.
+        start = time.time()
+        image_ids = store_images([r.metadata for r in results],
+                                 se_parset.extraction_radius_pix, dataset_id)
+        results_by_url = dict((r.metadata['url'], r) for r in results)
+
+        good_images = []
+        for image_id in image_ids:
+            image = Image(id=image_id)
+            rejected = results_by_url[image.url].rejected
+            if rejected:
+                reason, comment = rejected
+                steps.quality.reject_image(image.id, reason, comment)
+            else:
+                good_images.append(image)
+        db_time += time.time() - start
+        n_good_images += len(good_images)
+        # Sorted per frequency and stokes.
+        images = [image for _, group in group_per_timestep(good_images)
+                  for image in group]
 
         logger.info("storing extracted sources to database")
         # we also set the image max,min RMS values which calculated during
         # source extraction
-        for image, results in zip(images, extraction_results):
-            image.update(rms_min=results.rms_min, rms_max=results.rms_max,
+        for image in images:
+            start = time.time()
+            extraction = results_by_url[image.url].extraction
+            image.update(rms_min=extraction.rms_min,
+                rms_max=extraction.rms_max,
                 detection_thresh=se_parset['detection_threshold'],
                 analysis_thresh=se_parset['analysis_threshold'])
-            dbgen.insert_extracted_sources(image.id, results.sources, 'blind')
+            dbgen.insert_extracted_sources(image.id, extraction.sources,
+                                           'blind')
+            db_time += time.time() - start
+        del results, results_by_url
 
         logger.info("performing database operations")
+        start = time.time()
+        if batch_association:
+            # Images are associated together where their fields do not
+            # overlap; the groups are processed in turn.
+            groups = dbass.group_independent_images(
+                [image.id for image in images])
+            logger.info("associating %s images in %s groups" %
+                        (len(images), len(groups)))
+        else:
+            groups = [[image.id] for image in images]
+        db_time += time.time() - start
+
+        images_by_id = dict((image.id, image) for image in images)
+        for group in groups:
+            logger.info("performing source association for images %s" %
+                        (group,))
+            start = time.time()
+            dbass.associate_images(
+                group, deRuiter_r=deruiter_radius,
+                new_source_sigma_margin=new_src_sigma,
+                in_memory=in_memory_association)
+            db_time += time.time() - start
+
+            for image_id in group:
+                image = images_by_id[image_id]
+                logger.info("performing forced fits for image %s" % image.id)
+                start = time.time()
+                all_fit_posns, all_fit_ids = steps_ff.get_forced_fit_requests(
+                    image)
+                db_time += time.time() - start
+                if all_fit_posns:
+                    successful_fits, successful_ids = steps_ff.perform_forced_fits(
+                        all_fit_posns, all_fit_ids, image.url, se_parset)
+
+                    start = time.time()
+                    steps_ff.insert_and_associate_forced_fits(image.id,successful_fits,
+                                                              successful_ids)
+                    db_time += time.time() - start
+
+        logger.info("timestep %s: %.2f s of database operations for %s images"
+                    % (timestep, db_time, len(images)))
+        total_db_time += db_time
 
-        for image in images:
-            logger.info("performing DB operations for image %s" % image.id)
-
-            logger.info("performing source association")
-            dbass.associate_extracted_sources(
-                image.id,deRuiter_r=deruiter_radius,
-                new_source_sigma_margin=new_src_sigma)
-
-            all_fit_posns, all_fit_ids = steps_ff.get_forced_fit_requests(image)
-            if all_fit_posns:
-                successful_fits, successful_ids = steps_ff.perform_forced_fits(
-                    all_fit_posns, all_fit_ids, image.url, se_parset)
+        dbgen.update_dataset_process_end_ts(dataset_id)
 
-                steps_ff.insert_and_associate_forced_fits(image.id,successful_fits,
-                                                          successful_ids)
+    if not n_good_images:
+        logger.warn("No good images under these quality checking criteria")
 
+    elapsed = time.time() - pipeline_start
+    if elapsed > 0:
+        logger.info("stage occupancy over %.1f s: source extraction %.0f%%, "
+                    "database operations %.0f%%; waited %.1f s for source "
+                    "extraction" % (elapsed, 100 * node_results.busy / elapsed,
+                                    100 * total_db_time / elapsed,
+                                    node_results.waited))
 
-        dbgen.update_dataset_process_end_ts(dataset_id)
+    logger.info("source association statements, slowest first:")
+    dbass.log_statement_timings()
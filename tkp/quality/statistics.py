@@ -13,20 +13,53 @@ def rms(data):
     return numpy.sqrt(numpy.power(data, 2).sum()/len(data))
 
 
+def _partition_median(data):
+    """Returns the median of a 1D array, partitioning the array in place.
+    Args:
+        data: a numpy array, which is reordered
+    """
+    half = len(data) // 2
+    if not hasattr(data, 'partition'):
+        # ndarray.partition() is new in numpy 1.8; sorting will do as well.
+        data.sort()
+    elif len(data) % 2:
+        data.partition(half)
+    else:
+        data.partition([half - 1, half])
+    if len(data) % 2:
+        return data[half]
+    return (data[half - 1] + data[half]) / 2.0
+
+
 def clip(data, sigma=3):
     """Remove all values above a threshold from the array.
     Uses iterative clipping at sigma value until nothing more is getting clipped.
+    The values are returned in no particular order.
     Args:
         data: a numpy array
     """
-    raveled = data.ravel()
-    median = numpy.median(raveled)
-    std = numpy.std(raveled)
-    newdata = raveled[numpy.abs(raveled-median) <= sigma*std]
-    if len(newdata) and len(newdata) != len(raveled):
-        return clip(newdata, sigma)
-    else:
-        return newdata
+    # Every iteration works on an array of its own, so that the median can
+    # be found by partitioning it in place, without a further copy.
+    raveled = data.ravel().copy()
+    while True:
+        median = _partition_median(raveled)
+        std = numpy.std(raveled)
+        newdata = raveled[numpy.abs(raveled-median) <= sigma*std]
+        if not len(newdata) or len(newdata) == len(raveled):
+            return newdata
+        raveled = newdata
+
+
+def subregion_window(shape, f=4):
+    """Returns the slices selecting the inner region of an image, according
+    to f.
+
+    Resulting area is 4/(f*f) of the original.
+    Args:
+        shape: the shape of the image
+    """
+    x, y = shape
+    return slice(x/2 - x/f, x/2 + x/f), slice(y/2 - y/f, y/2 + y/f)
 
 
 def subregion(data, f=4):
@@ -36,8 +69,18 @@ def subregion(data, f=4):
     Args:
         data: a numpy array
     """
-    x, y = data.shape
-    return data[(x/2 - x/f):(x/2 + x/f), (y/2 - y/f):(y/2 + y/f)]
+    return data[subregion_window(data.shape, f)]
+
+
+def clipped_rms(data, sigma=3):
+    """RMS of data after iterative sigma clipping, calculated in double
+    precision.
+
+    Args:
+        data: a numpy array
+        sigma: sigma value used for clipping
+    """
+    return rms(clip(data.astype(numpy.float64), sigma))
 
 
 def rms_with_clipped_subregion(data, rms_est_sigma=3, rms_est_fraction=4):
@@ -55,4 +98,5 @@ def rms_with_clipped_subregion(data, rms_est_sigma=3, rms_est_fraction=4):
             1/fth of the image size where f=rms_est_fraction
     returns the rms value of a iterative sigma clipped subsection of an image
     """
-    return rms(clip(subregion(data, rms_est_fraction), rms_est_sigma))
+    # For memory-mapped data, only the subsection is read from disk.
+    return clipped_rms(subregion(data, rms_est_fraction), rms_est_sigma)
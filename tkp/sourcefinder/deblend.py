@@ -0,0 +1,287 @@
+"""
+Component tree used for deblending islands.
+
+An island is deblended by raising a threshold through a series of levels
+and watching its pixels above that threshold fall apart into separate
+components. Rather than labelling the island anew at every level, the
+components at all levels are arranged in a tree (a "max-tree") once, in a
+single pass over the pixels. The deblending criteria are then applied by
+walking that tree.
+"""
+
+import numpy
+
+
+def _reduce_at(ufunc, result, index, values):
+    """
+    Reduce values into result[index] with ufunc, in place.
+
+    As ufunc.at(result, index, values), which is not available before numpy
+    1.8: repeated indices accumulate. The values are sorted by index, so
+    that those for the same index can be reduced with ufunc.reduceat().
+    """
+    if not len(index):
+        return
+    order = numpy.argsort(index, kind='mergesort')
+    index = numpy.asarray(index)[order]
+    starts = numpy.flatnonzero(numpy.concatenate(
+        ([True], index[1:] != index[:-1])))
+    targets = index[starts]
+    result[targets] = ufunc(result[targets],
+                            ufunc.reduceat(numpy.asarray(values)[order],
+                                           starts))
+
+
+class ComponentTree(object):
+    """
+    The connected components of an island at a series of thresholds.
+
+    Every node of the tree is a component: a connected set of pixels with
+    values at or above levels[k], for k in the range
+    ``parent level <= k < level``. Its children are the components it falls
+    apart into at higher levels. The root holds the entire island, at
+    "level" 0, i.e. below the first threshold.
+
+    For every node, the following are stored, taken over all its pixels
+    (including those of its descendants): the number of pixels, the sum and
+    maximum of the pixel values, the maximum of the values minus the
+    detection map, the first pixel in raster order, and the bounding box.
+    """
+
+    def __init__(self, values, levels, structuring_element, detection_map):
+        """
+        Args:
+
+            values (numpy.ndarray): 2D island data, with masked pixels
+                filled with zero.
+
+            levels (numpy.ndarray): increasing thresholds.
+
+            structuring_element (array-like): 3x3 array defining the
+                connectivity between pixels, as used by ndimage.label().
+
+            detection_map (numpy.ndarray): 2D detection thresholds, of the
+                same shape as values.
+        """
+        self.levels = levels
+        self.shape = values.shape
+        height, width = values.shape
+
+        # The level of a pixel is the number of thresholds it reaches. We
+        # add a border of pixels below all thresholds, so that neighbours
+        # can be found without checking for the edges.
+        padded_width = width + 2
+        quantized = numpy.zeros((height + 2, padded_width), dtype=numpy.int)
+        quantized[1:-1, 1:-1] = numpy.searchsorted(levels, values,
+                                                   side='right')
+        flat_level = quantized.ravel()
+        structure = numpy.asarray(structuring_element)
+        offsets = [(i - 1) * padded_width + (j - 1)
+                   for i, j in zip(*numpy.nonzero(structure))
+                   if (i, j) != (1, 1)]
+
+        # Pixels above the first threshold, from high to low level.
+        pixels = numpy.flatnonzero(flat_level)
+        pixels = pixels[numpy.argsort(-flat_level[pixels], kind='mergesort')]
+
+        # Build the tree with union-find, as described by Berger et al.
+        # (2007, ICIP, "Effective component tree computation with
+        # application to pattern recognition in astronomical imaging").
+        # Every pixel gets a parent pixel. In the end, one pixel of every
+        # node, its canonical pixel, is the parent of the node's other
+        # pixels, while its own parent is the canonical pixel of the parent
+        # node (or itself, at the root of a tree).
+        order = pixels.tolist()
+        flat_level = flat_level.tolist()
+        parent = {}
+        zpar = {}
+        for p in order:
+            parent[p] = p
+            zpar[p] = p
+            for offset in offsets:
+                n = p + offset
+                if n not in zpar:
+                    continue
+                root = n
+                while zpar[root] != root:
+                    root = zpar[root]
+                while zpar[n] != root:
+                    zpar[n], n = root, zpar[n]
+                if root != p:
+                    parent[root] = p
+                    zpar[root] = p
+        for p in reversed(order):
+            q = parent[p]
+            if flat_level[parent[q]] == flat_level[q]:
+                parent[p] = parent[q]
+
+        # Number the nodes, i.e. the canonical pixels, such that every node
+        # comes after all its descendants.
+        parent = numpy.array([parent[p] for p in order], dtype=numpy.int)
+        level = quantized.ravel()[pixels]
+        canonical = (parent == pixels) | (quantized.ravel()[parent] != level)
+        node_pixels = pixels[canonical]
+        nnodes = len(node_pixels)
+        node_index = numpy.zeros(quantized.size, dtype=numpy.int)
+        node_index[node_pixels] = numpy.arange(nnodes)
+        pixel_node = node_index[numpy.where(canonical, pixels, parent)]
+
+        # The root of every tree becomes a child of the island root, which
+        # is numbered after all other nodes.
+        self.root = nnodes
+        node_parent = node_index[parent[canonical]]
+        node_parent[node_parent == numpy.arange(nnodes)] = self.root
+        self.level = numpy.append(level[canonical], 0)
+        self.parent = numpy.append(node_parent, -1)
+        self.children = [[] for node in range(nnodes + 1)]
+        for node, parent_node in enumerate(node_parent.tolist()):
+            self.children[parent_node].append(node)
+
+        # Per-node statistics, first of the pixels of the node itself...
+        rows = pixels // padded_width - 1
+        cols = pixels % padded_width - 1
+        pixel_values = values[rows, cols]
+        self.count = self._reduce(numpy.add, pixel_node,
+                                  numpy.ones(len(pixels), dtype=numpy.int), 0)
+        self.total = self._reduce(numpy.add, pixel_node,
+                                  pixel_values.astype(numpy.float64), 0.)
+        self.max = self._reduce(numpy.maximum, pixel_node, pixel_values,
+                                -numpy.inf)
+        self.max_excess = self._reduce(
+            numpy.maximum, pixel_node,
+            pixel_values - numpy.asarray(detection_map)[rows, cols],
+            -numpy.inf)
+        self.first = self._reduce(numpy.minimum, pixel_node, pixels,
+                                  quantized.size)
+        self.row_min = self._reduce(numpy.minimum, pixel_node, rows, height)
+        self.row_max = self._reduce(numpy.maximum, pixel_node, rows, -1)
+        self.col_min = self._reduce(numpy.minimum, pixel_node, cols, width)
+        self.col_max = self._reduce(numpy.maximum, pixel_node, cols, -1)
+
+        # ... and then accumulated from the highest level downwards, such
+        # that every node includes all its descendants.
+        for node_level in numpy.unique(self.level[:-1])[::-1]:
+            nodes = numpy.flatnonzero(self.level[:-1] == node_level)
+            parents = self.parent[nodes]
+            for statistic in (self.count, self.total):
+                _reduce_at(numpy.add, statistic, parents, statistic[nodes])
+            for statistic in (self.max, self.max_excess, self.row_max,
+                              self.col_max):
+                _reduce_at(numpy.maximum, statistic, parents,
+                           statistic[nodes])
+            for statistic in (self.first, self.row_min, self.col_min):
+                _reduce_at(numpy.minimum, statistic, parents,
+                           statistic[nodes])
+
+        # Numbering the nodes in depth first order makes the descendants of
+        # every node a contiguous range of numbers, which we use to select
+        # the pixels of a component.
+        self.preorder = numpy.zeros(nnodes + 1, dtype=numpy.int)
+        self.last_descendant = numpy.zeros(nnodes + 1, dtype=numpy.int)
+        counter = 0
+        stack = [(self.root, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                self.last_descendant[node] = counter - 1
+                continue
+            self.preorder[node] = counter
+            counter += 1
+            stack.append((node, True))
+            stack.extend((child, False) for child in self.children[node])
+        self.pixel_order = numpy.empty(self.shape, dtype=numpy.int)
+        self.pixel_order.fill(-1)
+        self.pixel_order[rows, cols] = self.preorder[pixel_node]
+
+    def _reduce(self, ufunc, index, values, initial):
+        """Reduce values per node with ufunc, starting from initial."""
+        result = numpy.empty(self.root + 1, dtype=numpy.asarray(values).dtype)
+        result.fill(initial)
+        _reduce_at(ufunc, result, index, values)
+        return result
+
+    def components(self, nodes, k):
+        """
+        The components at threshold levels[k] of the given nodes.
+
+        nodes must be components at a lower threshold.
+        """
+        result = []
+        stack = list(reversed(nodes))
+        while stack:
+            node = stack.pop()
+            if self.level[node] > k:
+                result.append(node)
+            else:
+                stack.extend(reversed(self.children[node]))
+        return result
+
+    def split(self, start, min_flux):
+        """
+        Split the island into significant components.
+
+        Starting at threshold levels[start], the components of the island
+        are followed to ever higher thresholds. Once a component falls apart
+        into more than one significant part, each of those parts is followed
+        further on its own. A part is significant if it has a pixel above
+        the detection map, and the sum of its pixel values above the
+        threshold exceeds min_flux.
+
+        Returns a list of (node, k) tuples, with the components which did
+        not fall apart any further and the index of the threshold at which
+        they were split off. Parts of the same component are in raster
+        order of their first pixels. If the island as a whole does not fall
+        apart, the result is [(root, None)].
+        """
+        result = []
+        stack = [(self.root, start, None)]
+        while stack:
+            node, start, split_at = stack.pop()
+            split = self._split_once(node, start, min_flux)
+            if split is None:
+                result.append((node, split_at))
+            else:
+                parts, k = split
+                stack.extend((part, k + 1, k) for part in reversed(parts))
+        return result
+
+    def _split_once(self, node, start, min_flux):
+        """
+        Find the first threshold, from levels[start] upwards, at which node
+        falls apart into more than one significant part.
+
+        Returns a tuple of the parts, in raster order, and the index of the
+        threshold, or None if node does not fall apart.
+        """
+        frontier = [node]
+        for k in range(start, len(self.levels)):
+            level = self.levels[k]
+            if level > self.max[node]:
+                return None
+            frontier = self.components(frontier, k)
+            if len(frontier) < 2:
+                continue
+            significant = [
+                part for part in frontier
+                if self.total[part] - level * self.count[part] > min_flux
+                and self.max_excess[part] >= 0]
+            if len(significant) > 1:
+                significant.sort(key=lambda part: self.first[part])
+                return significant, k
+            elif not significant:
+                return None
+        return None
+
+    def component(self, node):
+        """
+        The bounding box and pixels of a component.
+
+        Returns a tuple of slices, selecting the bounding box from the
+        island, and a boolean array which is True for the pixels of the
+        component within it.
+        """
+        chunk = (slice(self.row_min[node], self.row_max[node] + 1),
+                 slice(self.col_min[node], self.col_max[node] + 1))
+        order = self.pixel_order[chunk]
+        return chunk, ((order >= self.preorder[node]) &
+                       (order <= self.last_descendant[node]))
@@ -20,6 +20,7 @@ from ..utility.uncertain import Uncertain
 from .gaussian import gaussian
 from . import fitting
 from . import utils
+from .deblend import ComponentTree
 
 
 logger = logging.getLogger(__name__)
@@ -49,7 +50,7 @@ class Island(object):
 
         # deblend_nthresh is the number of subthresholds used when deblending.
         self.deblend_nthresh = deblend_nthresh
-        # If we deblend too far, we hit the recursion limit. And it's slow.
+        # Deblending many subthresholds is slow.
         if self.deblend_nthresh > 300:
             logger.warn("Limiting to 300 deblending subtresholds")
             self.deblend_nthresh = 300
@@ -98,103 +99,54 @@ class Island(object):
         Iterate up through subthresholds, looking for our island
         splitting into two. If it does, start again, with two or more
         separate islands.
+
+        The subislands at all subthresholds are found at once, in a
+        component tree (see deblend.ComponentTree), which is then walked
+        upwards. niter is the index of the first subthreshold considered.
         """
 
         logger.debug("Deblending source")
-        for level in self.subthrrange[niter:]:
-
-            # The idea is to retain the parent island when no significant
-            # subislands are found and jump to the next subthreshold
-            # using niter.
-            # Deblending is started at a level higher than the lowest
-            # pixel value in the island.
-            # Deblending at the level of the lowest pixel value will
-            # likely not yield anything, because the island was formed at
-            # threshold just below that.
-            # So that is why we use niter+1 (>=1) instead of niter (>=0).
-
-            if level > self.data.max():
-                # level is above the highest pixel value...
-                # Return the current island.
-                break
-            clipped_data = numpy.where(
-                self.data.filled(fill_value=0) >= level, 1, 0)
-            labels, number = ndimage.label((clipped_data),
-                                           self.structuring_element)
-            # If we have more than one island, then we need to make subislands.
-            if number > 1:
-                subislands = []
-                label = 0
-                for chunk in ndimage.find_objects(labels):
-                    label += 1
-                    newdata = numpy.where(
-                        labels == label,
-                        self.data.filled(fill_value=-BIGNUM), -BIGNUM
-                    )
-                    # NB: In class Island(object), rms * analysis_threshold
-                    # is taken as the threshold for the bottom of the island.
-                    # Everything below that level is masked.
-                    # For subislands, this product should be equal to level
-                    # and flat, i.e., horizontal.
-                    # We can achieve this by setting rms=level*ones and
-                    # analysis_threshold=1.
-                    island = Island(
-                                 newdata[chunk],
-                                 (numpy.ones(self.data[chunk].shape) * level),
-                                 (
-                                     slice(self.chunk[0].start + chunk[0].start,
-                                        self.chunk[0].start + chunk[0].stop),
-                                     slice(self.chunk[1].start + chunk[1].start,
-                                        self.chunk[1].start + chunk[1].stop)
-                                 ),
-                                 1,
-                                 self.detection_map[chunk],
-                                 self.beam,
-                                 self.deblend_nthresh,
-                                 self.deblend_mincont,
-                                 self.structuring_element,
-                                 self.rms_orig[chunk[0].start:chunk[0].stop, chunk[1].start:chunk[1].stop],
-                                 self.flux_orig,
-                                 self.subthrrange
-                            )
-
-                    subislands.append(island)
-                # This line should filter out any subisland with insufficient
-                # flux, in about the same way as SExtractor.
-                # Sufficient means: the flux of the branch above the
-                # subthreshold (=level) must exceed some user given fraction
-                # of the composite object, i.e., the original island.
-                subislands = filter(
-                    lambda isl: (isl.data-numpy.ma.array(
-                    numpy.ones(isl.data.shape)*level,
-                    mask=isl.data.mask)).sum() > self.deblend_mincont *
-                                    self.flux_orig, subislands)
-                # Discard subislands below detection threshold
-                subislands = filter(
-                    lambda isl: (isl.data - isl.detection_map).max() >= 0,
-                    subislands)
-                numbersignifsub = len(subislands)
-                # Proceed with the previous island, but make sure the next
-                # subthreshold is higher than the present one.
-                # Or we would end up in an infinite loop...
-                if numbersignifsub > 1:
-                    if niter+1 < self.deblend_nthresh:
-                        # Apparently, the map command always results in
-                        # nested lists.
-                        return list(utils.flatten(map(
-                            lambda island: island.deblend(niter=niter+1),
-                            subislands)))
-                    else:
-                        return subislands
-                elif numbersignifsub == 1 and niter+1 < self.deblend_nthresh:
-                    return Island.deblend(self, niter=niter+1)
-                else:
-                    # In this case we have numbersignifsub == 0 or
-                    # (1 and reached the highest subthreshold level).
-                    # Pull out of deblending loop, return current island.
-                    break
-        # We've not found any subislands: just return this island.
-        return self
+        tree = ComponentTree(self.data.filled(fill_value=0), self.subthrrange,
+                             self.structuring_element, self.detection_map)
+        parts = tree.split(niter, self.deblend_mincont * self.flux_orig)
+        if len(parts) == 1:
+            # We've not found any subislands: just return this island.
+            return self
+
+        subislands = []
+        for node, level_index in parts:
+            level = self.subthrrange[level_index]
+            chunk, pixels = tree.component(node)
+            newdata = numpy.where(pixels,
+                                  self.data[chunk].filled(fill_value=-BIGNUM),
+                                  -BIGNUM)
+            # NB: In class Island(object), rms * analysis_threshold
+            # is taken as the threshold for the bottom of the island.
+            # Everything below that level is masked.
+            # For subislands, this product should be equal to level
+            # and flat, i.e., horizontal.
+            # We can achieve this by setting rms=level*ones and
+            # analysis_threshold=1.
+            subislands.append(Island(
+                newdata,
+                numpy.ones(newdata.shape) * level,
+                (
+                    slice(self.chunk[0].start + chunk[0].start,
+                          self.chunk[0].start + chunk[0].stop),
+                    slice(self.chunk[1].start + chunk[1].start,
+                          self.chunk[1].start + chunk[1].stop)
+                ),
+                1,
+                self.detection_map[chunk],
+                self.beam,
+                self.deblend_nthresh,
+                self.deblend_mincont,
+                self.structuring_element,
+                self.rms_orig[chunk],
+                self.flux_orig,
+                self.subthrrange
+            ))
+        return subislands
 
     def threshold(self):
         """Threshold"""
@@ -694,6 +646,26 @@ def source_profile_and_errors(data, threshold, noise,
         # moments can't handle fixed params
         raise ValueError("fit failed with given fixed parameters")
 
+    return profile_errors_and_residuals(param, data, threshold, noise, beam)
+
+
+def profile_errors_and_residuals(param, data, threshold, noise, beam):
+    """Complete a fitted ParamSet with flux, errorbars and goodness-of-fit
+
+    This is the final stage of source_profile_and_errors(), split off for
+    use by fitting methods which determine the source parameters
+    themselves.
+
+    Args:
+
+        param (ParamSet): peak, position and shape of the source, with the
+            moments and gaussian flags set according to how they were found.
+
+        data, threshold, noise, beam: as for source_profile_and_errors().
+
+    Returns:
+        tuple: as for source_profile_and_errors().
+    """
     beamsize = utils.calculate_beamsize(beam[0], beam[1])
     param["flux"] = (numpy.pi * param["peak"] * param["semimajor"] *
                      param["semiminor"] / beamsize)
@@ -722,6 +694,11 @@ class Detection(object):
     """The result of a measurement at a given position in a given image."""
 
     def __init__(self, paramset, imagedata, chunk=None, eps_ra=0, eps_dec=0):
+        self._set_parameters(paramset, imagedata, chunk, eps_ra, eps_dec)
+        self._physical_coordinates()
+
+    def _set_parameters(self, paramset, imagedata, chunk, eps_ra, eps_dec):
+        """Copy the pixel parameters of this object from paramset."""
 
         self.eps_ra = eps_ra
         self.eps_dec = eps_dec
@@ -750,13 +727,6 @@ class Detection(object):
 
         self.sig = paramset.sig
 
-        try:
-            self._physical_coordinates()
-        except RuntimeError:
-            logger.warn("Physical coordinates failed at %f, %f" % (
-                self.x, self.y))
-            raise
-
     def __getstate__(self):
         return {
             'imagedata': self.imagedata,
@@ -789,12 +759,7 @@ class Detection(object):
         self.error_radius = attrdict['error_radius']
         self.gaussian = attrdict['gaussian']
 
-        try:
-            self._physical_coordinates()
-        except RuntimeError, e:
-            logger.warn("Physical coordinates failed at %f, %f" % (
-                self.x, self.y))
-            raise
+        self._physical_coordinates()
 
     def __getattr__(self, attrname):
         # Backwards compatibility for "errquantity" attributes
@@ -814,171 +779,7 @@ class Detection(object):
     def _physical_coordinates(self):
         """Convert the pixel parameters for this object into something
         physical."""
-
-        # First, the RA & dec.
-        self.ra, self.dec = [Uncertain(x) for x in self.imagedata.wcs.p2s(
-            [self.x.value, self.y.value])]
-        if numpy.isnan(self.dec.value) or abs(self.dec) > 90.0:
-            raise ValueError("object falls outside the sky")
-
-        # First, determine local north.
-        help1 = numpy.cos(numpy.radians(self.ra.value))
-        help2 = numpy.sin(numpy.radians(self.ra.value))
-        help3 = numpy.cos(numpy.radians(self.dec.value))
-        help4 = numpy.sin(numpy.radians(self.dec.value))
-        center_position = numpy.array([help3*help1, help3*help2, help4])
-
-        # The length of this vector is chosen such that it touches
-        # the tangent plane at center position.
-        # The cross product of the local north vector and the local east
-        # vector will always be aligned with the center_position vector.
-        if center_position[2] != 0:
-            local_north_position = numpy.array([0., 0., 1./center_position[2]])
-        else:
-            # If we are right on the equator (ie dec=0) the division above
-            # will blow up: as a workaround, we use something Really Big
-            # instead.
-            local_north_position = numpy.array([0., 0., 99e99])
-        # Next, determine the orientation of the y-axis wrt local north
-        # by incrementing y by a small amount and converting that
-        # to celestial coordinates. That small increment is conveniently
-        # chosen to be an increment of 1 pixel.
-
-        endy_ra, endy_dec = self.imagedata.wcs.p2s(
-            [self.x.value, self.y.value+1.])
-        help5 = numpy.cos(numpy.radians(endy_ra))
-        help6 = numpy.sin(numpy.radians(endy_ra))
-        help7 = numpy.cos(numpy.radians(endy_dec))
-        help8 = numpy.sin(numpy.radians(endy_dec))
-        endy_position = numpy.array([help7*help5, help7*help6, help8])
-
-        # Extend the length of endy_position to make it touch the plane
-        # tangent at center_position.
-        endy_position /= numpy.dot(center_position, endy_position)
-
-        diff1 = endy_position-center_position
-        diff2 = local_north_position-center_position
-
-        cross_prod = numpy.cross(diff2, diff1)
-
-        length_cross_sq = numpy.dot(cross_prod, cross_prod)
-
-        normalization = numpy.dot(diff1, diff1) * numpy.dot(diff2, diff2)
-
-        # The length of the cross product equals the product of the lengths of
-        # the vectors times the sine of their angle.
-        # This is the angle between the y-axis and local north,
-        # measured eastwards.
-        # yoffset_angle = numpy.degrees(
-        #    numpy.arcsin(numpy.sqrt(length_cross_sq/normalization)))
-        # The formula above is commented out because the angle computed
-        # in this way will always be 0<=yoffset_angle<=90.
-        # We'll use the dotproduct instead.
-        yoffs_rad = (numpy.arccos(numpy.dot(diff1, diff2) /
-                                  numpy.sqrt(normalization)))
-
-        # The multiplication with -sign_cor makes sure that the angle
-        # is measured eastwards (increasing RA), not westwards.
-        sign_cor = (numpy.dot(cross_prod, center_position) /
-                    numpy.sqrt(length_cross_sq))
-        yoffs_rad *= -sign_cor
-        yoffset_angle = numpy.degrees(yoffs_rad)
-
-        # Now that we have the BPA, we can also compute the position errors
-        # properly, by projecting the errors in pixel coordinates (x and y)
-        # on local north and local east.
-        errorx_proj = numpy.sqrt(
-            (self.x.error*numpy.cos(yoffs_rad))**2 +
-            (self.y.error*numpy.sin(yoffs_rad))**2)
-        errory_proj = numpy.sqrt(
-            (self.x.error*numpy.sin(yoffs_rad))**2 +
-            (self.y.error*numpy.cos(yoffs_rad))**2)
-
-        # Now we have to sort out which combination of errorx_proj and
-        # errory_proj gives the largest errors in RA and Dec.
-        try:
-            end_ra1, end_dec1 = self.imagedata.wcs.p2s(
-                                       [self.x.value+errorx_proj, self.y.value])
-            end_ra2, end_dec2 = self.imagedata.wcs.p2s(
-                [self.x.value, self.y.value+errory_proj])
-            # Here we include the position calibration errors
-            self.ra.error = self.eps_ra + max(
-                numpy.fabs(self.ra.value - end_ra1),
-                numpy.fabs(self.ra.value - end_ra2))
-            self.dec.error = self.eps_dec + max(
-                numpy.fabs(self.dec.value - end_dec1),
-                numpy.fabs(self.dec.value - end_dec2))
-        except RuntimeError:
-            #We get a runtime error from wcs.p2s if the errors place the
-            #limits outside of the image.
-            #In which case we set the RA / DEC uncertainties to infinity
-            self.ra.error = float('inf')
-            self.dec.error = float('inf')
-
-        # Estimate an absolute angular error on our central position.
-        self.error_radius = utils.get_error_radius(
-            self.imagedata.wcs, self.x.value, self.x.error, self.y.value, self.y.error
-        )
-
-        # Now we can compute the BPA, east from local north.
-        # That these angles can simply be added is not completely trivial.
-        # First, the Gaussian in gaussian.py must be such that theta is
-        # measured from the positive y-axis in the direction of negative x.
-        # Secondly, x and y are defined such that the direction
-        # positive y-->negative x-->negative y-->positive x is the same
-        # direction (counterclockwise) as (local) north-->east-->south-->west.
-        # If these two conditions are matched, the formula below is valid.
-        # Of course, the formula is also valid if theta is measured
-        # from the positive y-axis towards positive x
-        # and both of these directions are equal (clockwise).
-        self.theta_celes = Uncertain(
-            (numpy.degrees(self.theta.value) + yoffset_angle) % 180,
-            numpy.degrees(self.theta.error))
-        self.theta_dc_celes = Uncertain(
-            (self.theta_dc.value + yoffset_angle) % 180,
-            numpy.degrees(self.theta_dc.error))
-
-        # Next, the axes.
-        # Note that the signs of numpy.sin and numpy.cos in the
-        # four expressions below are arbitrary.
-        self.end_smaj_x = (self.x.value - numpy.sin(self.theta.value) *
-                      self.smaj.value)
-        self.start_smaj_x = (self.x.value + numpy.sin(self.theta.value) *
-                      self.smaj.value)
-        self.end_smaj_y = (self.y.value + numpy.cos(self.theta.value) *
-                      self.smaj.value)
-        self.start_smaj_y = (self.y.value - numpy.cos(self.theta.value) *
-                      self.smaj.value)
-        self.end_smin_x = (self.x.value + numpy.cos(self.theta.value) *
-                      self.smin.value)
-        self.start_smin_x = (self.x.value - numpy.cos(self.theta.value) *
-                      self.smin.value)
-        self.end_smin_y = (self.y.value + numpy.sin(self.theta.value) *
-                      self.smin.value)
-        self.start_smin_y = (self.y.value - numpy.sin(self.theta.value) *
-                      self.smin.value)
-
-
-        def pixel_to_spatial(x, y):
-            try:
-                return self.imagedata.wcs.p2s([x, y])
-            except RuntimeError:
-                logger.debug("pixel_to_spatial failed at %f, %f" % (x, y))
-                return numpy.nan, numpy.nan
-        end_smaj_ra, end_smaj_dec = pixel_to_spatial(self.end_smaj_x, self.end_smaj_y)
-        end_smin_ra, end_smin_dec = pixel_to_spatial(self.end_smin_x, self.end_smin_y)
-
-        smaj_asec = coordinates.angsep(self.ra.value, self.dec.value,
-                                       end_smaj_ra, end_smaj_dec)
-        scaling_smaj = smaj_asec / self.smaj.value
-        errsmaj_asec = scaling_smaj * self.smaj.error
-        self.smaj_asec = Uncertain(smaj_asec, errsmaj_asec)
-
-        smin_asec = coordinates.angsep(self.ra.value, self.dec.value,
-                                       end_smin_ra, end_smin_dec)
-        scaling_smin = smin_asec / self.smin.value
-        errsmin_asec = scaling_smin * self.smin.error
-        self.smin_asec = Uncertain(smin_asec, errsmin_asec)
+        _physical_coordinates([self])
 
     def distance_from(self, x, y):
         """Distance from center"""
@@ -1012,3 +813,245 @@ class Detection(object):
             self.chisq,
             self.reduced_chisq
         ]
+
+
+def create_detections(paramsets, imagedata, chunks=None, eps_ra=0, eps_dec=0):
+    """Create a :class:`Detection` for each of a list of measurements.
+
+    This is equivalent to creating the detections one by one, but the
+    conversion to celestial coordinates is done for all of them at once.
+
+    Args:
+        paramsets (list): measurements, as :class:`ParamSet` instances.
+        imagedata (tkp.sourcefinder.image.ImageData): the image in which
+            all of the measurements were made.
+
+    Kwargs:
+        chunks (list): the chunk of the image for each of the measurements,
+            or None.
+        eps_ra, eps_dec: position calibration errors, as for
+            :class:`Detection`.
+
+    Returns:
+        list of :class:`Detection`, in the order of paramsets.
+    """
+    if chunks is None:
+        chunks = [None] * len(paramsets)
+    detections = []
+    for paramset, chunk in zip(paramsets, chunks):
+        detection = Detection.__new__(Detection)
+        detection._set_parameters(paramset, imagedata, chunk, eps_ra, eps_dec)
+        detections.append(detection)
+    _physical_coordinates(detections)
+    return detections
+
+
+def _angsep(ra1, dec1, ra2, dec2):
+    """As tkp.utility.coordinates.angsep(), but for arrays of positions."""
+    b = numpy.pi / 2 - numpy.radians(dec1)
+    c = numpy.pi / 2 - numpy.radians(dec2)
+    temp = (numpy.cos(b) * numpy.cos(c) +
+            numpy.sin(b) * numpy.sin(c) * numpy.cos(numpy.radians(ra1 - ra2)))
+    # Truncate at +- 1, which may be exceeded due to rounding errors. NaN
+    # positions give NaN separations.
+    with numpy.errstate(invalid='ignore'):
+        temp = numpy.where(abs(temp) > 1.0, numpy.sign(temp), temp)
+    return 3600 * numpy.degrees(numpy.arccos(temp))
+
+
+def _physical_coordinates(detections):
+    """Convert the pixel parameters of detections into something physical.
+
+    All detections must have been made in the same image. The pixel
+    positions they need are converted to celestial coordinates in two calls
+    to the WCS, rather than in a dozen calls for every detection.
+    """
+    if not detections:
+        return
+    wcs = detections[0].imagedata.wcs
+    x = numpy.array([det.x.value for det in detections], dtype=numpy.float64)
+    y = numpy.array([det.y.value for det in detections], dtype=numpy.float64)
+    x_error = numpy.array([det.x.error for det in detections], dtype=numpy.float64)
+    y_error = numpy.array([det.y.error for det in detections], dtype=numpy.float64)
+    theta = numpy.array([det.theta.value for det in detections], dtype=numpy.float64)
+    smaj = numpy.array([det.smaj.value for det in detections], dtype=numpy.float64)
+    smin = numpy.array([det.smin.value for det in detections], dtype=numpy.float64)
+
+    # The axes.
+    # Note that the signs of numpy.sin and numpy.cos in the
+    # four expressions below are arbitrary.
+    end_smaj_x = x - numpy.sin(theta) * smaj
+    start_smaj_x = x + numpy.sin(theta) * smaj
+    end_smaj_y = y + numpy.cos(theta) * smaj
+    start_smaj_y = y - numpy.cos(theta) * smaj
+    end_smin_x = x + numpy.cos(theta) * smin
+    start_smin_x = x - numpy.cos(theta) * smin
+    end_smin_y = y + numpy.sin(theta) * smin
+    start_smin_y = y - numpy.sin(theta) * smin
+
+    # In one go, convert the centre, a point one pixel further along the
+    # y-axis (see below), the corners of the error box and the ends of the
+    # axes. Positions which cannot be converted come out as NaN.
+    ra, dec = wcs.p2s_many(numpy.column_stack((
+        numpy.concatenate((x, x, x + x_error, x - x_error, x + x_error,
+                           x - x_error, end_smaj_x, end_smin_x)),
+        numpy.concatenate((y, y + 1., y + y_error, y + y_error, y - y_error,
+                           y - y_error, end_smaj_y, end_smin_y)))))
+    ra = ra.reshape(8, len(detections))
+    dec = dec.reshape(8, len(detections))
+    centre_ra, centre_dec = ra[0], dec[0]
+    endy_ra, endy_dec = ra[1], dec[1]
+
+    unphysical = numpy.isnan(centre_ra) | numpy.isnan(endy_ra)
+    if unphysical.any():
+        index = unphysical.nonzero()[0][0]
+        logger.warn("Physical coordinates failed at %f, %f" % (
+            x[index], y[index]))
+        raise RuntimeError("Spatial position is not a number")
+    if (abs(centre_dec) > 90.0).any():
+        raise ValueError("object falls outside the sky")
+
+    # First, determine local north.
+    help1 = numpy.cos(numpy.radians(centre_ra))
+    help2 = numpy.sin(numpy.radians(centre_ra))
+    help3 = numpy.cos(numpy.radians(centre_dec))
+    help4 = numpy.sin(numpy.radians(centre_dec))
+    center_position = numpy.array([help3*help1, help3*help2, help4])
+
+    # The length of this vector is chosen such that it touches
+    # the tangent plane at center position.
+    # The cross product of the local north vector and the local east
+    # vector will always be aligned with the center_position vector.
+    # If we are right on the equator (ie dec=0) the division
+    # would blow up: as a workaround, we use something Really Big
+    # instead.
+    local_north_position = numpy.zeros_like(center_position)
+    on_equator = center_position[2] == 0
+    local_north_position[2] = 99e99
+    local_north_position[2, ~on_equator] = 1. / center_position[2, ~on_equator]
+
+    # Next, determine the orientation of the y-axis wrt local north
+    # by incrementing y by a small amount and converting that
+    # to celestial coordinates. That small increment is conveniently
+    # chosen to be an increment of 1 pixel.
+    help5 = numpy.cos(numpy.radians(endy_ra))
+    help6 = numpy.sin(numpy.radians(endy_ra))
+    help7 = numpy.cos(numpy.radians(endy_dec))
+    help8 = numpy.sin(numpy.radians(endy_dec))
+    endy_position = numpy.array([help7*help5, help7*help6, help8])
+
+    # Extend the length of endy_position to make it touch the plane
+    # tangent at center_position.
+    endy_position /= (center_position * endy_position).sum(axis=0)
+
+    diff1 = endy_position - center_position
+    diff2 = local_north_position - center_position
+
+    cross_prod = numpy.cross(diff2, diff1, axis=0)
+
+    length_cross_sq = (cross_prod * cross_prod).sum(axis=0)
+
+    normalization = (diff1 * diff1).sum(axis=0) * (diff2 * diff2).sum(axis=0)
+
+    # The length of the cross product equals the product of the lengths of
+    # the vectors times the sine of their angle, but an angle computed
+    # from it would always be 0<=yoffset_angle<=90. We use the dot product
+    # instead to get the angle between the y-axis and local north,
+    # measured eastwards.
+    yoffs_rad = numpy.arccos((diff1 * diff2).sum(axis=0) /
+                             numpy.sqrt(normalization))
+
+    # The multiplication with -sign_cor makes sure that the angle
+    # is measured eastwards (increasing RA), not westwards.
+    sign_cor = ((cross_prod * center_position).sum(axis=0) /
+                numpy.sqrt(length_cross_sq))
+    yoffs_rad *= -sign_cor
+    yoffset_angle = numpy.degrees(yoffs_rad)
+
+    # Now that we have the BPA, we can also compute the position errors
+    # properly, by projecting the errors in pixel coordinates (x and y)
+    # on local north and local east.
+    errorx_proj = numpy.sqrt(
+        (x_error*numpy.cos(yoffs_rad))**2 +
+        (y_error*numpy.sin(yoffs_rad))**2)
+    errory_proj = numpy.sqrt(
+        (x_error*numpy.sin(yoffs_rad))**2 +
+        (y_error*numpy.cos(yoffs_rad))**2)
+
+    # Now we have to sort out which combination of errorx_proj and
+    # errory_proj gives the largest errors in RA and Dec.
+    end_ra, end_dec = wcs.p2s_many(numpy.column_stack((
+        numpy.concatenate((x + errorx_proj, x)),
+        numpy.concatenate((y, y + errory_proj)))))
+    end_ra = end_ra.reshape(2, len(detections))
+    end_dec = end_dec.reshape(2, len(detections))
+    # If the errors place the limits outside of the image, we set the
+    # RA / DEC uncertainties to infinity.
+    errors_outside = numpy.isnan(end_ra).any(axis=0)
+    ra_error = numpy.maximum(numpy.fabs(centre_ra - end_ra[0]),
+                             numpy.fabs(centre_ra - end_ra[1]))
+    dec_error = numpy.maximum(numpy.fabs(centre_dec - end_dec[0]),
+                              numpy.fabs(centre_dec - end_dec[1]))
+
+    # Estimate an absolute angular error on our central position, as in
+    # utils.get_error_radius(): the largest separation between the centre
+    # and any corner of the error box, or infinity if part of the box does
+    # not map to the sky.
+    corners_outside = numpy.isnan(ra[2:6]).any(axis=0)
+    error_radius = numpy.zeros(len(detections))
+    for corner in range(2, 6):
+        error_radius = numpy.maximum(
+            error_radius,
+            _angsep(centre_ra, centre_dec, ra[corner], dec[corner]))
+
+    # End points of the axes which do not map to the sky give NaN sizes.
+    smaj_asec = _angsep(centre_ra, centre_dec, ra[6], dec[6])
+    smin_asec = _angsep(centre_ra, centre_dec, ra[7], dec[7])
+
+    for i, det in enumerate(detections):
+        det.ra = Uncertain(centre_ra[i])
+        det.dec = Uncertain(centre_dec[i])
+        if errors_outside[i]:
+            det.ra.error = float('inf')
+            det.dec.error = float('inf')
+        else:
+            # Here we include the position calibration errors
+            det.ra.error = det.eps_ra + ra_error[i]
+            det.dec.error = det.eps_dec + dec_error[i]
+
+        if corners_outside[i]:
+            det.error_radius = float('inf')
+        else:
+            det.error_radius = float(error_radius[i])
+
+        # Now we can compute the BPA, east from local north.
+        # That these angles can simply be added is not completely trivial.
+        # First, the Gaussian in gaussian.py must be such that theta is
+        # measured from the positive y-axis in the direction of negative x.
+        # Secondly, x and y are defined such that the direction
+        # positive y-->negative x-->negative y-->positive x is the same
+        # direction (counterclockwise) as (local) north-->east-->south-->west.
+        # If these two conditions are matched, the formula below is valid.
+        # Of course, the formula is also valid if theta is measured
+        # from the positive y-axis towards positive x
+        # and both of these directions are equal (clockwise).
+        det.theta_celes = Uncertain(
+            (numpy.degrees(det.theta.value) + yoffset_angle[i]) % 180,
+            numpy.degrees(det.theta.error))
+        det.theta_dc_celes = Uncertain(
+            (det.theta_dc.value + yoffset_angle[i]) % 180,
+            numpy.degrees(det.theta_dc.error))
+
+        det.end_smaj_x = end_smaj_x[i]
+        det.start_smaj_x = start_smaj_x[i]
+        det.end_smaj_y = end_smaj_y[i]
+        det.start_smaj_y = start_smaj_y[i]
+        det.end_smin_x = end_smin_x[i]
+        det.start_smin_x = start_smin_x[i]
+        det.end_smin_y = end_smin_y[i]
+        det.start_smin_y = start_smin_y[i]
+
+        det.smaj_asec = Uncertain(
+            smaj_asec[i], smaj_asec[i] / det.smaj.value * det.smaj.error)
+        det.smin_asec = Uncertain(
+            smin_asec[i], smin_asec[i] / det.smin.value * det.smin.error)
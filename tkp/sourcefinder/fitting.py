@@ -5,7 +5,7 @@ Source fitting routines.
 import math
 import numpy
 import scipy.optimize
-from .gaussian import gaussian
+from .gaussian import gaussian, jacobian
 from .stats import indep_pixels
 import utils
 
@@ -150,44 +150,65 @@ def fitgaussian(pixels, params, fixed=None, maxfev=0):
             else:
                 initial.append(params[param])
 
-    def residuals(paramlist):
-        """Error function to be used in chi-squared fitting
+    # The fit only takes account of the unmasked pixels (the masked ones are
+    # below threshold, at the edges and corners of the (rectangular) pixel
+    # array). Their coordinates and values are collected once, and the model
+    # is evaluated only there.
+    unmasked = ~numpy.ma.getmaskarray(pixels)
+    x, y = numpy.indices(pixels.shape)
+    x, y = x[unmasked], y[unmasked]
+    values = numpy.ma.getdata(pixels)[unmasked]
+    free = [i for i, param in enumerate(FIT_PARAMS) if param not in fixed]
+
+    def gaussian_args(paramlist):
+        """Merge the fitting parameters with the fixed ones.
 
         :argument paramlist: fitting parameters
         :type paramlist: numpy.ndarray
-        :argument fixed: parameters to be held frozen
-        :type fixed: dict
 
-        :returns: 2d-array of difference between estimated Gaussian function
-            and the actual pixels
+        :returns: list of arguments to gaussian(), in the order of FIT_PARAMS
         """
-        paramlist = list(paramlist)
-        gaussian_args = []
+        paramlist = list(numpy.atleast_1d(paramlist))
+        args = []
         for param in FIT_PARAMS:
             if param in fixed:
-                gaussian_args.append(fixed[param])
+                args.append(fixed[param])
             else:
-                gaussian_args.append(paramlist.pop(0))
+                args.append(paramlist.pop(0))
+        return args
 
+    def residuals(paramlist):
+        """Error function to be used in chi-squared fitting
+
+        :argument paramlist: fitting parameters
+        :type paramlist: numpy.ndarray
+
+        :returns: 1d-array of difference between estimated Gaussian function
+            and the actual (unmasked) pixels
+        """
         # gaussian() returns a function which takes arguments x, y and returns
         # a Gaussian with parameters gaussian_args evaluated at that point.
-        g = gaussian(*gaussian_args)
-
-        # The .compressed() below is essential so the Gaussian fit will not
-        # take account of the masked values (=below threshold) at the edges
-        # and corners of pixels (=(masked) array, so rectangular in shape).
-        pixel_resids = numpy.ma.MaskedArray(
-            data = numpy.fromfunction(g, pixels.shape) - pixels,
-            mask = pixels.mask)
-        return pixel_resids.compressed()
-
-    # maxfev=0, the default, corresponds to 200*(N+1) (NB, not 100*(N+1) as
-    # the scipy docs state!) function evaluations, where N is the number of
-    # parameters in the solution.
+        return gaussian(*gaussian_args(paramlist))(x, y) - values
+
+    def residuals_jacobian(paramlist):
+        """Derivatives of residuals() to the fitting parameters
+
+        :argument paramlist: fitting parameters
+        :type paramlist: numpy.ndarray
+
+        :returns: 2d-array with one row per fitting parameter
+        """
+        derivatives = jacobian(*gaussian_args(paramlist))(x, y)
+        return numpy.array([derivatives[i] for i in free])
+
+    # maxfev=0, the default, corresponds to 100*(N+1) function evaluations
+    # when the Jacobian is supplied, N being the number of parameters in the
+    # solution.
     # Convergence tolerances xtol and ftol established by experiment on images
     # from Paul Hancock's simulations.
     soln, success = scipy.optimize.leastsq(
-        residuals, initial, maxfev=maxfev, xtol=1e-4, ftol=1e-4
+        residuals, initial, Dfun=residuals_jacobian, col_deriv=1,
+        maxfev=maxfev, xtol=1e-4, ftol=1e-4
     )
 
     if success > 4:
@@ -221,6 +242,33 @@ def fitgaussian(pixels, params, fixed=None, maxfev=0):
 
     return results
 
+def fit_amplitudes(pixels, model):
+    """Fit the amplitude of a fixed model to a stack of pixel boxes
+
+    When all but the peak of a Gaussian are held fixed, fitting is a linear
+    least squares problem, which we solve in closed form for every box at
+    once.
+
+    Args:
+        pixels (numpy.ma.MaskedArray): pixel values, with the boxes along
+            the first axis (ie, of shape (nboxes, nx, ny)). Masked pixels
+            are not used.
+
+        model (numpy.ndarray): the model with unit amplitude, of shape
+            (nx, ny).
+
+    Returns:
+        numpy.ndarray: best fitting amplitude for each box; NaN for boxes
+            without any unmasked pixels.
+    """
+    weights = ~numpy.ma.getmaskarray(pixels)
+    values = numpy.where(weights, numpy.ma.getdata(pixels), 0.)
+    numerator = (values * model).sum(axis=2).sum(axis=1)
+    denominator = (weights * model**2).sum(axis=2).sum(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numerator / denominator
+
+
 def goodness_of_fit(masked_residuals, noise, beam):
     """
     Calculates the goodness-of-fit values, `chisq` and `reduced_chisq`.
@@ -34,3 +34,36 @@ def gaussian(height, center_x, center_y, semimajor, semiminor, theta):
                           ((cos(theta) * (y - center_y) -
                             sin(theta) * (x - center_x)) /
                            semimajor)**2.))
+
+
+def jacobian(height, center_x, center_y, semimajor, semiminor, theta):
+    """Return the partial derivatives of a 2D Gaussian to its parameters.
+
+    Args:
+        As for gaussian().
+
+    Returns:
+        lambda: function of pixel coords ``(x,y)`` returning a list of the
+        derivatives of gaussian() to height, center_x, center_y, semimajor,
+        semiminor and theta, in that order, evaluated at those coords.
+    """
+    def derivatives(x, y):
+        cos_theta, sin_theta = cos(theta), sin(theta)
+        dx, dy = x - center_x, y - center_y
+        # Coordinates along the minor (u) and major (v) axes.
+        u = cos_theta * dx + sin_theta * dy
+        v = cos_theta * dy - sin_theta * dx
+        u_scaled = u / semiminor**2
+        v_scaled = v / semimajor**2
+        shape = exp(-log(2.0) * ((u / semiminor)**2.0 + (v / semimajor)**2.))
+        # Common factor of all derivatives but the one to height.
+        g = 2.0 * log(2.0) * height * shape
+        return [
+            shape,
+            g * (u_scaled * cos_theta - v_scaled * sin_theta),
+            g * (u_scaled * sin_theta + v_scaled * cos_theta),
+            g * v * v_scaled / semimajor,
+            g * u * u_scaled / semiminor,
+            g * u * v * (1.0 / semimajor**2 - 1.0 / semiminor**2)
+        ]
+    return derivatives
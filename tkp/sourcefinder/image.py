@@ -3,14 +3,19 @@ Some generic utility routines for number handling and
 calculating (specific) variances
 """
 
+import atexit
 import logging
 import itertools
+import multiprocessing
+import os
 import numpy
 from tkp.utility import containers
 from tkp.utility.memoize import Memoize
 from tkp.sourcefinder import utils
 from tkp.sourcefinder import stats
 from tkp.sourcefinder import extract
+from tkp.sourcefinder import fitting
+from tkp.sourcefinder.gaussian import gaussian
 try:
     import ndimage
 except ImportError:
@@ -31,6 +36,82 @@ MF_THRESHOLD = 0        # If MEDIAN_FILTER is non-zero, only use the filtered
                         # and filtered grids is larger than MF_THRESHOLD.
 DEBLEND_MINCONT = 0.005 # Min. fraction of island flux in deblended subisland
 STRUCTURING_ELEMENT = [[0,1,0], [1,1,1], [0,1,0]] # Island connectiivty
+BATCHED_GRIDS = True    # Clip all background cells simultaneously rather
+                        # than looping over them; see _batched_grids().
+INTERPOLATE_BLOCK = 2**20 # Number of pixels interpolated at a time.
+
+def _grid_coordinates(npix, ratio):
+    """Grid coordinates of npix pixels along an axis spanning ratio cells.
+
+    These are the coordinates numpy.mgrid[-0.5:-0.5 + ratio:npix * 1j]
+    would give.
+    """
+    start, stop = -0.5, -0.5 + ratio
+    if npix == 1:
+        return numpy.array([start])
+    return numpy.arange(npix, dtype=numpy.float) * (
+        (stop - start) / float(npix - 1)) + start
+
+def _linear_weights(coordinates, size):
+    """Linear interpolation along an axis of size grid points.
+
+    Returns the lower and upper grid points around each of the coordinates,
+    and the weight of the upper one. Coordinates beyond the grid take the
+    value of the nearest grid point, as in ndimage.map_coordinates() with
+    mode='nearest'.
+    """
+    coordinates = numpy.clip(coordinates, 0, size - 1)
+    lower = numpy.floor(coordinates).astype(numpy.int)
+    upper = numpy.minimum(lower + 1, size - 1)
+    return lower, upper, coordinates - lower
+
+def _deblend_and_fit(task):
+    """Deblend an island, if required, and fit each of its parts.
+
+    Takes a tuple (island, deblend, fixed) so that it can be used with
+    Pool.map(). Returns a list of (island, fit results) tuples, where the
+    fit results are as returned by Island.fit().
+    """
+    island, deblend, fixed = task
+    if deblend:
+        islands = utils.flatten([island.deblend()])
+    else:
+        islands = [island]
+    return [(part, part.fit(fixed=fixed)) for part in islands]
+
+# Process pools for deblending and fitting islands, keyed on the process
+# which created them and their number of workers; see _fitting_pool().
+_fitting_pools = {}
+
+def _fitting_pool(workers):
+    """The pool of workers processes (one per CPU if 0) used to deblend and
+    fit islands.
+
+    It is created the first time it is needed and used again for later
+    images, rather than forking new workers for every image. A process keeps
+    a single pool: one of another size is closed first. A pool is only used
+    by the process which created it.
+    """
+    key = (os.getpid(), workers)
+    if key not in _fitting_pools:
+        close_fitting_pools()
+        _fitting_pools[key] = multiprocessing.Pool(workers or None)
+    return _fitting_pools[key]
+
+def close_fitting_pools():
+    """Close the pools used to deblend and fit islands which were created by
+    this process, and wait for their workers to exit.
+
+    This is done when the process exits, but may be done earlier to free the
+    workers; a new pool is created when one is needed again.
+    """
+    pid = os.getpid()
+    for key in [key for key in _fitting_pools if key[0] == pid]:
+        pool = _fitting_pools.pop(key)
+        pool.close()
+        pool.join()
+
+atexit.register(close_fitting_pools)
 
 class ImageData(object):
     """Encapsulates an image in terms of a numpy array + meta/headerdata.
@@ -40,7 +121,8 @@ class ImageData(object):
     """
 
     def __init__(self, data, beam, wcs, margin=0, radius=0, back_size_x=32,
-                 back_size_y=32, residuals=True
+                 back_size_y=32, residuals=True, dtype=numpy.float64,
+                 map_cache=None
     ):
         """Sets up an ImageData object.
 
@@ -51,13 +133,22 @@ class ImageData(object):
           - beam (3-tuple): beam shape specification as
             (semimajor, semiminor, theta)
 
+        *Kwargs:*
+          - dtype (numpy.dtype): floating point type of the image and of
+            all maps of its size. numpy.float32 halves the memory used;
+            the islands are still measured in double precision.
+          - map_cache (mapcache.CachedImageMaps): on-disk cache of the
+            background and RMS maps of this image, which is consulted
+            before they are calculated.
+
         """
 
         # Do data, wcs and beam need deepcopy?
         # Probably not (memory overhead, in particular for data),
         # but then the user shouldn't change them outside ImageData in the
-        # mean time
-        self.rawdata = data   # a 2D numpy array
+        # mean time. Data of the requested type is not copied.
+        self.dtype = numpy.dtype(dtype)
+        self.rawdata = numpy.asanyarray(data, dtype=self.dtype)   # a 2D numpy array
         self.wcs = wcs   # a utility.coordinates.wcs instance
         self.beam = beam   # tuple of (semimaj, semimin, theta)
         self.clip = {}
@@ -70,6 +161,7 @@ class ImageData(object):
         self.margin = margin
         self.radius = radius
         self.residuals = residuals
+        self.map_cache = map_cache
 
 
     ###########################################################################
@@ -96,7 +188,8 @@ class ImageData(object):
     def _backmap(self):
         """Background map"""
         if not hasattr(self, "_user_backmap"):
-            return self._interpolate(self.grids['bg'])
+            return self._cached_map(
+                'bg', lambda: self._interpolate(self.grids['bg']))
         else:
             return self._user_backmap
 
@@ -111,7 +204,9 @@ class ImageData(object):
     def _get_rm(self):
         """RMS map"""
         if not hasattr(self, "_user_noisemap"):
-            return self._interpolate(self.grids['rms'], roundup=True)
+            return self._cached_map(
+                'rms', lambda: self._interpolate(self.grids['rms'],
+                                                 roundup=True))
         else:
             return self._user_noisemap
 
@@ -131,16 +226,16 @@ class ImageData(object):
         # * A margin from the edge of the image;
         # * Any data outside a given radius from the centre of the image;
         # * Data which is "obviously" bad (equal to 0 or NaN).
-        mask = numpy.zeros((self.xdim, self.ydim))
+        mask = numpy.zeros((self.xdim, self.ydim), dtype=numpy.bool)
         if self.margin:
-            margin_mask = numpy.ones((self.xdim, self.ydim))
+            margin_mask = numpy.ones((self.xdim, self.ydim), dtype=numpy.bool)
             margin_mask[self.margin:-self.margin, self.margin:-self.margin] = 0
-            mask = numpy.logical_or(mask, margin_mask)
+            mask |= margin_mask
         if self.radius:
             radius_mask = utils.circular_mask(self.xdim, self.ydim, self.radius)
-            mask = numpy.logical_or(mask, radius_mask)
-        mask = numpy.logical_or(mask, numpy.where(self.rawdata == 0, 1, 0))
-        mask = numpy.logical_or(mask, numpy.isnan(self.rawdata))
+            mask |= radius_mask
+        mask |= self.rawdata == 0
+        mask |= numpy.isnan(self.rawdata)
         return numpy.ma.array(self.rawdata, mask=mask)
     data = property(fget=_get_data, fdel=_get_data.delete)
 
@@ -202,6 +297,17 @@ class ImageData(object):
     ###########################################################################
 
     # Private "support" methods
+    def _cached_map(self, name, calculate):
+        """Returns the map called name from the map cache, if there is one
+        and it holds the map; otherwise, the map is calculated and stored."""
+        if self.map_cache is None:
+            return calculate()
+        cached = self.map_cache.load(name)
+        if cached is None:
+            cached = calculate()
+            self.map_cache.store(name, cached)
+        return cached
+
     def __grids(self):
         """Calculate background and RMS grids of this image.
 
@@ -217,6 +323,26 @@ class ImageData(object):
         useful_chunk = ndimage.find_objects(numpy.where(self.data.mask, 0, 1))
         assert(len(useful_chunk) == 1)
         useful_data = self.data[useful_chunk[0]]
+
+        if BATCHED_GRIDS:
+            rmsgrid, bggrid = self._batched_grids(useful_data)
+        else:
+            rmsgrid, bggrid = self._per_cell_grids(useful_data)
+
+        rmsgrid = numpy.ma.array(
+            rmsgrid, mask=numpy.where(numpy.array(rmsgrid) == False, 1, 0))
+        bggrid = numpy.ma.array(
+            bggrid, mask=numpy.where(numpy.array(bggrid) == False, 1, 0))
+
+        return {'rms': rmsgrid, 'bg': bggrid}
+
+    def _per_cell_grids(self, useful_data):
+        """Calculate background and RMS grids, clipping one cell at a time.
+
+        Returns nested lists of values, with False marking cells for which
+        no useful background could be determined. This is the reference
+        implementation for _batched_grids().
+        """
         my_xdim, my_ydim = useful_data.shape
 
         rmsgrid, bggrid = [], []
@@ -257,13 +383,52 @@ class ImageData(object):
 
             rmsgrid.append(rmsrow)
             bggrid.append(bgrow)
+        return rmsgrid, bggrid
 
-        rmsgrid = numpy.ma.array(
-            rmsgrid, mask=numpy.where(numpy.array(rmsgrid) == False, 1, 0))
-        bggrid = numpy.ma.array(
-            bggrid, mask=numpy.where(numpy.array(bggrid) == False, 1, 0))
+    def _batched_grids(self, useful_data):
+        """Calculate background and RMS grids, clipping all cells at once.
 
-        return {'rms': rmsgrid, 'bg': bggrid}
+        The data is padded with masked pixels to a whole number of cells and
+        reshaped so that every cell becomes one row of a 2D array, which is
+        clipped in a single call to stats.sigma_clip_cells(). The results
+        agree with _per_cell_grids() up to floating point rounding.
+
+        Returns 2D arrays of values, with zero marking cells for which no
+        useful background could be determined.
+        """
+        my_xdim, my_ydim = useful_data.shape
+        nx = -(-my_xdim // self.back_size_x)
+        ny = -(-my_ydim // self.back_size_y)
+
+        padded = numpy.ma.masked_all(
+            (nx * self.back_size_x, ny * self.back_size_y),
+            dtype=useful_data.dtype)
+        padded[:my_xdim, :my_ydim] = useful_data
+        cells = padded.reshape(
+            nx, self.back_size_x, ny, self.back_size_y
+        ).swapaxes(1, 2).reshape(nx * ny, self.back_size_x * self.back_size_y)
+
+        # Cells containing only zeros and masked pixels are skipped, as in
+        # _per_cell_grids().
+        has_data = (cells.filled(0) != 0).any(axis=1)
+        count, sigma, median, mean, num_clip_its = stats.sigma_clip_cells(
+            cells[has_data], self.beam)
+        logger.debug('clipped %d cells in at most %d iterations',
+                     len(count), num_clip_its.max() if len(count) else 0)
+
+        # See _per_cell_grids() for the choice of background estimator.
+        # Cells in which all surviving pixels are zero end up with zero
+        # sigma and background, and are therefore masked as well.
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            skewed = numpy.fabs(mean - median) / sigma >= 0.3
+        bg = numpy.where(skewed, median, 2.5 * median - 1.5 * mean)
+
+        usable = count > 0
+        rmsgrid = numpy.zeros(nx * ny)
+        bggrid = numpy.zeros(nx * ny)
+        rmsgrid[has_data] = numpy.where(usable, sigma, 0)
+        bggrid[has_data] = numpy.where(usable, bg, 0)
+        return rmsgrid.reshape(nx, ny), bggrid.reshape(nx, ny)
 
     def _interpolate(self, grid, roundup=False):
         """
@@ -289,9 +454,13 @@ class ImageData(object):
         """
         # there's no point in working with the whole of the data array if it's
         # masked.
-        useful_chunk = ndimage.find_objects(numpy.where(self.data.mask, 0, 1))
-        assert(len(useful_chunk) == 1)
-        my_xdim, my_ydim = self.data[useful_chunk[0]].shape
+        data_mask = numpy.ma.getmaskarray(self.data)
+        useful_rows = numpy.flatnonzero(~data_mask.all(axis=1))
+        useful_cols = numpy.flatnonzero(~data_mask.all(axis=0))
+        assert(len(useful_rows) > 0)
+        useful_chunk = (slice(useful_rows[0], useful_rows[-1] + 1),
+                        slice(useful_cols[0], useful_cols[-1] + 1))
+        my_xdim, my_ydim = self.data[useful_chunk].shape
 
         if MEDIAN_FILTER:
             f_grid = ndimage.median_filter(grid, MEDIAN_FILTER)
@@ -305,34 +474,64 @@ class ImageData(object):
         # Bicubic spline interpolation
         xratio = float(my_xdim)/self.back_size_x
         yratio = float(my_ydim)/self.back_size_y
-        # First arg: starting point. Second arg: ending point. Third arg:
-        # 1j * number of points. (Why is this complex? Sometimes, NumPy has an
-        # utterly baffling API...)
-        slicex = slice(-0.5, -0.5+xratio, 1j*my_xdim)
-        slicey = slice(-0.5, -0.5+yratio, 1j*my_ydim)
-        my_map = numpy.ma.MaskedArray(numpy.zeros(self.data.shape),
-                                      mask = self.data.mask)
-        my_map[useful_chunk[0]] = ndimage.map_coordinates(
-            grid, numpy.mgrid[slicex, slicey],
-            mode='nearest', order=INTERPOLATE_ORDER)
+        xcoords = _grid_coordinates(my_xdim, xratio)
+        ycoords = _grid_coordinates(my_ydim, yratio)
+        grid_data = numpy.ma.getdata(grid)
+
+        # The map is filled in blocks of rows, so that no temporary arrays
+        # the size of the image are needed. Linear interpolation weights
+        # are products of weights along either axis, which are calculated
+        # once. The four corners are summed in the same order as by
+        # ndimage.map_coordinates(), which gives identical results.
+        my_map = numpy.zeros(self.data.shape, dtype=self.dtype)
+        target = my_map[useful_chunk]
+        block = max(1, INTERPOLATE_BLOCK // my_ydim)
+        if INTERPOLATE_ORDER == 1:
+            x_lower, x_upper, x_weight = _linear_weights(xcoords,
+                                                         grid_data.shape[0])
+            y_lower, y_upper, y_weight = _linear_weights(ycoords,
+                                                         grid_data.shape[1])
+            x_weights = ((1 - x_weight)[:, numpy.newaxis],
+                         x_weight[:, numpy.newaxis])
+            y_weights = (1 - y_weight, y_weight)
+            for start in range(0, my_xdim, block):
+                rows = slice(start, start + block)
+                out = target[rows]
+                for x_index, x_weight in zip((x_lower, x_upper), x_weights):
+                    grid_rows = grid_data[x_index[rows]]
+                    for y_index, y_weight in zip((y_lower, y_upper),
+                                                 y_weights):
+                        corner = grid_rows[:, y_index]
+                        corner *= x_weight[rows]
+                        corner *= y_weight
+                        out += corner
+        else:
+            for start in range(0, my_xdim, block):
+                rows = slice(start, start + block)
+                ndimage.map_coordinates(
+                    grid_data,
+                    numpy.array(numpy.meshgrid(xcoords[rows], ycoords,
+                                               indexing='ij')),
+                    output=target[rows], mode='nearest',
+                    order=INTERPOLATE_ORDER)
+
+        # Only the bounding box of the unmasked data is used.
+        mask = numpy.ones(self.data.shape, dtype=numpy.bool)
+        mask[useful_chunk] = False
 
         # If the input grid was entirely masked, then the output map must
         # also be masked: there's no useful data here. We don't search for
         # sources on a masked background/RMS, so this data will be cleanly
         # skipped by the rest of the sourcefinder
         if numpy.ma.getmask(grid).all():
-            my_map.mask = True
+            mask.fill(True)
         elif roundup:
             # In some cases, the spline interpolation may produce values
             # lower than the minimum value in the map. If required, these
             # can be trimmed off. No point doing this if the map is already
             # fully masked, though.
-            my_map = numpy.ma.MaskedArray(
-                    data = numpy.where(
-                        my_map >= numpy.min(grid), my_map, numpy.min(grid)),
-                    mask = my_map.mask
-            )
-        return my_map
+            numpy.fmax(my_map, numpy.min(grid), out=my_map)
+        return numpy.ma.MaskedArray(my_map, mask=mask)
 
     ###########################################################################
     #                                                                         #
@@ -344,7 +543,7 @@ class ImageData(object):
     ###########################################################################
 
     def extract(self, det, anl, noisemap=None, bgmap=None, labelled_data=None,
-                labels=None, deblend_nthresh=0, force_beam=False):
+                labels=None, deblend_nthresh=0, force_beam=False, workers=1):
 
         """
         Kick off conventional (ie, RMS island finding) source extraction.
@@ -369,6 +568,10 @@ class ImageData(object):
             force_beam (bool): force all extractions to have major/minor axes
                 equal to the restoring beam
 
+            workers (int): number of processes used to deblend and fit the
+                islands. 1 (the default) does all the work in this process;
+                0 uses one process per CPU.
+
         Returns:
              :class:`tkp.utility.containers.ExtractionResults`
         """
@@ -398,7 +601,7 @@ class ImageData(object):
 
         return self._pyse(
             det * self.rmsmap, anl * self.rmsmap, deblend_nthresh, force_beam,
-            labelled_data=labelled_data, labels=labels
+            labelled_data=labelled_data, labels=labels, workers=workers
         )
 
     def reverse_se(self, det):
@@ -422,13 +625,15 @@ class ImageData(object):
         return results
 
     def fd_extract(self, alpha, anl=None, noisemap=None,
-                   bgmap=None, deblend_nthresh=0, force_beam=False
+                   bgmap=None, deblend_nthresh=0, force_beam=False, workers=1
     ):
         """False Detection Rate based source extraction.
         The FDR procedure guarantees that <FDR> < alpha.
 
         See `Hopkins et al., AJ, 123, 1086 (2002)
         <http://adsabs.harvard.edu/abs/2002AJ....123.1086H>`_.
+
+        The other arguments are as for extract().
         """
 
         # The correlation length in config.py is used not only for the
@@ -483,7 +688,7 @@ class ImageData(object):
         if not anl:
             anl = fdr_threshold
         return self._pyse(fdr_threshold * self.rmsmap, anl * self.rmsmap,
-                          deblend_nthresh, force_beam)
+                          deblend_nthresh, force_beam, workers=workers)
 
     def flux_at_pixel(self, x, y, numpix=1):
         """Return the background-subtracted flux at a certain position
@@ -545,11 +750,13 @@ class ImageData(object):
             if mylabel == 0:  # 'Background'
                 raise ValueError("Fit region is below specified threshold, fit aborted.")
             mask = numpy.where(labels[chunk] == mylabel, 0, 1)
-            fitme = numpy.ma.array(self.data_bgsubbed[chunk], mask=mask)
+            fitme = numpy.ma.array(self.data_bgsubbed[chunk], mask=mask,
+                                   dtype=numpy.float64)
             if len(fitme.compressed()) < 1:
                 raise IndexError("Fit region too close to edge or too small")
         else:
-            fitme = self.data_bgsubbed[chunk]
+            fitme = numpy.ma.asarray(self.data_bgsubbed[chunk],
+                                     dtype=numpy.float64)
             if fitme.size < 1:
                 raise IndexError("Fit region too close to edge or too small")
 
@@ -624,6 +831,10 @@ class ImageData(object):
         In particular, boxsize is in pixel coordinates as in
         fit_to_point, not in sky coordinates.
 
+        When fixed is ``position+shape`` and no threshold is given, only the
+        peak is fitted. That is a linear problem, which is solved for all
+        positions at once: see _fit_fixed_shapes().
+
         Returns:
             list: A list of successful fits.
                 If ``ids`` is None, returns a single list of
@@ -635,43 +846,139 @@ class ImageData(object):
         if ids is not None:
             assert len(ids)==len(positions)
 
+        pixel_positions = self._sky_to_pixels(positions)
+        if fixed == 'position+shape' and threshold is None:
+            fits = self._fit_fixed_shapes(positions, pixel_positions, boxsize)
+        else:
+            fits = []
+            for posn, pixpos in zip(positions, pixel_positions):
+                fit_results = None
+                if pixpos is not None:
+                    try:
+                        fit_results = self.fit_to_point(pixpos[0], pixpos[1],
+                                                        boxsize=boxsize,
+                                                        threshold=threshold,
+                                                        fixed=fixed)
+                    except IndexError as e:
+                        logger.warning("Input pixel coordinates (%.2f, %.2f) "
+                                       "could not be fit because: " + e.message,
+                                       posn[0], posn[1])
+                fits.append(fit_results)
+
         successful_fits = []
         successful_ids = []
-        for idx, posn in enumerate(positions):
-            try:
-                x, y, = self.wcs.s2p((posn[0], posn[1]))
-            except RuntimeError, e:
-                if (str(e).startswith("wcsp2s error: 8:") or
-                    str(e).startswith("wcsp2s error: 9:")):
-                    logger.warning("Input coordinates (%.2f, %.2f) invalid: ",
-                                    posn[0], posn[1])
-                else:
-                    raise
+        for idx, fit_results in enumerate(fits):
+            if not fit_results:
+                # We were unable to get a good fit
+                continue
+            if ( fit_results.ra.error == float('inf') or
+                  fit_results.dec.error == float('inf')):
+                logging.warning("position errors extend outside image")
             else:
-                try:
-                    fit_results = self.fit_to_point(x, y,
-                                                boxsize=boxsize,
-                                                threshold=threshold,
-                                                fixed=fixed)
-                    if not fit_results:
-                        # We were unable to get a good fit
-                        continue
-                    if ( fit_results.ra.error == float('inf') or
-                          fit_results.dec.error == float('inf')):
-                        logging.warning("position errors extend outside image")
-                    else:
-                        successful_fits.append(fit_results)
-                        if ids:
-                            successful_ids.append(ids[idx])
-
-                except IndexError as e:
-                    logger.warning("Input pixel coordinates (%.2f, %.2f) "
-                                    "could not be fit because: " + e.message,
-                                    posn[0], posn[1])
+                successful_fits.append(fit_results)
+                if ids:
+                    successful_ids.append(ids[idx])
         if ids:
             return successful_fits, successful_ids
         return successful_fits
 
+    def _sky_to_pixels(self, positions):
+        """Convert a list of (RA, Dec) positions to pixel coordinates.
+
+        All positions are converted in a single call to the WCS. Returns a
+        list with an (x, y) tuple for each position, or None for positions
+        which are invalid in this WCS.
+        """
+        x, y = self.wcs.s2p_many([(posn[0], posn[1]) for posn in positions])
+        pixel_positions = []
+        for posn, pixpos in zip(positions, zip(x, y)):
+            if numpy.isnan(pixpos[0]):
+                logger.warning("Input coordinates (%.2f, %.2f) invalid: ",
+                               posn[0], posn[1])
+                pixpos = None
+            pixel_positions.append(pixpos)
+        return pixel_positions
+
+    def _fit_fixed_shapes(self, positions, pixel_positions, boxsize):
+        """Fit the peaks of sources of fixed position and shape, in bulk.
+
+        For each of the pixel_positions this gives the same result as
+        fit_to_point() with no threshold and fixed set to ``position+shape``,
+        except that the peak is calculated exactly rather than by the
+        iterative fitter. Boxes of equal shape share the same model, so their
+        peaks are fitted together.
+
+        Returns a list with a
+        :class:`tkp.sourcefinder.extract.Detection` for each position, or
+        None where no fit could be made. The positions are only used for
+        logging.
+        """
+        # As in fitting.fitgaussian(), the semi-major axis is the longer one.
+        semimajor, semiminor, theta = self.beam
+        if semiminor > semimajor:
+            semimajor, semiminor = semiminor, semimajor
+            theta += numpy.pi/2
+        shape = (abs(semimajor), abs(semiminor), theta)
+        centre = boxsize/2.0
+
+        detections = [None] * len(pixel_positions)
+        boxes = {}
+        for idx, (posn, pixpos) in enumerate(zip(positions, pixel_positions)):
+            if pixpos is None:
+                continue
+            x, y = pixpos
+            try:
+                if numpy.ma.is_masked(self.rmsmap[x, y]):
+                    logger.error("Background is masked: cannot fit")
+                    continue
+                chunk = ImageData.box_slice_about_pixel(x, y, centre)
+                fitme = numpy.ma.asarray(self.data_bgsubbed[chunk],
+                                         dtype=numpy.float64)
+                if fitme.size < 1:
+                    raise IndexError("Fit region too close to edge or too small")
+            except IndexError as e:
+                logger.warning("Input pixel coordinates (%.2f, %.2f) "
+                               "could not be fit because: " + e.message,
+                               posn[0], posn[1])
+                continue
+            if not len(fitme.compressed()):
+                logger.error("All data is masked: cannot fit")
+                continue
+            # Gaussian fitting is only done if the data is more than 2 pixels
+            # across in both dimensions; see source_profile_and_errors().
+            xpix, ypix = fitme.nonzero()
+            if not len(xpix) or xpix.ptp() <= 2 or ypix.ptp() <= 2:
+                logger.error("Gaussian fit failed at %f, %f", x, y)
+                continue
+            boxes.setdefault(fitme.shape, []).append((idx, x, y, chunk, fitme))
+
+        measurements = []
+        for box_shape, members in boxes.iteritems():
+            model = gaussian(1.0, centre, centre, *shape)(
+                *numpy.indices(box_shape))
+            pixels = numpy.ma.MaskedArray(
+                data=[numpy.ma.getdata(member[4]) for member in members],
+                mask=[numpy.ma.getmaskarray(member[4]) for member in members])
+            peaks = fitting.fit_amplitudes(pixels, model)
+            for (idx, x, y, chunk, fitme), peak in zip(members, peaks):
+                param = extract.ParamSet()
+                param.update({'peak': peak, 'xbar': centre, 'ybar': centre,
+                              'semimajor': shape[0], 'semiminor': shape[1],
+                              'theta': shape[2]})
+                param.gaussian = True
+                measurement, residuals = extract.profile_errors_and_residuals(
+                    param, fitme, None, self.rmsmap[x, y], self.beam)
+                measurement['xbar'] += x-centre
+                measurement['ybar'] += y-centre
+                measurement.sig = (fitme / self.rmsmap[chunk]).max()
+                measurements.append((idx, measurement))
+        if measurements:
+            indices, params = zip(*measurements)
+            for idx, det in zip(indices,
+                                extract.create_detections(params, self)):
+                detections[idx] = det
+        return detections
+
     def label_islands(self, detectionthresholdmap, analysisthresholdmap):
         """
         Return a lablled array of pixels for fitting.
@@ -689,7 +996,8 @@ class ImageData(object):
             labelled islands (numpy.ndarray)
         """
         # If there is no usable data, we return an empty set of islands.
-        if not len(self.rmsmap.compressed()):
+        usable_rms = self.rmsmap.compressed()
+        if not len(usable_rms):
             logging.warning("RMS map masked; sourcefinding skipped")
             return [], numpy.zeros(self.data_bgsubbed.shape, dtype=numpy.int)
 
@@ -707,56 +1015,56 @@ class ImageData(object):
         # The third filter attempts to exclude those regions of the image
         # which contain no usable data; for example, the parts of the image
         # falling outside the circular region produced by awimager.
+        #
+        # All of this is done with boolean arrays, rather than with masked
+        # arrays of numbers, to limit the memory used for large images.
         RMS_FILTER = 0.001
-        clipped_data = numpy.ma.where(
-            (self.data_bgsubbed > analysisthresholdmap) &
-            (self.rmsmap >= (RMS_FILTER * numpy.ma.median(self.rmsmap))),
-            1, 0
-        ).filled(fill_value=0)
+        rms_floor = RMS_FILTER * numpy.median(usable_rms, overwrite_input=True)
+        del usable_rms
+        clipped_data = numpy.greater(numpy.ma.getdata(self.data_bgsubbed),
+                                     numpy.ma.getdata(analysisthresholdmap))
+        clipped_data &= numpy.ma.getdata(self.rmsmap) >= rms_floor
+        for masked in (self.data_bgsubbed, analysisthresholdmap, self.rmsmap):
+            if numpy.ma.getmask(masked) is not numpy.ma.nomask:
+                clipped_data &= ~numpy.ma.getmask(masked)
         labelled_data, num_labels = ndimage.label(clipped_data, STRUCTURING_ELEMENT)
+        del clipped_data
 
-        labels_below_det_thr, labels_above_det_thr = [], []
+        labels_above_det_thr = []
         if num_labels > 0:
             # Select the labels of the islands above the analysis threshold
             # that have maximum values values above the detection threshold.
-            # Like above we make sure not to select anything where either
-            # the data or the noise map are masked.
-            # We fill these pixels in above_det_thr with -1 to make sure
-            # its labels will not be in labels_above_det_thr.
-            # NB data_bgsubbed, and hence above_det_thr, is a masked array;
-            # filled() sets all mased values equal to -1.
+            # Only the pixels of the islands are considered, rather than
+            # whole images. Like above we make sure not to select anything
+            # where either the data or the noise map are masked: those
+            # pixels are set to -1, so that they are below the threshold.
+            pixels = numpy.flatnonzero(labelled_data)
+            pixel_labels = labelled_data.ravel()[pixels]
             above_det_thr = (
-                self.data_bgsubbed - detectionthresholdmap
-            ).filled(fill_value=-1)
+                numpy.ma.getdata(self.data_bgsubbed).ravel()[pixels] -
+                numpy.ma.getdata(detectionthresholdmap).ravel()[pixels])
+            for masked in (self.data_bgsubbed, detectionthresholdmap):
+                if numpy.ma.getmask(masked) is not numpy.ma.nomask:
+                    above_det_thr[numpy.ma.getmask(masked).ravel()[pixels]] = -1
             # Note that we avoid label 0 (the background).
-            maximum_values = ndimage.maximum(
-                above_det_thr, labelled_data, numpy.arange(1, num_labels + 1)
-            )
-
-            # If there's only one island, ndimage.maximum will return a float,
-            # rather than a list. The rest of this function assumes that it's
-            # always a list, so we need to convert it.
-            if isinstance(maximum_values, float):
-                maximum_values = [maximum_values]
-
-            # We'll filter out the insignificant islands
-            for i, x in enumerate(maximum_values, 1):
-                if x < 0:
-                    labels_below_det_thr.append(i)
-                else:
-                    labels_above_det_thr.append(i)
-            # Set to zero all labelled islands that are below det_thr:
-            labelled_data = numpy.where(
-                numpy.in1d(labelled_data.ravel(), labels_above_det_thr).reshape(labelled_data.shape),
-                labelled_data, 0
-            )
+            maximum_values = numpy.atleast_1d(ndimage.maximum(
+                above_det_thr, pixel_labels, numpy.arange(1, num_labels + 1)
+            ))
+
+            # We'll filter out the insignificant islands, and set the
+            # pixels of those below det_thr to zero.
+            significant = numpy.ones(num_labels + 1, dtype=numpy.bool)
+            significant[1:] = ~(maximum_values < 0)
+            labels_above_det_thr = numpy.flatnonzero(significant[1:]) + 1
+            labels_above_det_thr = labels_above_det_thr.tolist()
+            labelled_data.flat[pixels[~significant[pixel_labels]]] = 0
 
         return labels_above_det_thr, labelled_data
 
 
     def _pyse(
         self, detectionthresholdmap, analysisthresholdmap,
-        deblend_nthresh, force_beam, labelled_data=None, labels=[]
+        deblend_nthresh, force_beam, labelled_data=None, labels=[], workers=1
     ):
         """
         Run Python-based source extraction on this image.
@@ -780,6 +1088,9 @@ class ImageData(object):
             labels (list): list of labels in the island map to use for
             fitting.
 
+            workers (int): number of processes used for deblending and
+            fitting; see extract().
+
         Returns:
 
             (..utility.containers.ExtractionResults):
@@ -799,28 +1110,40 @@ class ImageData(object):
         # 'None' returned for missing label indices.
         slices = ndimage.find_objects(labelled_data)
 
+        # Everything below is done within the bounding box of each island.
+        # Masked pixels and undefined ratios are left out of the analysis
+        # threshold, as they would be by a masked array division.
+        data = numpy.ma.getdata(self.data_bgsubbed)
+        analysis_data = numpy.ma.getdata(analysisthresholdmap)
+        rms_data = numpy.ma.getdata(self.rmsmap)
+        unmasked = ~(numpy.ma.getmaskarray(analysisthresholdmap) |
+                     numpy.ma.getmaskarray(self.rmsmap))
         for label in labels:
             chunk = slices[label-1]
-            analysis_threshold = (analysisthresholdmap[chunk] /
-                                  self.rmsmap[chunk]).max()
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                ratio = analysis_data[chunk] / rms_data[chunk]
+            analysis_threshold = ratio[
+                unmasked[chunk] & numpy.isfinite(ratio)].max()
             # In selected_data only the pixels with the "correct"
             # (see above) labels are retained. Other pixel values are
             # set to -(bignum).
             # In this way, disconnected pixels within (rectangular)
             # slices around islands (particularly the large ones) do
             # not affect the source measurements.
-            selected_data = numpy.ma.where(
-                labelled_data[chunk] == label,
-                self.data_bgsubbed[chunk].data, -extract.BIGNUM
-            ).filled(fill_value=-extract.BIGNUM)
+            # Whatever the type of the image, islands are measured in
+            # double precision.
+            selected_data = numpy.where(
+                labelled_data[chunk] == label, data[chunk], -extract.BIGNUM
+            ).astype(numpy.float64)
 
             island_list.append(
                 extract.Island(
                     selected_data,
-                    self.rmsmap[chunk],
+                    numpy.ma.asarray(self.rmsmap[chunk], dtype=numpy.float64),
                     chunk,
                     analysis_threshold,
-                    detectionthresholdmap[chunk],
+                    numpy.ma.asarray(detectionthresholdmap[chunk],
+                                     dtype=numpy.float64),
                     self.beam,
                     deblend_nthresh,
                     DEBLEND_MINCONT,
@@ -831,51 +1154,62 @@ class ImageData(object):
         # If required, we can save the 'left overs' from the deblending and
         # fitting processes for later analysis. This needs setting up here:
         if self.residuals:
-            self.residuals_from_gauss_fitting = numpy.zeros(self.data.shape)
-            self.residuals_from_deblending = numpy.zeros(self.data.shape)
+            self.residuals_from_gauss_fitting = numpy.zeros(self.data.shape,
+                                                            dtype=self.dtype)
+            self.residuals_from_deblending = numpy.zeros(self.data.shape,
+                                                         dtype=self.dtype)
             for island in island_list:
                 self.residuals_from_deblending[island.chunk] += (
                     island.data.filled(fill_value=0.))
 
-        # Deblend each of the islands to its consituent parts, if necessary
-        if deblend_nthresh:
-            deblended_list = map(lambda x: x.deblend(), island_list)
-            #deblended_list = [x.deblend() for x in island_list]
-            island_list = list(utils.flatten(deblended_list))
+        # Deblend each of the islands to its consituent parts, if necessary,
+        # and measure the source in each part. The islands are independent,
+        # so this work may be spread over several processes; Pool.map()
+        # returns the results in the order of island_list, so they are the
+        # same as when done serially.
+        if force_beam:
+            fixed = {'semimajor': self.beam[0],
+                     'semiminor': self.beam[1],
+                     'theta': self.beam[2]}
+        else:
+            fixed = None
+        tasks = [(island, deblend_nthresh, fixed) for island in island_list]
+        if workers != 1 and multiprocessing.current_process().daemon:
+            # Daemonic processes, such as the workers of the multiproc
+            # distribution method, are not allowed to have children.
+            logger.warn("Running as daemon: ignoring workers=%s, fitting "
+                        "islands serially" % (workers,))
+            workers = 1
+        if workers != 1 and len(tasks) > 1:
+            fitted = _fitting_pool(workers).map(_deblend_and_fit, tasks)
+        else:
+            fitted = map(_deblend_and_fit, tasks)
 
-        # Iterate over the list of islands and measure the source in each,
-        # appending it to the results list.
+        # Append each successful measurement to the results list.
+        fits = [(island, fit_results)
+                for island, fit_results in itertools.chain.from_iterable(fitted)
+                if fit_results]
+        try:
+            detections = extract.create_detections(
+                [measurement for island, (measurement, residual) in fits],
+                self, chunks=[island.chunk for island, fit_results in fits])
+        except RuntimeError:
+            logger.warn("Island not processed; unphysical?")
+            raise
         results = containers.ExtractionResults()
-        for island in island_list:
-            if force_beam:
-                fixed = {'semimajor': self.beam[0],
-                         'semiminor': self.beam[1],
-                         'theta': self.beam[2]}
+        for det, (island, (measurement, residual)) in zip(detections, fits):
+            if (det.ra.error == float('inf') or
+                    det.dec.error == float('inf')):
+                logger.warn('Bad fit from blind extraction at pixel coords:'
+                              '%f %f - measurement discarded'
+                              '(increase fitting margin?)', det.x, det.y )
             else:
-                fixed = None
-            fit_results = island.fit(fixed=fixed)
-            if fit_results:
-                measurement, residual = fit_results
-            else:
-                # Failed to fit; drop this island and go to the next.
-                continue
-            try:
-                det = extract.Detection(measurement, self, chunk=island.chunk)
-                if (det.ra.error == float('inf') or
-                        det.dec.error == float('inf')):
-                    logger.warn('Bad fit from blind extraction at pixel coords:'
-                                  '%f %f - measurement discarded'
-                                  '(increase fitting margin?)', det.x, det.y )
-                else:
-                    results.append(det)
-
-                if self.residuals:
-                    self.residuals_from_deblending[island.chunk] -= (
-                        island.data.filled(fill_value=0.))
-                    self.residuals_from_gauss_fitting[island.chunk] += residual
-            except RuntimeError:
-                logger.warn("Island not processed; unphysical?")
-                raise
+                results.append(det)
+
+            if self.residuals:
+                self.residuals_from_deblending[island.chunk] -= (
+                    island.data.filled(fill_value=0.))
+                self.residuals_from_gauss_fitting[island.chunk] += residual
 
         def is_usable(det):
             # Check that both ends of each axis are usable; that is, that they
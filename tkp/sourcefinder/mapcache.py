@@ -0,0 +1,171 @@
+"""
+A node-local cache of the background and RMS maps of images on disk.
+
+The maps are stored as .npy files, which are memory-mapped when read back, so
+that a map is only read from disk where it is used. Every file is named after
+a key of the image and the parameters which determine its maps. The cache is
+bounded in size: when it grows beyond its limit, the least recently used
+files are removed.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import numpy
+
+
+logger = logging.getLogger(__name__)
+
+
+def _modification_time(path):
+    """
+    Returns the time at which the image at path was last changed.
+
+    An image which is a directory, such as a CASA image, is changed by
+    rewriting the table files in it, which leaves the modification time of
+    the directory itself alone. The latest modification time of its table
+    files is used instead. The lock file is left out: it is written whenever
+    the image is opened.
+    """
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    mtimes = [os.path.getmtime(path)]
+    for filename in os.listdir(path):
+        if filename.startswith('table.') and filename != 'table.lock':
+            mtimes.append(os.path.getmtime(os.path.join(path, filename)))
+    return max(mtimes)
+
+
+class MapCache(object):
+    """Cache of background and RMS maps in a directory.
+
+    The directory may be shared by several processes on a node. Files are
+    written under a temporary name and renamed when complete, so a process
+    never reads a partially written map.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Args:
+            directory (str): directory which holds the cached maps. It is
+                created if it does not exist.
+            max_bytes (int): the size the cache is trimmed to after a map
+                is stored.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process may have created it in the mean time.
+                if not os.path.isdir(directory):
+                    raise
+
+    def image(self, url, params):
+        """Returns the maps of an image in this cache, or None if the image
+        is not a local file or directory.
+
+        The key of the image includes its modification time, so that the
+        maps of an image which was changed are not used.
+
+        Args:
+            url (str): path of the image.
+            params (tuple): the parameters which determine the maps of the
+                image.
+        """
+        try:
+            mtime = _modification_time(url)
+        except OSError as e:
+            logger.warn("Not caching the maps of %s: %s" % (url, e))
+            return None
+        key = repr((os.path.abspath(url), mtime, tuple(params)))
+        return CachedImageMaps(self, hashlib.sha1(key).hexdigest())
+
+    def _path(self, key, name):
+        return os.path.join(self.directory, "%s-%s.npy" % (key, name))
+
+    def load(self, key, name):
+        """Returns the masked map called name of the image with key, or None
+        if it is not in the cache."""
+        data_path = self._path(key, name)
+        mask_path = self._path(key, name + "-mask")
+        try:
+            data = numpy.load(data_path, mmap_mode='r')
+            mask = numpy.load(mask_path)
+        except (IOError, ValueError):
+            self.misses += 1
+            logger.debug("map cache miss: %s %s", key, name)
+            return None
+        # The modification time marks when a file was last used, for the
+        # eviction of the least recently used maps.
+        for path in data_path, mask_path:
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        self.hits += 1
+        logger.debug("map cache hit: %s %s", key, name)
+        return numpy.ma.MaskedArray(data, mask=mask)
+
+    def store(self, key, name, masked_map):
+        """Stores the masked map called name of the image with key."""
+        self._write(self._path(key, name + "-mask"),
+                    numpy.ma.getmaskarray(masked_map))
+        self._write(self._path(key, name), numpy.ma.getdata(masked_map))
+        self.evict()
+
+    def _write(self, path, array):
+        handle, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             suffix=".tmp")
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                numpy.save(f, array)
+            os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def evict(self):
+        """Removes the least recently used maps until the cache is no larger
+        than max_bytes."""
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".npy"):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def log_counts(self):
+        logger.info("map cache %s: %s hits, %s misses" %
+                    (self.directory, self.hits, self.misses))
+
+
+class CachedImageMaps(object):
+    """The maps of a single image in a MapCache."""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+
+    def load(self, name):
+        return self.cache.load(self.key, name)
+
+    def store(self, name, masked_map):
+        self.cache.store(self.key, name, masked_map)
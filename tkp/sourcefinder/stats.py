@@ -55,9 +55,36 @@ def unbiased_sigma(N_indep):
     return 1.4142135623730951 * erfcinv(0.5 / N_indep)
 
 
+if hasattr(numpy.ndarray, 'partition'):
+    def _partition(work, kth):
+        work.partition(kth)
+else:
+    # ndarray.partition() is new in numpy 1.8; a full sort in place puts
+    # the kth elements where they belong just as well, only slower.
+    def _partition(work, kth):
+        work.sort()
+
+
+def _median(data, scratch):
+    """Median of data, using scratch (at least as long as data) as work space.
+
+    numpy.median() partitions a fresh copy of its input on every call; here
+    the copy goes into a preallocated buffer instead. The result is the same.
+    """
+    n = len(data)
+    work = scratch[:n]
+    work[:] = data
+    half = n // 2
+    if n % 2:
+        _partition(work, half)
+        return work[half]
+    _partition(work, [half - 1, half])
+    return work.dtype.type((work[half - 1] + work[half]) / 2.)
+
+
 def sigma_clip(data, beam, sigma=unbiased_sigma, max_iter=100,
                centref=numpy.median, distf=numpy.var, my_iterations=0,
-               corr_clip=1.):
+               corr_clip=1., full_output=False):
     """Iterative clipping
 
     By default, this performs clipping of the standard deviation about the
@@ -66,62 +93,269 @@ def sigma_clip(data, beam, sigma=unbiased_sigma, max_iter=100,
 
     max_iter sets the maximum number of iterations used.
 
-    my_iterations is a counter for recursive operation of the code; leave it
+    my_iterations is the initial value of the iteration counter; leave it
     alone unless you really want to pretend to jump into the middle of a loop.
+    corr_clip is the corresponding correction factor for the variance.
 
     sigma is subtle: if a callable is given, it is passed a copy of the data
     array and can calculate a clipping limit. See, for e.g., unbiased_sigma()
     defined above. However, if it isn't callable, sigma is assumed to just set
     a hard limit.
 
-    To do: Improve documentation
-            -Returns???
-            -How does it make use of the beam? (It estimates the noise correlation)
-    """
-    if my_iterations >= max_iter:
-        # Exceeded maximum number of iterations; return
-        return data, my_iterations
+    The beam is used to estimate the noise correlation, and thereby the number
+    of independent pixels.
 
+    Returns a tuple (clipped data, unbiased sigma, centre, iterations). If
+    full_output is set, a boolean is appended which is True when the
+    clipping converged, and False when it was cut off at max_iter, when every
+    pixel was clipped or when the data was too small for processing. In the
+    last case, the clipped data is empty and the other values are zero; when
+    every pixel was clipped, the clipped data is empty as well. Otherwise,
+    the values are those of the last iteration performed.
+
+    The data is copied once; all further work is done in two preallocated
+    buffers, rather than in fresh copies for each iteration. With the
+    default centref and distf, the median and variance are calculated in
+    that space as well.
+    """
     # Numpy 1.1 breaks std() for MaskedArray: see
     # <http://www.scipy.org/scipy/numpy/wiki/MaskedArray>.
     # MaskedArray.compressed() returns a 1-D array of non-masked data.
     if isinstance(data, MaskedArray):
         data = data.compressed()
-    centre = centref(data)
-    N = numpy.size(data)
-    N_indep = indep_pixels(N, beam)
-    if N_indep < 1:
-        # This chunk is too small for processing; return an empty array.
-        return numpy.array([]), 0, 0, 0
-
-    # If sigma is callable, use it to dynamically calculate the clipping
-    # limits.
-    if callable(sigma):
-        my_sigma = sigma(N_indep)
-    else:
-        my_sigma = sigma
-
-    # distf=numpy.var is a sample variance with the factor N/(N-1)
-    # already built in, N being the number of pixels. So, we are
-    # going to remove that and replace it by N_indep/(N_indep-1)
-    clipped_var = distf(data) * (N - 1.) * N_indep / (N * (N_indep - 1.))
-    unbiased_var = corr_clip * clipped_var
-
-    # There is an extra factor c4 needed to get a unbiased standard
-    # deviation, unbiased if we disregard clipping bias, see
-    # http://en.wikipedia.org/wiki/Unbiased_estimation_of_standard_deviation\
-    #         #Results_for_the_normal_distribution
-    c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
-    unbiased_std = numpy.sqrt(unbiased_var) / c4
-
-    limit = my_sigma * unbiased_std
-
-    newdata = data.compress(abs(data - centre) <= limit)
-
-    if len(newdata) != len(data) and len(newdata) > 0:
+    data = numpy.ravel(data)
+    if not issubclass(data.dtype.type, numpy.floating):
+        data = data.astype(numpy.float64)
+
+    N = data.size
+    work = data.copy()
+    scratch = numpy.empty_like(work)
+    keep = numpy.empty(N, dtype=numpy.bool)
+    converged = False
+
+    while True:
+        current = work[:N]
+        if centref is numpy.median:
+            centre = _median(current, scratch)
+        else:
+            centre = centref(current)
+        N_indep = indep_pixels(N, beam)
+        if N_indep < 1:
+            # This chunk is too small for processing; return an empty array.
+            result = numpy.array([]), 0, 0, 0
+            break
+
+        # If sigma is callable, use it to dynamically calculate the clipping
+        # limits.
+        if callable(sigma):
+            my_sigma = sigma(N_indep)
+        else:
+            my_sigma = sigma
+
+        if distf is numpy.var:
+            # As numpy.var(), but without allocating a temporary array.
+            deviation = scratch[:N]
+            numpy.subtract(current, current.mean(), out=deviation)
+            numpy.multiply(deviation, deviation, out=deviation)
+            variance = deviation.dtype.type(deviation.sum() / N)
+        else:
+            variance = distf(current)
+
+        # distf=numpy.var is a sample variance with the factor N/(N-1)
+        # already built in, N being the number of pixels. So, we are
+        # going to remove that and replace it by N_indep/(N_indep-1)
+        clipped_var = variance * (N - 1.) * N_indep / (N * (N_indep - 1.))
+        unbiased_var = corr_clip * clipped_var
+
+        # There is an extra factor c4 needed to get a unbiased standard
+        # deviation, unbiased if we disregard clipping bias, see
+        # http://en.wikipedia.org/wiki/Unbiased_estimation_of_standard_deviation\
+        #         #Results_for_the_normal_distribution
+        c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
+        unbiased_std = numpy.sqrt(unbiased_var) / c4
+
+        limit = my_sigma * unbiased_std
+
+        distance = scratch[:N]
+        numpy.subtract(current, centre, out=distance)
+        numpy.absolute(distance, out=distance)
+        numpy.less_equal(distance, limit, out=keep[:N])
+        new_N = int(keep[:N].sum())
+
+        if new_N == N or new_N == 0:
+            converged = new_N == N
+            result = (current[:new_N] if new_N else numpy.array([]),
+                      unbiased_std, centre, my_iterations)
+            break
+
+        # Gather the surviving pixels, in order, at the front of the scratch
+        # buffer, which then becomes the work buffer for the next iteration.
+        numpy.compress(keep[:N], current, out=scratch[:new_N])
+        work, scratch = scratch, work
+        N = new_N
         corr_clip = var_helper(my_sigma)
         my_iterations += 1
-        return sigma_clip(newdata, beam, sigma, max_iter, centref, distf,
-                          my_iterations, corr_clip)
-    else:
-        return newdata, unbiased_std, centre, my_iterations
+
+        if my_iterations >= max_iter:
+            # Exceeded maximum number of iterations; return
+            result = work[:N], unbiased_std, centre, my_iterations
+            break
+
+    if full_output:
+        return result + (converged,)
+    return result
+
+
+def sigma_clip_cells(cells, beam, sigma=unbiased_sigma, max_iter=100):
+    """Iterative clipping of many independent cells at once
+
+    This performs the same median/variance clipping as sigma_clip() with its
+    default centref and distf, but on every row of a 2D array
+    simultaneously, so that the background grid of an image can be
+    calculated without a Python-level loop over its cells.
+
+    Args:
+
+        cells (numpy.ma.MaskedArray): 2D array with one row per cell. Masked
+            pixels do not take part in the clipping; rows may therefore
+            contain different numbers of pixels.
+
+        beam (tuple): beam parameters (semimaj, semimin, theta), used to
+            estimate the noise correlation.
+
+    Kwargs:
+
+        sigma: as for sigma_clip(). A callable is evaluated on an array of
+            numbers of independent pixels, so it must accept arrays.
+
+        max_iter (int): maximum number of clipping iterations. A cell which
+            reaches it is returned as clipped so far, as in sigma_clip().
+
+    Returns:
+
+        tuple of 1D numpy.ndarray, one element per cell: number of pixels
+        surviving the clipping, unbiased sigma, centre (median), mean of the
+        surviving pixels and number of clipping iterations. Cells without
+        data, or too small for processing, have zero surviving pixels.
+    """
+    values = numpy.ma.getdata(cells)
+    valid = ~numpy.ma.getmaskarray(cells)
+    ncells, npix = values.shape
+
+    # Clipping symmetrically about the median always retains a contiguous
+    # range of the sorted pixel values. We therefore sort each cell once,
+    # with the masked pixels at the end, and from then on track every cell
+    # as a window [lo, hi) on its sorted row. Sums over a window follow from
+    # cumulative sums, which we take relative to a reference value per cell
+    # to limit the loss of precision.
+    #
+    # Apart from the per-cell results, only the sorted rows and the two
+    # cumulative sums take memory in proportion to the image: they are
+    # computed in place, and each clipping iteration bisects the windows
+    # rather than testing every pixel of every cell.
+    srt = numpy.where(valid, values, numpy.inf)
+    srt.sort(axis=1)
+    hi = valid.sum(axis=1)
+    lo = numpy.zeros(ncells, dtype=hi.dtype)
+    cells_idx = numpy.arange(ncells)
+    reference = srt[cells_idx, numpy.maximum(hi - 1, 0) // 2]
+    sum1 = numpy.zeros((ncells, npix + 1))
+    sum2 = numpy.zeros((ncells, npix + 1))
+    numpy.subtract(srt, reference[:, numpy.newaxis], out=sum1[:, 1:])
+    sum1[:, 1:][numpy.isinf(srt)] = 0.
+    numpy.multiply(sum1[:, 1:], sum1[:, 1:], out=sum2[:, 1:])
+    numpy.cumsum(sum1[:, 1:], axis=1, out=sum1[:, 1:])
+    numpy.cumsum(sum2[:, 1:], axis=1, out=sum2[:, 1:])
+
+    corr_clip = numpy.ones(ncells)
+    count = numpy.zeros(ncells, dtype=numpy.int)
+    std = numpy.zeros(ncells)
+    centre = numpy.zeros(ncells)
+    mean = numpy.zeros(ncells)
+    iterations = numpy.zeros(ncells, dtype=numpy.int)
+
+    active = hi > 0
+    while active.any():
+        idx = cells_idx[active]
+        my_lo, my_hi = lo[idx], hi[idx]
+        N = my_hi - my_lo
+
+        my_centre = 0.5 * (srt[idx, my_lo + (N - 1) // 2] +
+                           srt[idx, my_lo + N // 2])
+        N_indep = indep_pixels(N, beam)
+        too_small = N_indep < 1
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            # Population variance, as numpy.var() in sigma_clip().
+            my_mean = (sum1[idx, my_hi] - sum1[idx, my_lo]) / N
+            var = (sum2[idx, my_hi] - sum2[idx, my_lo]) / N - my_mean**2
+            var = numpy.maximum(var, 0.)
+
+            if callable(sigma):
+                my_sigma = sigma(N_indep)
+            else:
+                my_sigma = sigma * numpy.ones(len(idx))
+
+            # See sigma_clip() for the origin of these corrections.
+            clipped_var = var * (N - 1.) * N_indep / (N * (N_indep - 1.))
+            unbiased_var = corr_clip[idx] * clipped_var
+            c4 = 1. - 0.25 / N_indep - 0.21875 / N_indep**2
+            unbiased_std = numpy.sqrt(unbiased_var) / c4
+            limit = my_sigma * unbiased_std
+
+        # The same distance test as in sigma_clip(), restricted to the
+        # current window. The rounded distance to the centre is monotonic on
+        # either side of it, so the surviving pixels are a suffix of the lower
+        # half of the window followed by a prefix of the upper half.
+        middle = my_lo + (N + 1) // 2
+
+        def keep(columns):
+            with numpy.errstate(invalid='ignore'):
+                return numpy.absolute(
+                    srt[idx, columns] - my_centre) <= limit
+
+        new_lo = _bisect(keep, my_lo, middle)
+        new_hi = _bisect(lambda columns: ~keep(columns), middle, my_hi)
+        new_N = new_hi - new_lo
+        new_lo = numpy.where(new_N > 0, new_lo, my_lo)
+        new_hi = new_lo + new_N
+
+        clip_again = ((new_N != N) & (new_N > 0) & ~too_small &
+                      (iterations[idx] + 1 < max_iter))
+        again = idx[clip_again]
+        lo[again] = new_lo[clip_again]
+        hi[again] = new_hi[clip_again]
+        corr_clip[again] = var_helper(my_sigma[clip_again])
+        iterations[again] += 1
+
+        done = ~clip_again
+        finished = idx[done]
+        count[finished] = numpy.where(too_small[done], 0, new_N[done])
+        std[finished] = unbiased_std[done]
+        centre[finished] = my_centre[done]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            mean[finished] = reference[finished] + (
+                sum1[finished, new_hi[done]] - sum1[finished, new_lo[done]]
+            ) / new_N[done]
+        active[finished] = False
+
+    return count, std, centre, mean, iterations
+
+
+def _bisect(test, lo, hi):
+    """
+    Per row, the first column in [lo, hi) for which test holds, or hi.
+
+    test takes an array of one column per row and returns a boolean array;
+    within [lo, hi) of each row it must be False up to some column and True
+    from there on.
+    """
+    searching = lo < hi
+    while searching.any():
+        mid = (lo + hi) // 2
+        # Rows which are done keep a valid, if unused, column.
+        passed = test(numpy.where(searching, mid, 0))
+        hi = numpy.where(searching & passed, mid, hi)
+        lo = numpy.where(searching & ~passed, mid + 1, lo)
+        searching = lo < hi
+    return lo
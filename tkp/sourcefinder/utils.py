@@ -2,6 +2,8 @@
 This module contain utilities for the source finding routines
 """
 
+import collections
+import functools
 import numpy
 import math
 import scipy.integrate
@@ -138,6 +140,40 @@ def calculate_beamsize(semimajor, semiminor):
     return numpy.pi * semimajor * semiminor
 
 
+# The number of beams for which the pixel corrections below are remembered.
+# All islands in an image share the same beam, so this need not be large.
+BEAM_CACHE_SIZE = 64
+
+
+def _beam_cache(function):
+    """Remember the results of function for recently used beams
+
+    function is called with the semi-major and semi-minor axes and position
+    angle of a beam. Its results are kept for the BEAM_CACHE_SIZE most
+    recently used beams, so that the numerical integration behind it is done
+    once per image, rather than once per island. The cache (an OrderedDict,
+    least recently used first) is available as the ``cache`` attribute of
+    the returned function.
+    """
+    cache = collections.OrderedDict()
+
+    @functools.wraps(function)
+    def cached(semimajor, semiminor, theta):
+        key = (semimajor, semiminor, theta)
+        try:
+            result = cache.pop(key)
+        except KeyError:
+            result = function(semimajor, semiminor, theta)
+            while len(cache) >= BEAM_CACHE_SIZE:
+                cache.popitem(last=False)
+        cache[key] = result
+        return result
+
+    cached.cache = cache
+    return cached
+
+
+@_beam_cache
 def fudge_max_pix(semimajor, semiminor, theta):
     """Estimate peak flux correction at pixel of maximum flux
 
@@ -175,6 +211,7 @@ def fudge_max_pix(semimajor, semiminor, theta):
     return correction
 
 
+@_beam_cache
 def maximum_pixel_method_variance(semimajor, semiminor, theta):
     """Estimate variance for peak flux at pixel position of maximum
 
@@ -1,7 +1,6 @@
 import logging
 import tkp.accessors
-from tkp.accessors import sourcefinder_image_from_accessor
-import tkp.accessors
+from tkp.steps import source_extraction
 from tkp.db import general as dbgen
 from tkp.db import monitoringlist as dbmon
 from tkp.db import nulldetections as dbnd
@@ -85,18 +84,22 @@ def perform_forced_fits(fit_posns, fit_ids,
     """
     logger.info("Forced fitting in image: %s" % (image_path))
     fitsimage = tkp.accessors.open(image_path)
-
-    data_image = sourcefinder_image_from_accessor(fitsimage,
-                    margin=extraction_params['margin'],
-                    radius=extraction_params['extraction_radius_pix'],
-                    back_size_x=extraction_params['back_size_x'],
-                    back_size_y=extraction_params['back_size_y'])
-
-
-    boxsize = extraction_params['box_in_beampix'] * max(data_image.beam[0],
-                                             data_image.beam[1])
-    successful_fits, successful_ids = data_image.fit_fixed_positions(
+    # With a map cache configured, the background and RMS maps computed for
+    # the blind extraction are read back rather than computed anew.
+    try:
+        data_image = source_extraction.sourcefinder_image(fitsimage,
+                                                          extraction_params)
+
+        cache = source_extraction.map_cache(extraction_params)
+        if cache:
+            cache.log_counts()
+
+        boxsize = extraction_params['box_in_beampix'] * max(data_image.beam[0],
+                                                 data_image.beam[1])
+        successful_fits, successful_ids = data_image.fit_fixed_positions(
                                                 fit_posns, boxsize, ids=fit_ids)
+    finally:
+        fitsimage.close()
     if successful_fits:
         serialized =[
             f.serialize(
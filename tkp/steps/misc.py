@@ -127,3 +127,25 @@ def group_per_timestep(images):
     # and then sort the nested items per freq and stokes
     [l[1].sort(key=lambda x: (x.freq_eff, x.stokes)) for l in grouped_images]
     return grouped_images
+
+
+def group_urls_per_timestep(urls, timestamps):
+    """
+    groups the urls of images per time step, before they are processed.
+
+    Args:
+        urls (list): urls of the images.
+        timestamps (list): the start time of each image, or None for an image
+            which could not be opened; these are left out.
+
+    Returns:
+        list: List of (timestamp, urls) tuples, sorted by timestamp. Per time
+            step, the urls are in the order in which they were given.
+    """
+    timestamp_to_urls_map = defaultdict(list)
+    for url, timestamp in zip(urls, timestamps):
+        if timestamp is None:
+            logger.warn("Skipping %s, which could not be opened" % url)
+            continue
+        timestamp_to_urls_map[timestamp].append(url)
+    return sorted(timestamp_to_urls_map.items())
@@ -0,0 +1,102 @@
+"""
+The persistence, quality and source extraction steps for a single image,
+combined into one node step so that every image is opened and read only once.
+"""
+import logging
+from collections import namedtuple
+
+import tkp.accessors
+from tkp.steps import persistence, quality, source_extraction
+
+
+logger = logging.getLogger(__name__)
+
+#Short-lived struct for returning the results of the node step:
+NodeResults = namedtuple('NodeResults',
+                         ['metadata',
+                          'rejected',
+                          'extraction'])
+
+
+def process_image(image_path, image_cache_config, job_config):
+    """
+    Runs all node steps on an image: it is copied to the image cache, its
+    metadata is extracted, it is quality checked and, if accepted, the
+    sources in it are extracted.
+
+    NOTE: should only be used on a NODE
+
+    args:
+        image_path: path to image
+        image_cache_config: image cache configuration, see
+            `tkp.steps.persistence.node_steps`
+        job_config: job configuration, with the persistence, quality and
+            source extraction parameters.
+    returns:
+        NodeResults named tuple of the metadata, the rejection tuple (None if
+        accepted) and the ExtractionResults (None if rejected), or False if
+        the image could not be opened.
+    """
+    accessor = _open_image(image_path, image_cache_config)
+    if not accessor:
+        return False
+    try:
+        results = _inspect_accessor(accessor, job_config)
+        if results.rejected:
+            return results
+        extraction = _extract_accessor(accessor, job_config.source_extraction)
+    finally:
+        accessor.close()
+    return results._replace(extraction=extraction)
+
+
+def image_timestamp(image_path):
+    """
+    Reads the start time of an image, so that the images can be grouped per
+    timestep before they are processed. Only the header of the image is
+    read.
+
+    NOTE: should only be used on a NODE
+
+    returns:
+        the taustart_ts of the image, or None if the image could not be
+        opened.
+    """
+    try:
+        accessor = tkp.accessors.open(image_path)
+    except TypeError as e:
+        logger.error("Can't open image %s: %s" % (image_path, e))
+        return None
+    accessor.close()
+    return accessor.taustart_ts
+
+
+def _open_image(image_path, image_cache_config):
+    """Copies an image to the image cache and opens it, or returns False."""
+    persistence.copy_to_image_cache([image_path], image_cache_config)
+
+    logger.info("Extracting metadata from %s" % image_path)
+    try:
+        return tkp.accessors.open(image_path)
+    except TypeError as e:
+        logger.error("Can't open image %s: %s" % (image_path, e))
+        return False
+
+
+def _inspect_accessor(accessor, job_config):
+    """Extracts the metadata of an image and quality checks it."""
+    metadata = persistence.extract_metadata(
+        accessor, job_config.persistence.rms_est_sigma,
+        job_config.persistence.rms_est_fraction)
+
+    rejected = quality.reject_check_accessor(accessor, job_config,
+                                             metadata['rms_qc'])
+    return NodeResults(metadata=metadata, rejected=rejected or None,
+                       extraction=None)
+
+
+def _extract_accessor(accessor, extraction_params):
+    """Extracts the sources of an image which is already opened."""
+    logger.info("Extracting image: %s" % accessor.url)
+    return source_extraction.extract_sources_from_accessor(accessor,
+                                                           extraction_params)
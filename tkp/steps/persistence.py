@@ -12,7 +12,6 @@ from pyrap.images import image as pyrap_image
 import tkp.accessors
 from tkp.db.database import Database
 from tkp.db.orm import DataSet, Image
-from tkp.quality.statistics import rms_with_clipped_subregion
 
 
 logger = logging.getLogger(__name__)
@@ -103,13 +102,32 @@ def extract_metadatas(images, rms_est_sigma, rms_est_fraction):
             logging.error("Can't open image %s: %s" % (image, e))
             results.append(False)
         else:
-            metadata = accessor.extract_metadata()
-            metadata['rms_qc'] = rms_with_clipped_subregion(accessor.data,
-                                                rms_est_sigma,rms_est_fraction)
-            results.append(metadata)
+            try:
+                results.append(extract_metadata(accessor, rms_est_sigma,
+                                                rms_est_fraction))
+            finally:
+                accessor.close()
     return results
 
 
+def extract_metadata(accessor, rms_est_sigma, rms_est_fraction):
+    """
+    Extracts metadata and the rms_qc value from an opened image.
+
+    Args:
+        accessor: accessor of the image
+        rms_est_sigma: used for RMS calculation, see `tkp.quality.statistics`
+        rms_est_fraction: used for RMS calculation, see `tkp.quality.statistics`
+
+    Returns:
+        the metadata, a dict
+    """
+    metadata = accessor.extract_metadata()
+    metadata['rms_qc'] = accessor.rms_with_clipped_subregion(
+        rms_est_sigma, rms_est_fraction)
+    return metadata
+
+
 def store_images(images_metadata, extraction_radius_pix, dataset_id):
     """ Add images to database.
     Note that all images in one dataset should be inserted in one go, since the
@@ -143,9 +161,9 @@ def store_images(images_metadata, extraction_radius_pix, dataset_id):
     return image_ids
 
 
-def node_steps(images, image_cache_config, rms_est_sigma, rms_est_fraction):
+def copy_to_image_cache(images, image_cache_config):
     """
-    this function executes all persistence steps that should be executed on a node.
+    Copies the images to mongodb, if the image cache config asks for it.
     Note: Should only be used in a node recipe
     """
     mongohost = image_cache_config['mongo_host']
@@ -159,5 +177,12 @@ def node_steps(images, image_cache_config, rms_est_sigma, rms_est_fraction):
     else:
         logger.info("Not copying images to mongodb")
 
+
+def node_steps(images, image_cache_config, rms_est_sigma, rms_est_fraction):
+    """
+    this function executes all persistence steps that should be executed on a node.
+    Note: Should only be used in a node recipe
+    """
+    copy_to_image_cache(images, image_cache_config)
     metadatas = extract_metadatas(images, rms_est_sigma, rms_est_fraction)
     return metadatas
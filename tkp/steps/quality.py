@@ -14,7 +14,7 @@ import tkp.quality
 logger = logging.getLogger(__name__)
 
 
-def reject_check(image_path, job_config):
+def reject_check(image_path, job_config, rms_qc=None):
     """ checks if an image passes the quality check. If not, a rejection
         tuple is returned.
 
@@ -25,20 +25,41 @@ def reject_check(image_path, job_config):
             distributed computation!
         image_path: path to image
         parset_file: parset file location with quality check parameters
+        rms_qc: RMS of the image as stored by the persistence step, if
+            known. Otherwise, it is calculated from the image.
     Returns:
         (rejection ID, description) if rejected, else None
     """
 
     accessor = tkp.accessors.open(image_path)
+    try:
+        return reject_check_accessor(accessor, job_config, rms_qc)
+    finally:
+        accessor.close()
+
+
+def reject_check_accessor(accessor, job_config, rms_qc=None):
+    """ checks if an image, which is already opened, passes the quality
+        check. See `reject_check`.
+
+    NOTE: should only be used on a NODE
+
+    args:
+        accessor: accessor of the image
+        job_config: job configuration with quality check parameters
+        rms_qc: RMS of the image, if known.
+    Returns:
+        (rejection ID, description) if rejected, else None
+    """
     # Only run LOFAR-specific QC checks on LOFAR images.
     if isinstance(accessor, LofarAccessor):
         return reject_check_lofar(
-            accessor, job_config
+            accessor, job_config, rms_qc
         )
     else:
         logger.warn(
             "Unrecognised telescope %s for file %s, no quality checks.",
-            accessor.telescope, image_path
+            accessor.telescope, accessor.url
         )
         return None
 
@@ -2,6 +2,8 @@ import logging
 import tkp.accessors
 from tkp.accessors import sourcefinder_image_from_accessor
 import tkp.accessors
+from tkp.utility.containers import ColumnarExtractionResults
+from tkp.sourcefinder.mapcache import MapCache
 from collections import namedtuple
 
 logger = logging.getLogger(__name__)
@@ -12,6 +14,52 @@ ExtractionResults = namedtuple('ExtractionResults',
                                     'rms_min',
                                     'rms_max'])
 
+# map cache directory -> MapCache, for this process.
+_map_caches = {}
+
+
+def _image_params(extraction_params):
+    """The extraction parameters which determine the sourcefinder image."""
+    return (extraction_params['margin'],
+            extraction_params['extraction_radius_pix'],
+            extraction_params['back_size_x'],
+            extraction_params['back_size_y'],
+            extraction_params.get('dtype', 'float64'))
+
+
+def map_cache(extraction_params):
+    """
+    Returns the on-disk cache of background and RMS maps set up by the
+    extraction parameters, or None if there is none.
+    """
+    directory = extraction_params.get('map_cache_dir')
+    if not directory:
+        return None
+    if directory not in _map_caches:
+        max_bytes = int(extraction_params.get('map_cache_size', 1024) * 2**20)
+        _map_caches[directory] = MapCache(directory, max_bytes)
+    return _map_caches[directory]
+
+
+def sourcefinder_image(accessor, extraction_params):
+    """
+    Create the sourcefinder image for an accessor with the given extraction
+    parameters.
+    """
+    cache = map_cache(extraction_params)
+    if cache:
+        image_maps = cache.image(accessor.url,
+                                 _image_params(extraction_params))
+    else:
+        image_maps = None
+    return sourcefinder_image_from_accessor(accessor,
+                    margin=extraction_params['margin'],
+                    radius=extraction_params['extraction_radius_pix'],
+                    back_size_x=extraction_params['back_size_x'],
+                    back_size_y=extraction_params['back_size_y'],
+                    dtype=extraction_params.get('dtype', 'float64'),
+                    map_cache=image_maps)
+
 
 def extract_sources(image_path, extraction_params):
     """
@@ -23,18 +71,31 @@ def extract_sources(image_path, extraction_params):
             analysis threshold and the association radius, the last one a
             multiplication factor of the de Ruiter radius.
     returns:
-        list of ExtractionResults named tuples containing source measurements,
-        min RMS value and max RMS value
+        ExtractionResults named tuple containing the source measurements, as
+        a ColumnarExtractionResults, and the min and max RMS value
     """
     logger.info("Extracting image: %s" % image_path)
     accessor = tkp.accessors.open(image_path)
+    try:
+        return extract_sources_from_accessor(accessor, extraction_params)
+    finally:
+        accessor.close()
+
+
+def extract_sources_from_accessor(accessor, extraction_params):
+    """
+    Extract sources from an image which is already opened.
+
+    args:
+        accessor: accessor of the image.
+        extraction_params: see `extract_sources`.
+    returns:
+        ExtractionResults, see `extract_sources`.
+    """
+    image_path = accessor.url
     logger.debug("Detecting sources in image %s at detection threshold %s",
                  image_path, extraction_params['detection_threshold'])
-    data_image = sourcefinder_image_from_accessor(accessor,
-                    margin=extraction_params['margin'],
-                    radius=extraction_params['extraction_radius_pix'],
-                    back_size_x=extraction_params['back_size_x'],
-                    back_size_y=extraction_params['back_size_y'])
+    data_image = sourcefinder_image(accessor, extraction_params)
 
     logger.debug("Employing margin: %s extraction radius: %s deblend_nthresh: %s",
                  extraction_params['margin'],
@@ -47,17 +108,23 @@ def extract_sources(image_path, extraction_params):
         det=extraction_params['detection_threshold'],
         anl=extraction_params['analysis_threshold'],
         deblend_nthresh=extraction_params['deblend_nthresh'],
-        force_beam=extraction_params['force_beam']
+        force_beam=extraction_params['force_beam'],
+        workers=extraction_params.get('fit_workers', 1)
     )
     logger.info("Detected %d sources in image %s" % (len(results), image_path))
 
     ew_sys_err = extraction_params['ew_sys_err']
     ns_sys_err = extraction_params['ns_sys_err']
-    serialized = [r.serialize(ew_sys_err, ns_sys_err) for r in results]
-    return ExtractionResults(sources=serialized,
+    # Columnar results pickle as a single buffer, so are cheap to return
+    # from a worker process. Iterating over them gives the serialized rows.
+    sources = ColumnarExtractionResults.from_detections(results, ew_sys_err,
+                                                        ns_sys_err)
+    cache = map_cache(extraction_params)
+    if cache:
+        cache.log_counts()
+    extraction_results = ExtractionResults(
+                             sources=sources,
                              rms_min=float(data_image.rmsmap.min()),
                              rms_max=float(data_image.rmsmap.max())
                              )
-
-
-
+    return extraction_results
@@ -3,14 +3,19 @@ import tkp.db
 import tkp.quality
 from tkp.quality.restoringbeam import beam_invalid
 from tkp.quality.rms import rms_invalid
-from tkp.quality.statistics import rms_with_clipped_subregion
 from tkp.telescope.lofar.noise import noise_level
 from tkp.utility import nice_format
 
 logger = logging.getLogger(__name__)
 
 
-def reject_check_lofar(accessor, job_config):
+def reject_check_lofar(accessor, job_config, rms_qc=None):
+    """
+    LOFAR specific quality checks of an image.
+
+    rms_qc is the RMS of the image used for quality control, as calculated
+    by the persistence step; it is only calculated anew if it is not given.
+    """
 
     lofar_quality_params = job_config['quality_lofar']
 
@@ -24,11 +29,11 @@ def reject_check_lofar(accessor, job_config):
         logger.info("image %s REJECTED: tau_time is 0, should be > 0" % accessor.url)
         return tkp.db.quality.reason['tau_time'], "tau_time is 0"
 
-    rms_est_sigma = job_config.persistence.rms_est_sigma
-    rms_est_fraction = job_config.persistence.rms_est_fraction
-    rms_qc = rms_with_clipped_subregion(accessor.data,
-                                        rms_est_sigma=rms_est_sigma,
-                                        rms_est_fraction=rms_est_fraction)
+    if rms_qc is None:
+        rms_est_sigma = job_config.persistence.rms_est_sigma
+        rms_est_fraction = job_config.persistence.rms_est_fraction
+        rms_qc = accessor.rms_with_clipped_subregion(
+            rms_est_sigma=rms_est_sigma, rms_est_fraction=rms_est_fraction)
 
     noise = noise_level(accessor.freq_eff, accessor.freq_bw, accessor.tau_time,
         accessor.antenna_set, accessor.ncore, accessor.nremote, accessor.nintl
@@ -6,6 +6,7 @@ lightcurves, detections, sources, etc -- that the pipeline must handle.
 """
 
 import logging
+import numpy
 logger = logging.getLogger(__name__)
 
 class ObjectContainer(list):
@@ -83,3 +84,105 @@ class ExtractionResults(ObjectContainer):
 
     def __str__(self):
         return 'ExtractionResults: ' + str(len(self)) + ' detection(s).'
+
+
+class ColumnarExtractionResults(object):
+    """Source extraction results of an image, stored column by column.
+
+    Rather than a list of Detection objects, this holds the measured
+    quantities of all the sources in a single numpy structured array, with
+    a value and an error column for each of the uncertain quantities. The
+    results serialize to the same rows as Detection.serialize(), and pickle
+    as a single buffer, which makes them cheap to pass between processes.
+
+    Iterating over the results gives the serialized rows, so they can be
+    passed to tkp.db.general.insert_extracted_sources() as they are.
+    """
+    dtype = numpy.dtype([
+        ('ra', numpy.float64),
+        ('dec', numpy.float64),
+        ('ra_err', numpy.float64),
+        ('dec_err', numpy.float64),
+        ('peak', numpy.float64),
+        ('peak_err', numpy.float64),
+        ('flux', numpy.float64),
+        ('flux_err', numpy.float64),
+        ('sig', numpy.float64),
+        ('smaj_asec', numpy.float64),
+        ('smin_asec', numpy.float64),
+        ('theta_celes', numpy.float64),
+        ('ew_sys_err', numpy.float64),
+        ('ns_sys_err', numpy.float64),
+        ('error_radius', numpy.float64),
+        ('gaussian', numpy.bool_),
+        ('chisq', numpy.float64),
+        ('reduced_chisq', numpy.float64),
+        ('smaj_asec_err', numpy.float64),
+        ('smin_asec_err', numpy.float64),
+        ('theta_celes_err', numpy.float64),
+        ('x', numpy.float64),
+        ('x_err', numpy.float64),
+        ('y', numpy.float64),
+        ('y_err', numpy.float64),
+    ])
+
+    # The columns of a serialized row, in order; see Detection.serialize().
+    serialized_columns = dtype.names[:18]
+
+    def __init__(self, data=None):
+        if data is None:
+            data = numpy.empty(0, dtype=self.dtype)
+        self.data = data
+
+    @classmethod
+    def from_detections(cls, detections, ew_sys_err=0., ns_sys_err=0.):
+        """Collect a list of Detection objects.
+
+        ew_sys_err and ns_sys_err are the systematic position errors, as
+        passed to Detection.serialize().
+        """
+        rows = [
+            (det.ra.value, det.dec.value, det.ra.error, det.dec.error,
+             det.peak.value, det.peak.error, det.flux.value, det.flux.error,
+             det.sig, det.smaj_asec.value, det.smin_asec.value,
+             det.theta_celes.value, ew_sys_err, ns_sys_err,
+             det.error_radius, det.gaussian,
+             # Only Gaussian fits have a chi-squared; NaN stands for None.
+             numpy.nan if det.chisq is None else det.chisq,
+             numpy.nan if det.reduced_chisq is None else det.reduced_chisq,
+             det.smaj_asec.error, det.smin_asec.error, det.theta_celes.error,
+             det.x.value, det.x.error, det.y.value, det.y.error)
+            for det in detections
+        ]
+        return cls(numpy.array(rows, dtype=cls.dtype))
+
+    def serialize(self):
+        """
+        Return the source properties suitable for database storage.
+
+        returns: a list with a list of 18 values for each source, as
+        Detection.serialize().
+        """
+        rows = [list(row) for row in
+                self.data[list(self.serialized_columns)].tolist()]
+        for index in numpy.isnan(self.data['chisq']).nonzero()[0]:
+            rows[index][16] = None
+        for index in numpy.isnan(self.data['reduced_chisq']).nonzero()[0]:
+            rows[index][17] = None
+        return rows
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.serialize())
+
+    def __getstate__(self):
+        # Wrapped in a tuple: pickle skips __setstate__ for an empty state.
+        return (self.data.tostring(),)
+
+    def __setstate__(self, state):
+        self.data = numpy.fromstring(state[0], dtype=self.dtype)
+
+    def __str__(self):
+        return 'ExtractionResults: ' + str(len(self)) + ' detection(s).'
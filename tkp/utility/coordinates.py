@@ -6,6 +6,7 @@ General purpose astronomical coordinate handling routines.
 
 import sys
 import math
+import numpy
 import pywcs
 import logging
 import datetime
@@ -683,3 +684,64 @@ class WCS(object):
         if math.isnan(x) or math.isnan(y):
             raise RuntimeError("Pixel position is not a number")
         return x, y
+
+    def p2s_many(self, pixpos):
+        """
+        Pixel to Spatial coordinate conversion for many positions at once.
+
+        Args:
+            pixpos (array-like): [x, y] pixel positions, of shape (N, 2)
+
+        Returns:
+            ra (numpy.ndarray):  Right ascensions corresponding to pixpos
+            dec (numpy.ndarray): Declinations corresponding to pixpos
+
+        Rather than raising an error, both ra and dec are NaN for positions
+        which can not be converted.
+        """
+        return self._convert_many(self.wcs.wcs_pix2sky, pixpos)
+
+    def s2p_many(self, spatialpos):
+        """
+        Spatial to Pixel coordinate conversion for many positions at once.
+
+        Args:
+            spatialpos (array-like): [ra, dec] spatial positions, of shape
+                (N, 2)
+
+        Returns:
+            x (numpy.ndarray): X pixel values corresponding to spatialpos
+            y (numpy.ndarray): Y pixel values corresponding to spatialpos
+
+        Rather than raising an error, both x and y are NaN for positions
+        which can not be converted.
+        """
+        return self._convert_many(self.wcs.wcs_sky2pix, spatialpos)
+
+    def _convert_many(self, conversion, positions):
+        """
+        Apply a pywcs conversion to an (N, 2) array of positions.
+
+        pywcs refuses to convert the whole array if any of the positions is
+        invalid; in that case, they are converted one by one, and the invalid
+        ones are set to NaN.
+        """
+        positions = numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 2)
+        if not len(positions):
+            return numpy.array([]), numpy.array([])
+        try:
+            first, second = conversion(positions[:, 0], positions[:, 1],
+                                       self.ORIGIN)
+        except RuntimeError:
+            first = numpy.empty(len(positions))
+            second = numpy.empty(len(positions))
+            for i, position in enumerate(positions):
+                try:
+                    [first[i]], [second[i]] = conversion(
+                        position[0:1], position[1:2], self.ORIGIN)
+                except RuntimeError:
+                    first[i] = second[i] = numpy.nan
+        invalid = numpy.isnan(first) | numpy.isnan(second)
+        first[invalid] = numpy.nan
+        second[invalid] = numpy.nan
+        return first, second
@@ -0,0 +1,225 @@
+"""
+HEALPix pixel numbers in the nested scheme, for indexing positions on the sky.
+
+The extractedsource, runningcatalog and skyregion tables hold the pixel, at
+:data:`ORDER`, of each position. In the nested scheme the descendants of a
+pixel at a lower order form a contiguous range of pixel numbers, so that the
+sources near a position are found with a few range conditions on an indexed
+integer column: see :func:`disc_ranges`.
+
+The pixel numbers are those of the HEALPix library (Gorski et al. 2005,
+ApJ 622, 759); the ``hpxNest`` database function calculates them in the same
+way.
+"""
+
+import math
+import numpy
+
+
+# The order of the pixels stored in the database. The pixels are about 0.86
+# arcmin across.
+ORDER = 12
+
+# The centre of a pixel at order k is no further than MAX_PIXRAD / 2**k
+# radians from any point of the pixel.
+MAX_PIXRAD = 1.1
+
+# For every base pixel: the ring number (in units of nside) of its
+# southernmost corner, and the longitude (in units of pi / 4) of its centre.
+_JRLL = numpy.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+_JPLL = numpy.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7])
+
+
+def npix(order):
+    """The number of pixels on the sphere at order."""
+    return 12 << (2 * order)
+
+
+def _spread_bits(v, order):
+    """Moves bit k of v to bit 2 k."""
+    result = numpy.zeros_like(v)
+    for bit in range(order):
+        result |= ((v >> bit) & 1) << (2 * bit)
+    return result
+
+
+def _compress_bits(v, order):
+    """Moves bit 2 k of v to bit k."""
+    result = numpy.zeros_like(v)
+    for bit in range(order):
+        result |= ((v >> (2 * bit)) & 1) << bit
+    return result
+
+
+def xyz2nest(x, y, z, order=ORDER):
+    """
+    Returns the nested pixel numbers of unit vectors.
+
+    Args:
+        x, y, z: cartesian co-ordinates of positions on the unit sphere, as
+            stored in the database.
+        order (int): the order of the pixels, nside = 2**order.
+
+    Returns:
+        numpy array of int64 pixel numbers, or a single pixel number for a
+        single position.
+    """
+    scalar = all(numpy.ndim(c) == 0 for c in (x, y, z))
+    x, y, z = numpy.broadcast_arrays(
+        *[numpy.atleast_1d(numpy.asarray(c, dtype=numpy.float64))
+          for c in (x, y, z)])
+    nside = 1 << order
+    za = numpy.abs(z)
+    tt = numpy.mod(numpy.arctan2(y, x) / (math.pi / 2), 4.0)
+    tt[tt >= 4] = 0
+
+    # Equatorial region.
+    temp1 = nside * (0.5 + tt)
+    temp2 = nside * z * 0.75
+    jp = numpy.floor(temp1 - temp2).astype(numpy.int64)
+    jm = numpy.floor(temp1 + temp2).astype(numpy.int64)
+    ifp = jp >> order
+    ifm = jm >> order
+    face = numpy.where(ifp == ifm, ifp | 4,
+                       numpy.where(ifp < ifm, ifp, ifm + 8))
+    ix = jm & (nside - 1)
+    iy = nside - (jp & (nside - 1)) - 1
+
+    # Polar caps. 1 - |z| is calculated from x and y, which is accurate
+    # close to the poles.
+    polar = za > 2. / 3
+    if polar.any():
+        ntt = numpy.minimum(tt[polar].astype(numpy.int64), 3)
+        tp = tt[polar] - ntt
+        s_sq = x[polar] ** 2 + y[polar] ** 2
+        tmp = nside * numpy.sqrt(3 * s_sq / (1 + za[polar]))
+        jp = numpy.minimum(numpy.floor(tp * tmp).astype(numpy.int64),
+                           nside - 1)
+        jm = numpy.minimum(numpy.floor((1 - tp) * tmp).astype(numpy.int64),
+                           nside - 1)
+        north = z[polar] >= 0
+        face[polar] = numpy.where(north, ntt, ntt + 8)
+        ix[polar] = numpy.where(north, nside - jm - 1, jp)
+        iy[polar] = numpy.where(north, nside - jp - 1, jm)
+
+    pix = ((face << (2 * order)) + _spread_bits(ix, order) +
+           (_spread_bits(iy, order) << 1))
+    if scalar:
+        return pix[0]
+    return pix
+
+
+def radec2nest(ra, decl, order=ORDER):
+    """Returns the nested pixel numbers of positions in degrees."""
+    ra = numpy.radians(ra)
+    decl = numpy.radians(decl)
+    return xyz2nest(numpy.cos(decl) * numpy.cos(ra),
+                    numpy.cos(decl) * numpy.sin(ra),
+                    numpy.sin(decl), order)
+
+
+def nest2xyz(pix, order=ORDER):
+    """
+    Returns the unit vectors of the centres of nested pixels.
+
+    Returns:
+        tuple of numpy arrays (x, y, z).
+    """
+    pix = numpy.asarray(pix, dtype=numpy.int64)
+    nside = 1 << order
+    face = pix >> (2 * order)
+    ix = _compress_bits(pix, order)
+    iy = _compress_bits(pix >> 1, order)
+    jr = _JRLL[face] * nside - ix - iy - 1
+
+    nr = numpy.where(jr < nside, jr,
+                     numpy.where(jr > 3 * nside, 4 * nside - jr, nside))
+    tmp = nr.astype(numpy.float64) ** 2 / (3. * nside * nside)
+    z = numpy.where(jr < nside, 1 - tmp,
+                    numpy.where(jr > 3 * nside, tmp - 1,
+                                (2 * nside - jr) * (2. / (3 * nside))))
+    # sin(theta), accurately also close to the poles.
+    sin_theta = numpy.where((jr < nside) | (jr > 3 * nside),
+                            numpy.sqrt(tmp * (2 - tmp)),
+                            numpy.sqrt(numpy.maximum(1 - z * z, 0)))
+    kshift = numpy.where((jr < nside) | (jr > 3 * nside), 0,
+                         (jr - nside) & 1)
+    jp = (_JPLL[face] * nr + ix - iy + 1 + kshift) // 2
+    jp = numpy.where(jp > 4 * nside, jp - 4 * nside, jp)
+    jp = numpy.where(jp < 1, jp + 4 * nside, jp)
+    phi = (jp - (kshift + 1) * 0.5) * (math.pi / 2 / nr)
+    return sin_theta * numpy.cos(phi), sin_theta * numpy.sin(phi), z
+
+
+def disc_ranges(x, y, z, radius, order=ORDER, max_ranges=256):
+    """
+    Returns ranges of nested pixels which together cover a disc.
+
+    The disc is covered with the pixels of the lowest order at which they
+    are smaller than the disc, down to the pixels which are entirely inside
+    it, and each of those is replaced by the range of its descendants at
+    order. The cover is conservative: it always contains the whole disc, but
+    may contain more.
+
+    Args:
+        x, y, z (float): unit vector of the centre of the disc.
+        radius (float): radius of the disc in degrees.
+        order (int): the order of the pixel numbers in the ranges.
+        max_ranges (int): the refinement stops before the cover would
+            consist of more than about this number of pixels.
+
+    Returns:
+        numpy array of shape (n, 2), holding the first and last pixel
+        number of each range. Adjacent ranges are merged.
+    """
+    radius = math.radians(radius)
+    if radius >= math.pi:
+        return numpy.array([[0, npix(order) - 1]], dtype=numpy.int64)
+
+    centre = numpy.array([x, y, z], dtype=numpy.float64)
+    candidates = numpy.arange(12, dtype=numpy.int64)
+    covered = []  # (pixel, its order)
+    level = 0
+    while len(candidates):
+        cx, cy, cz = nest2xyz(candidates, level)
+        cosine = numpy.clip(cx * centre[0] + cy * centre[1] + cz * centre[2],
+                            -1, 1)
+        distance = numpy.arccos(cosine)
+        pixrad = MAX_PIXRAD / (1 << level)
+        touching = distance < radius + pixrad
+        inside = distance + pixrad <= radius
+        partial = candidates[touching & ~inside]
+        covered.append((candidates[inside], level))
+        if level == order or 4 * len(partial) > max_ranges:
+            covered.append((partial, level))
+            break
+        candidates = ((partial << 2)[:, numpy.newaxis] +
+                      numpy.arange(4)).ravel()
+        level += 1
+
+    ranges = []
+    for pixels, level in covered:
+        shift = 2 * (order - level)
+        ranges.extend(zip(pixels << shift, ((pixels + 1) << shift) - 1))
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges):
+    """
+    Merges overlapping and adjacent ranges of pixels.
+
+    Args:
+        ranges: sequence of (first, last) pixel numbers, in any order, such
+            as the concatenated results of :func:`disc_ranges` for several
+            discs.
+
+    Returns:
+        numpy array of shape (n, 2) of disjoint ranges, in increasing order.
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return numpy.array(merged, dtype=numpy.int64).reshape(-1, 2)